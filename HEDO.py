@@ -4,9 +4,8 @@
 Skydio HTTP Client
 v0.2
 Communicate with a vehicle using HTTP apis.
-"""
 
-"""NOTE (8/17/2020): Many parts of this code (like the SecurityBot or Panorama commands) are dependent on the Skydio 
+NOTE (8/17/2020): Many parts of this code (like the SecurityBot or Panorama commands) are dependent on the Skydio 
 SDK, which is no longer supported. However, this script will allow you to takeoff and land, and will utilize the 
 drone's object avoidance capabilities if anything gets too close. 
 
@@ -17,38 +16,475 @@ computer, then run the script (pairing the gloves interferes with the connection
 from __future__ import absolute_import
 from __future__ import print_function
 
+import atexit
 import base64
+import heapq
+import itertools
 import json
+import multiprocessing
 import os
+import random
 import requests
+import signal
+import socket
+import struct
 import sys
 import threading
 import time
-import serial
 import numpy as np
+from bisect import bisect_left
+from collections import Counter, deque, namedtuple
+from concurrent.futures import Future, ThreadPoolExecutor, wait, FIRST_COMPLETED
 from uuid import uuid4
 
-from dataglove import *
+try:
+    from dataglove import *
+except (ImportError, OSError):
+    # The Bebop SDK is Windows only. Without it only the simulated glove driver works.
+    class GloveDisconnectedException(Exception):
+        pass
 from time import *
 
 try:
     # Python 3
+    from http.server import BaseHTTPRequestHandler, HTTPServer
+    from queue import Empty
+    from threading import get_ident
     from urllib.parse import urlparse
 except ImportError:
     # Python 2
+    from BaseHTTPServer import BaseHTTPRequestHandler, HTTPServer
+    from Queue import Empty
+    from thread import get_ident
     from urlparse import urlparse
 
+# Optional faster JSON backends for vehicle responses. simdjson parses lazily, so only the fields a
+# caller asks for are turned into Python objects.
+try:
+    import simdjson
+except ImportError:
+    simdjson = None
+try:
+    import orjson
+except ImportError:
+    orjson = None
+
+
+class EventLog(object):
+    """
+    Log records are queued by the caller and formatted and written by a background thread, so a
+    slow terminal or pipe never blocks the glove or heartbeat loops.
+    A record is (timestamp, level, event, args, fields), where event is the format string. When the
+    queue is full records are dropped and counted rather than waited for, and the terminal output
+    is rate limited. Every record can also be written to a JSON lines stream for later analysis.
+    Args:
+        capacity (int): maximum number of queued records.
+        max_rate (int): maximum records written to the terminal per second.
+        interval (float): seconds between writes.
+        json_stream (file): optional stream for JSON lines output.
+    """
+
+    def __init__(self, capacity=10000, max_rate=500, interval=0.02, json_stream=None):
+        self.capacity = capacity
+        self.max_rate = max_rate
+        self.interval = interval
+        self.json_stream = json_stream
+        self.dropped = 0
+        self.rate_limited = 0
+        # deque appends and pops are atomic, producers never take a lock.
+        self._records = deque()
+        self._reported = (0, 0)
+        self._window = (0, 0)
+        self._drain_lock = threading.Lock()
+        self._start()
+        if hasattr(os, 'register_at_fork'):
+            # A forked child, like the glove process in process_mode, gets no copy of the writer thread.
+            os.register_at_fork(after_in_child=self._start_in_child)
+
+    def _start(self):
+        self._thread = threading.Thread(target=self._run)
+        self._thread.daemon = True
+        self._thread.start()
+
+    def _start_in_child(self):
+        # Records queued before the fork are the parent's to write, and its writer may have held the lock.
+        self._records = deque()
+        self._drain_lock = threading.Lock()
+        self._start()
+
+    def log(self, level, event, args=(), fields=None):
+        """ Queue a record. Never blocks. """
+        if len(self._records) >= self.capacity:
+            self.dropped += 1
+            return
+        self._records.append((time(), level, event, args, fields))
+
+    def flush(self):
+        """ Write everything queued so far. """
+        self._drain()
+
+    def _run(self):
+        while True:
+            sleep(self.interval)
+            self._drain()
+
+    def _drain(self):
+        with self._drain_lock:
+            out = []
+            err = []
+            lines = []
+            second, written = self._window
+            while self._records:
+                stamp, level, event, args, fields = self._records.popleft()
+                try:
+                    text = event.format(*args, **(fields or {}))
+                except (IndexError, KeyError, ValueError) as error:
+                    text = '{} {!r} {!r} ({})\n'.format(event, args, fields, error)
+                if self.json_stream is not None:
+                    lines.append(json.dumps({'t': stamp, 'level': level, 'event': event,
+                                             'msg': text.rstrip('\n'), 'fields': fields or None},
+                                            default=str))
+                if int(stamp) != second:
+                    second, written = int(stamp), 0
+                if written >= self.max_rate:
+                    self.rate_limited += 1
+                    continue
+                written += 1
+                (err if level == 'error' else out).append(text)
+            self._window = (second, written)
+
+            if (self.dropped, self.rate_limited) != self._reported:
+                err.append('[log] {} records dropped, {} rate limited so far\n'.format(
+                    self.dropped, self.rate_limited))
+                self._reported = (self.dropped, self.rate_limited)
+            for stream, chunks in ((sys.stdout, out), (sys.stderr, err)):
+                if chunks:
+                    stream.write(''.join(chunks))
+                    stream.flush()
+            if lines:
+                self.json_stream.write('\n'.join(lines) + '\n')
+                self.json_stream.flush()
+
+
+LOG = EventLog()
+atexit.register(LOG.flush)
+
 
 def fmt_out(fmt, *args, **kwargs):
-    """ Helper for printing formatted text to stdout. """
-    sys.stdout.write(fmt.format(*args, **kwargs))
-    sys.stdout.flush()
+    """ Helper for printing formatted text to stdout. Queued, see EventLog. """
+    LOG.log('info', fmt, args, kwargs)
 
 
 def fmt_err(fmt, *args, **kwargs):
-    """ Helper for printing formatted text to stderr. """
-    sys.stderr.write(fmt.format(*args, **kwargs))
-    sys.stderr.flush()
+    """ Helper for printing formatted text to stderr. Queued, see EventLog. """
+    LOG.log('error', fmt, args, kwargs)
+
+
+# Histogram bucket upper bounds in seconds: 1us to 100s, six buckets per decade.
+LATENCY_BUCKETS = tuple(float('{}e{}'.format(m, e)) for e in range(-6, 2) for m in (1, 1.5, 2, 3, 5, 7)) + (100.0,)
+
+
+class Histogram(object):
+    """
+    Fixed-bucket latency histogram. record() is a bisect and two additions with no lock, so it can
+    sit in the glove loop. Two threads recording at the same instant can lose a count, which is
+    fine for metrics.
+    """
+
+    def __init__(self, bounds=LATENCY_BUCKETS):
+        self.bounds = bounds
+        # The last bucket counts values above every bound.
+        self.counts = [0] * (len(bounds) + 1)
+        self.sum = 0.0
+
+    def record(self, value):
+        self.counts[bisect_left(self.bounds, value)] += 1
+        self.sum += value
+
+    @property
+    def count(self):
+        return sum(self.counts)
+
+    def percentile(self, pct):
+        """ Upper bound of the bucket holding the pct percentile, or None if nothing was recorded. """
+        counts = list(self.counts)
+        rank = sum(counts) * pct / 100.0
+        seen = 0
+        for bound, count in zip(self.bounds + (float('inf'),), counts):
+            seen += count
+            if count and seen >= rank:
+                return bound
+        return None
+
+
+class MetricCounter(object):
+    """ Monotonic counter. Same lock-free caveat as Histogram. """
+
+    def __init__(self):
+        self.value = 0
+
+    def inc(self, amount=1):
+        self.value += amount
+
+
+class Metrics(object):
+    """
+    Registry of named, labelled counters and histograms, rendered in the Prometheus text format.
+    Look a metric up once and keep it: the lookup builds a key, recording on the returned object
+    is the cheap part.
+    """
+
+    def __init__(self):
+        self._metrics = {}
+        self._help = {}
+        self._lock = threading.Lock()
+
+    def histogram(self, name, help='', **labels):
+        return self._get(Histogram, name, help, labels)
+
+    def counter(self, name, help='', **labels):
+        return self._get(MetricCounter, name, help, labels)
+
+    def _get(self, kind, name, help, labels):
+        key = (name, tuple(sorted(labels.items())))
+        metric = self._metrics.get(key)
+        if metric is None:
+            with self._lock:
+                metric = self._metrics.setdefault(key, kind())
+                self._help.setdefault(name, help)
+        return metric
+
+    def _snapshot(self):
+        """ The registered metrics sorted by key, and their help texts, as of now. """
+        # Other threads register metrics as they go, iterating the live dicts could fail.
+        with self._lock:
+            return sorted(self._metrics.items(), key=lambda item: item[0]), dict(self._help)
+
+    def render(self):
+        """ Return every metric in the Prometheus text exposition format. """
+        lines = []
+        described = set()
+        metrics, helps = self._snapshot()
+        for (name, labels), metric in metrics:
+            if name not in described:
+                described.add(name)
+                kind = 'histogram' if isinstance(metric, Histogram) else 'counter'
+                lines.append('# HELP {} {}'.format(name, helps[name]))
+                lines.append('# TYPE {} {}'.format(name, kind))
+            if isinstance(metric, MetricCounter):
+                lines.append('{}{} {}'.format(name, _label_text(labels), metric.value))
+                continue
+            counts = list(metric.counts)
+            total = 0
+            for bound, count in zip(metric.bounds + (float('inf'),), counts):
+                total += count
+                le = '+Inf' if bound == float('inf') else repr(bound)
+                lines.append('{}_bucket{} {}'.format(name, _label_text(labels + (('le', le),)), total))
+            lines.append('{}_sum{} {!r}'.format(name, _label_text(labels), metric.sum))
+            lines.append('{}_count{} {}'.format(name, _label_text(labels), total))
+        return '\n'.join(lines) + '\n'
+
+    def summary(self):
+        """ Return one human readable line per metric: counts, and p50/p99 for histograms. """
+        lines = []
+        metrics, _ = self._snapshot()
+        for (name, labels), metric in metrics:
+            if isinstance(metric, MetricCounter):
+                lines.append('{}{} {}'.format(name, _label_text(labels), metric.value))
+            elif metric.count:
+                lines.append('{}{} n={} p50<={:.3g}s p99<={:.3g}s mean={:.3g}s'.format(
+                    name, _label_text(labels), metric.count, metric.percentile(50),
+                    metric.percentile(99), metric.sum / metric.count))
+        return '\n'.join(lines)
+
+    def serve(self, port, host='127.0.0.1'):
+        """ Serve render() read-only at http://host:port/metrics from a daemon thread. """
+        registry = self
+
+        class Handler(BaseHTTPRequestHandler):
+            def do_GET(self):
+                if self.path.split('?')[0] != '/metrics':
+                    self.send_error(404)
+                    return
+                body = registry.render().encode('utf-8')
+                self.send_response(200)
+                self.send_header('Content-Type', 'text/plain; version=0.0.4')
+                self.send_header('Content-Length', str(len(body)))
+                self.end_headers()
+                self.wfile.write(body)
+
+            def log_message(self, *args):
+                pass
+
+        server = HTTPServer((host, port), Handler)
+        thread = threading.Thread(target=server.serve_forever)
+        thread.daemon = True
+        thread.start()
+        return server
+
+    def dump_every(self, interval):
+        """ Log summary() every interval seconds from a daemon thread. """
+        def run():
+            while True:
+                sleep(interval)
+                fmt_out('--- metrics ---\n{}\n', self.summary())
+        thread = threading.Thread(target=run)
+        thread.daemon = True
+        thread.start()
+        return thread
+
+
+def _label_text(labels):
+    if not labels:
+        return ''
+    return '{' + ','.join('{}="{}"'.format(k, str(v).replace('"', '\\"')) for k, v in labels) + '}'
+
+
+METRICS = Metrics()
+GLOVE_READ_SECONDS = dict((side, METRICS.histogram('hedo_glove_read_seconds', 'Time to read one glove.', side=side))
+                          for side in ('left', 'right'))
+CLASSIFY_SECONDS = METRICS.histogram('hedo_classify_seconds', 'Time to classify a two-hand frame.')
+HAPTIC_DISPATCH_SECONDS = METRICS.histogram('hedo_haptic_dispatch_seconds', 'Time to start a haptic pulse.')
+
+
+class _Span(object):
+    __slots__ = ('tracer', 'name', 'args', 'start')
+
+    def __init__(self, tracer, name, args):
+        self.tracer = tracer
+        self.name = name
+        self.args = args
+
+    def __enter__(self):
+        self.start = monotonic()
+        return self
+
+    def __exit__(self, *exc_info):
+        self.tracer._record(self.name, 'X', self.start, monotonic() - self.start, self.args)
+        return False
+
+
+class _NullSpan(object):
+    __slots__ = ()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        return False
+
+
+_NULL_SPAN = _NullSpan()
+
+
+class Tracer(object):
+    """
+    Opt-in timing spans that follow one gesture through to the commands and phase changes it
+    causes. Each thread has a current trace id. new_trace() starts one, and bind() carries it into
+    work handed to another thread. Spans are kept in a ring buffer and written out by dump() as
+    Chrome Trace Event JSON (open it in Perfetto or chrome://tracing), with flow arrows joining
+    the spans of each trace. While disabled span() returns a shared no-op and bind() returns its
+    argument, so the instrumentation costs a method call.
+    Args:
+        capacity (int): number of spans kept, the oldest are overwritten.
+    """
+
+    def __init__(self, capacity=100000):
+        self.enabled = False
+        self._events = deque(maxlen=capacity)
+        self._ids = itertools.count(1)
+        self._local = threading.local()
+
+    @property
+    def trace_id(self):
+        return getattr(self._local, 'trace', None)
+
+    def new_trace(self):
+        """ Start a new trace on this thread and return its id. """
+        if not self.enabled:
+            return None
+        self._local.trace = next(self._ids)
+        return self._local.trace
+
+    def span(self, name, **args):
+        """ Context manager timing a span of the current trace. """
+        if not self.enabled:
+            return _NULL_SPAN
+        return _Span(self, name, args)
+
+    def instant(self, name, **args):
+        """ Mark a point in time in the current trace. """
+        if self.enabled:
+            self._record(name, 'i', monotonic(), 0, args)
+
+    def bind(self, func):
+        """ Wrap func so that it runs in the caller's current trace, on whichever thread calls it. """
+        if not self.enabled:
+            return func
+        trace = self.trace_id
+
+        def traced(*args, **kwargs):
+            previous = self.trace_id
+            self._local.trace = trace
+            try:
+                return func(*args, **kwargs)
+            finally:
+                self._local.trace = previous
+        return traced
+
+    def _record(self, name, phase, start, duration, args):
+        self._events.append((name, phase, start, duration, get_ident(), getattr(self._local, 'trace', None), args))
+
+    def dump(self, path):
+        """ Write the buffered spans to path as Chrome Trace Event JSON. Returns the number of spans. """
+        pid = os.getpid()
+        events = [{'name': 'thread_name', 'ph': 'M', 'pid': pid, 'tid': thread.ident, 'args': {'name': thread.name}}
+                  for thread in threading.enumerate()]
+        traces = {}
+        recorded = list(self._events)
+        for name, phase, start, duration, tid, trace, args in recorded:
+            event = {'name': name, 'cat': 'hedo', 'ph': phase, 'ts': start * 1e6, 'pid': pid, 'tid': tid,
+                     'args': dict(args, trace_id=trace)}
+            if phase == 'X':
+                event['dur'] = duration * 1e6
+                if trace is not None:
+                    traces.setdefault(trace, []).append(event)
+            else:
+                event['s'] = 't'
+            events.append(event)
+        for trace, spans in traces.items():
+            if len(spans) < 2:
+                continue
+            spans.sort(key=lambda event: event['ts'])
+            for i, span in enumerate(spans):
+                flow = 's' if i == 0 else 'f' if i == len(spans) - 1 else 't'
+                events.append({'name': 'trace {}'.format(trace), 'cat': 'hedo', 'ph': flow, 'id': trace,
+                               'ts': span['ts'], 'pid': pid, 'tid': span['tid'], 'bp': 'e'})
+        with open(path, 'w') as f:
+            json.dump({'traceEvents': events, 'displayTimeUnit': 'ms'}, f, default=str)
+        return len(recorded)
+
+
+TRACER = Tracer()
+
+
+def in_thread(func, *args):
+    """
+    Call func(*args) on a new daemon thread, in the caller's trace, and return a Future for the result.
+    For calls that mustn't wait for a pool worker, and that may be abandoned while they finish on
+    their own.
+    """
+    future = Future()
+
+    def run():
+        try:
+            future.set_result(func(*args))
+        except Exception as err:  # pylint: disable=broad-except
+            future.set_exception(err)
+    thread = threading.Thread(target=TRACER.bind(run))
+    thread.daemon = True
+    thread.start()
+    return future
 
 
 # Gstreamer pipeline description for the vehicle to produce an MJPEG stream over RTP.
@@ -57,6 +493,487 @@ videoscale ! video/x-raw, width=360, height=240 ! videoconvert ! video/x-raw, fo
 ! jpegenc ! rtpjpegpay ! udpsink host={} port={} sync=false
 """.replace('\n', ' ')
 
+# Endpoints that can safely be sent more than once. async_command is only idempotent for the
+# commands listed in IDEMPOTENT_COMMANDS (a repeated takeoff request is not).
+IDEMPOTENT_ENDPOINTS = ('status', 'active_faults', 'set_fault_override', 'set_skill', 'channel')
+IDEMPOTENT_COMMANDS = ('land',)
+
+
+class CircuitOpenError(IOError):
+    """ Raised instead of sending a request while the vehicle is considered unreachable. """
+
+
+class CircuitBreaker(object):
+    """
+    Fail fast while the vehicle is unreachable instead of waiting out every request.
+    Args:
+        failure_threshold (int): consecutive failures before the circuit opens.
+        reset_timeout (float): seconds to stay open before letting a single probe request through.
+    """
+
+    def __init__(self, failure_threshold=5, reset_timeout=3.0):
+        self.failure_threshold = failure_threshold
+        self.reset_timeout = reset_timeout
+        self.failures = 0
+        self.opened_at = None
+        # Thread sending the half-open probe, if any.
+        self._probing = None
+        self._lock = threading.Lock()
+
+    def allow(self):
+        """ Return True if a request may be sent now. """
+        with self._lock:
+            if self.opened_at is None:
+                return True
+            if self._probing is not None or monotonic() - self.opened_at < self.reset_timeout:
+                return False
+            # Half-open: let one request through to find out if the vehicle is back.
+            self._probing = get_ident()
+            return True
+
+    def record_success(self):
+        with self._lock:
+            self.failures = 0
+            self.opened_at = None
+            self._probing = None
+
+    def record_failure(self):
+        with self._lock:
+            self.failures += 1
+            self._probing = None
+            if self.failures >= self.failure_threshold:
+                self.opened_at = monotonic()
+
+    def release(self):
+        """ End this thread's probe if it was neither a success nor a failure, so another can be sent. """
+        with self._lock:
+            if self._probing == get_ident():
+                self._probing = None
+
+
+class LatencyTracker(object):
+    """ Keep a window of recent round trip times per endpoint to derive hedging delays. """
+
+    def __init__(self, window=100, min_samples=20):
+        self.window = window
+        self.min_samples = min_samples
+        self._samples = {}
+        self._lock = threading.Lock()
+
+    def record(self, endpoint, seconds):
+        with self._lock:
+            samples = self._samples.get(endpoint)
+            if samples is None:
+                samples = self._samples[endpoint] = deque(maxlen=self.window)
+            samples.append(seconds)
+
+    def percentile(self, endpoint, pct, default=None):
+        """ Return the pct percentile latency of endpoint, or default if there are too few samples. """
+        with self._lock:
+            samples = sorted(self._samples.get(endpoint, ()))
+        if len(samples) < self.min_samples:
+            return default
+        return samples[min(len(samples) - 1, int(len(samples) * pct / 100.0))]
+
+
+# Status response fields the client itself needs on every heartbeat.
+STATUS_FIELDS = ('sessionId', 'flightPhase', 'accessLevel')
+
+# Flight phases in which the vehicle is on the ground, and in which it is in the air. A phase in neither
+# is not known to the client, and doesn't stop any command.
+GROUND_PHASES = ('REST', 'PREP', 'FLIGHT_PROCESSES_CHECK', 'LOGGING_START', 'READY_FOR_GROUND_TAKEOFF')
+AIRBORNE_PHASES = ('FLYING',)
+
+
+class FlightStateMachine(object):
+    """
+    Client-side view of the vehicle's flight phase, used to drop commands that can't do anything
+    before they cost a round trip. The phase comes from the status responses the client already
+    gets. If the cached phase is older than stale_after seconds, or is not one the client knows,
+    every intent is let through. A land is always let through while a takeoff is in progress, the
+    takeoff gives way to it.
+    Args:
+        stale_after (float): seconds after which the cached phase is no longer trusted.
+        history (int): number of dropped intents to remember.
+    """
+
+    def __init__(self, stale_after=5.0, history=100):
+        self.stale_after = stale_after
+        self.phase = None
+        self.updated_at = None
+        self.skill = None
+        self.pending = set()
+        self.sent = Counter()
+        self.dropped = Counter()
+        self.history = deque(maxlen=history)
+        self._lock = threading.Lock()
+
+    def update(self, phase):
+        """ Record the flight phase from a status response. """
+        if not phase:
+            return
+        with self._lock:
+            if phase in GROUND_PHASES:
+                self.skill = None
+            if phase != self.phase:
+                TRACER.instant('phase', phase=phase)
+            self.phase = phase
+            self.updated_at = monotonic()
+
+    def known_phase(self):
+        """ The cached phase, or None if it is missing or stale. """
+        if self.updated_at is None or monotonic() - self.updated_at > self.stale_after:
+            return None
+        return self.phase
+
+    def request(self, intent, arg=None):
+        """
+        Decide whether an intent should be sent to the vehicle, and mark it in progress if so.
+        Every admitted intent must be followed by a call to done().
+        Args:
+            intent (str): 'takeoff', 'land' or 'set_skill'.
+            arg: the skill key for set_skill.
+        Returns:
+            bool: True if the intent should be sent.
+        """
+        with self._lock:
+            reason = self._reject_reason(intent, arg, self.known_phase())
+            if reason:
+                self.dropped[reason] += 1
+                self.history.append((monotonic(), intent, arg, reason))
+                return False
+            self.pending.add(intent)
+            self.sent[intent] += 1
+            return True
+
+    def done(self, intent, arg=None, ok=True):
+        with self._lock:
+            self.pending.discard(intent)
+            if intent == 'set_skill' and ok:
+                self.skill = arg
+
+    def _reject_reason(self, intent, arg, phase):
+        airborne = phase in AIRBORNE_PHASES
+        on_ground = phase in GROUND_PHASES
+        if intent in self.pending:
+            return '{} already in progress'.format(intent)
+        if intent == 'takeoff':
+            if 'land' in self.pending:
+                return 'takeoff while landing'
+            if airborne:
+                return 'takeoff while {}'.format(phase)
+        elif intent == 'land':
+            if on_ground and 'takeoff' not in self.pending:
+                return 'land while {}'.format(phase)
+        elif intent == 'set_skill':
+            if on_ground:
+                return 'set_skill while {}'.format(phase)
+            if arg == self.skill:
+                return 'skill {} already active'.format(arg)
+        return None
+
+
+class FaultMonitor(object):
+    """
+    Poll the vehicle's active faults on a schedule and keep the blocking ones cached.
+    Subscribers are called with only what changed, as subscriber(raised, cleared) with sets of
+    fault names, from the monitor's thread.
+    Args:
+        client (HTTPClient): the vehicle to watch.
+        interval (float): seconds between polls.
+    """
+
+    def __init__(self, client, interval=2.0):
+        self.client = client
+        self.interval = interval
+        self.faults = frozenset()
+        self.updated_at = None
+        self._subscribers = []
+        self._thread = None
+
+    def subscribe(self, callback):
+        self._subscribers.append(callback)
+
+    def start(self):
+        """ Start polling, if not already started. """
+        if self._thread:
+            return
+        self._thread = threading.Thread(target=self._run)
+        self._thread.daemon = True
+        self._thread.start()
+
+    def blocking_faults(self):
+        """ The blocking faults as of the last poll, without making a request. """
+        return sorted(self.faults)
+
+    def poll(self):
+        """ Fetch the active faults once and notify subscribers of any change. """
+        faults = frozenset(self.client.get_blocking_faults())
+        raised = faults - self.faults
+        cleared = self.faults - faults
+        self.faults = faults
+        self.updated_at = monotonic()
+        if raised or cleared:
+            for callback in self._subscribers:
+                callback(raised, cleared)
+
+    def _run(self):
+        while True:
+            try:
+                self.poll()
+            except IOError as err:
+                fmt_err('Fault poll failed: {}\n', err)
+            except Exception as err:  # pylint: disable=broad-except
+                # A malformed reply or a failing subscriber must not stop the polling.
+                fmt_err('Fault poll failed: {}: {}\n', type(err).__name__, err)
+            sleep(self.interval)
+
+
+def print_fault_changes(raised, cleared):
+    for name in sorted(raised):
+        fmt_out('Fault raised: {}\n', name)
+    for name in sorted(cleared):
+        fmt_out('Fault cleared: {}\n', name)
+
+
+class _Series(object):
+    """
+    Append-only structured array that keeps its newest capacity rows in time order, in a buffer
+    twice that size so rows only move once per capacity appends. view() is a zero-copy slice.
+    """
+
+    def __init__(self, dtype, capacity):
+        self.capacity = capacity
+        self._buffer = np.zeros(2 * capacity, dtype=dtype)
+        self._start = 0
+        self._end = 0
+
+    def append(self, row):
+        if self._end == len(self._buffer):
+            count = self._end - self._start
+            self._buffer[:count] = self._buffer[self._start:self._end]
+            self._start, self._end = 0, count
+        self._buffer[self._end] = row
+        self._end += 1
+        if self._end - self._start > self.capacity:
+            self._start += 1
+
+    def drop_before(self, t):
+        """ Forget rows with a timestamp before t. """
+        self._start += int(np.searchsorted(self.view()['t'], t))
+
+    def view(self):
+        return self._buffer[self._start:self._end]
+
+
+class StatusHistory(object):
+    """
+    Bounded history of the vehicle's status responses, for looking back during an incident.
+    Numeric fields (and the request's round trip time, 'rtt') go into fixed-size columnar arrays:
+    every sample for the last recent_seconds, then per-interval count/min/mean/max rollups for
+    each entry of rollups. Fields that rarely change, like the flight phase, are delta encoded:
+    only the times they change are stored, as codes into a table of the values seen. Every array
+    is allocated up front, so memory stays flat however long the flight.
+    Subscribers are called with every recorded status, as subscriber(timestamp, status), from the
+    thread that records it.
+    Args:
+        categories (tuple): top-level status fields to delta encode.
+        numbers (tuple): top-level numeric status fields to keep, besides rtt.
+        recent_seconds (float): how long full-rate samples are kept.
+        recent_capacity (int): upper bound on the number of full-rate samples.
+        rollups (tuple): (interval seconds, capacity) of each downsampled tier.
+        max_changes (int): number of changes kept per delta-encoded field.
+    """
+
+    def __init__(self, categories=('flightPhase', 'accessLevel', 'sessionId'), numbers=(),
+                 recent_seconds=600, recent_capacity=4096, rollups=((10.0, 2160), (300.0, 2016)),
+                 max_changes=4096):
+        self.categories = tuple(categories)
+        self.numbers = ('rtt',) + tuple(numbers)
+        self.recent_seconds = recent_seconds
+        self._lock = threading.Lock()
+        self._recent = _Series([('t', 'f8')] + [(name, 'f4') for name in self.numbers], recent_capacity)
+        rollup_dtype = [('t', 'f8'), ('count', 'u4')] + [
+            (name + suffix, 'f4') for name in self.numbers for suffix in ('_min', '_mean', '_max')]
+        self._rollups = [(interval, _Series(rollup_dtype, capacity), {}) for interval, capacity in rollups]
+        self._changes = dict((name, _Series([('t', 'f8'), ('code', 'i4')], max_changes))
+                             for name in self.categories)
+        self._codes = dict((name, {}) for name in self.categories)
+        self._values = dict((name, []) for name in self.categories)
+        self._current = dict((name, None) for name in self.categories)
+        self._subscribers = []
+
+    def subscribe(self, callback):
+        self._subscribers.append(callback)
+
+    def record(self, timestamp, status, rtt=float('nan')):
+        """ Add one status response, received at timestamp (seconds since the epoch). """
+        values = [rtt] + [_as_float(status.get(name)) for name in self.numbers[1:]]
+        with self._lock:
+            self._recent.append(tuple([timestamp] + values))
+            self._recent.drop_before(timestamp - self.recent_seconds)
+            for interval, series, bucket in self._rollups:
+                self._add_to_rollup(interval, series, bucket, timestamp, values)
+            for name in self.categories:
+                value = status.get(name)
+                if value is None or value == self._current[name]:
+                    continue
+                codes = self._codes[name]
+                if value not in codes:
+                    codes[value] = len(self._values[name])
+                    self._values[name].append(value)
+                self._changes[name].append((timestamp, codes[value]))
+                self._current[name] = value
+        for callback in self._subscribers:
+            callback(timestamp, status)
+
+    def _add_to_rollup(self, interval, series, bucket, timestamp, values):
+        start = timestamp - timestamp % interval
+        if bucket and bucket['start'] != start:
+            self._close_rollup(series, bucket)
+        if not bucket:
+            bucket.update(start=start, count=0, columns=[[0, 0.0, None, None] for _ in values])
+        bucket['count'] += 1
+        for column, value in zip(bucket['columns'], values):
+            if value != value:
+                continue
+            column[0] += 1
+            column[1] += value
+            column[2] = value if column[2] is None else min(column[2], value)
+            column[3] = value if column[3] is None else max(column[3], value)
+
+    def _close_rollup(self, series, bucket):
+        row = [bucket['start'], bucket['count']]
+        for seen, total, low, high in bucket['columns']:
+            if seen:
+                row.extend((low, total / seen, high))
+            else:
+                row.extend((np.nan, np.nan, np.nan))
+        series.append(tuple(row))
+        bucket.clear()
+
+    def value_at(self, field, t):
+        """ The value of a delta-encoded field at time t, or None if it is from before the history. """
+        with self._lock:
+            changes = self._changes[field].view()
+            i = int(np.searchsorted(changes['t'], t, side='right')) - 1
+            return self._values[field][changes['code'][i]] if i >= 0 else None
+
+    def phase_at(self, t):
+        return self.value_at('flightPhase', t)
+
+    def transitions(self, field='flightPhase', start=None, end=None):
+        """ List the (time, previous value, new value) changes of field with start <= time < end. """
+        with self._lock:
+            changes = self._changes[field].view().copy()
+            values = list(self._values[field])
+        first = 0 if start is None else int(np.searchsorted(changes['t'], start))
+        last = len(changes) if end is None else int(np.searchsorted(changes['t'], end))
+        return [(float(changes['t'][i]), values[changes['code'][i - 1]] if i > 0 else None,
+                 values[changes['code'][i]]) for i in range(first, last)]
+
+    def to_numpy(self):
+        """
+        Copy the history out as NumPy arrays.
+        Returns:
+            dict: 'recent' the full-rate samples, 'rollup_<interval>s' each downsampled tier, and
+                one (t, value) array of changes per delta-encoded field.
+        """
+        with self._lock:
+            result = {'recent': self._recent.view().copy()}
+            for interval, series, _ in self._rollups:
+                result['rollup_{:g}s'.format(interval)] = series.view().copy()
+            for name in self.categories:
+                changes = self._changes[name].view()
+                table = np.array(self._values[name] or [''], dtype=object)
+                result[name] = np.rec.fromarrays([changes['t'].copy(), table[changes['code']]], names='t,value')
+        return result
+
+
+def _as_float(value):
+    try:
+        return float(value)
+    except (TypeError, ValueError):
+        return float('nan')
+
+
+class ResponseDecoder(object):
+    """
+    Decode the JSON body of a vehicle response and unwrap its 'data' field, building only the
+    requested fields where the backend allows it.
+    Fields are '/' separated paths inside 'data', like 'flightPhase' or 'json/images'. The result
+    keeps the same nesting and leaves out fields the response doesn't have.
+    With simdjson each thread reuses one parser and its buffers, and fields are read straight from
+    the parsed document. Otherwise, and for whole responses, the body is decoded with orjson or the
+    json module and then projected.
+    Args:
+        backend (str): 'simdjson', 'orjson' or 'json'. Defaults to the fastest one installed.
+    """
+
+    def __init__(self, backend=None):
+        self.backend = backend or ('simdjson' if simdjson else 'orjson' if orjson else 'json')
+        # simdjson is slower than orjson at building a whole document.
+        self._loads = orjson.loads if orjson and self.backend != 'json' else json.loads
+        self._local = threading.local()
+
+    def decode(self, body, fields=None):
+        """ Decode body (bytes). Raises ValueError if it isn't valid JSON. """
+        if self.backend == 'simdjson' and fields is not None:
+            return self._decode_simdjson(body, fields)
+        data = self._loads(body)['data']
+        if fields is None:
+            return data
+        result = {}
+        for field in fields:
+            value = data
+            keys = field.split('/')
+            for key in keys:
+                if not isinstance(value, dict) or key not in value:
+                    break
+                value = value[key]
+            else:
+                _set_path(result, keys, value)
+        return result
+
+    def _decode_simdjson(self, body, fields):
+        parser = getattr(self._local, 'parser', None)
+        if parser is None:
+            parser = self._local.parser = simdjson.Parser()
+        try:
+            document = parser.parse(body)
+        except RuntimeError as err:
+            raise ValueError(str(err))
+        result = {}
+        try:
+            for field in fields:
+                try:
+                    value = document.at_pointer('/data/' + field)
+                except KeyError:
+                    continue
+                # Lazy values point into the parser's buffer, which the next parse reuses.
+                if isinstance(value, simdjson.Object):
+                    value = value.as_dict()
+                elif isinstance(value, simdjson.Array):
+                    value = value.as_list()
+                _set_path(result, field.split('/'), value)
+        finally:
+            del document
+        return result
+
+
+def _set_path(target, keys, value):
+    for key in keys[:-1]:
+        target = target.setdefault(key, {})
+    target[keys[-1]] = value
+
+
+def _get_path(source, keys):
+    for key in keys:
+        if not isinstance(source, dict):
+            return None
+        source = source.get(key)
+    return source
+
 
 class HTTPClient(object):
     """
@@ -72,15 +989,43 @@ class HTTPClient(object):
         token_file (str): Path to a file that contains the auth token for simulator access.
         stream_settings (dict): Configuration for receiving an RTP video stream.
             This feature is coming soon to R1 and will not work in the simulator.
+        max_retries (int): number of retries for idempotent requests.
+        backoff (float): base delay in seconds for the jittered exponential backoff between retries.
+        hedge_delay (float): seconds to wait before hedging a request when there are not yet enough
+            samples to use the endpoint's p95 latency.
     """
 
-    def __init__(self, baseurl, client_id=None, pilot=False, token_file=None, stream_settings=None):
+    # Parsers are per thread, so one decoder can serve every client.
+    decoder = ResponseDecoder()
+    # The latency histogram and failure counter for each endpoint, shared by every client.
+    _endpoint_metrics = {}
+
+    # Shared by every client, for sending independent requests concurrently.
+    _request_pool = ThreadPoolExecutor(max_workers=8)
+
+    def __init__(self, baseurl, client_id=None, pilot=False, token_file=None, stream_settings=None,
+                 max_retries=3, backoff=0.1, hedge_delay=0.25):
         self.client_id = client_id or str(uuid4())
         self.baseurl = baseurl
         self.access_token = None
         self.session_id = None
         self.access_level = None
         self.stream_settings = stream_settings
+        self.max_retries = max_retries
+        self.backoff = backoff
+        self.hedge_delay = hedge_delay
+        self.breaker = CircuitBreaker()
+        self.flight = FlightStateMachine()
+        self.faults = FaultMonitor(self)
+        self.faults.subscribe(print_fault_changes)
+        self.history = StatusHistory()
+        # The heartbeat only decodes what the client and its history use, not the vehicle config.
+        self.status_fields = STATUS_FIELDS + self.history.numbers[1:]
+        self.latency = LatencyTracker()
+        self._refresh_interval = METRICS.histogram('hedo_session_refresh_interval_seconds',
+                                                   'Time between status heartbeats.', vehicle=baseurl)
+        self._last_refresh = None
+        self._session = requests.Session()
         self._authenticate(pilot, token_file)
 
     def _authenticate(self, pilot=False, token_file=None):
@@ -129,15 +1074,24 @@ class HTTPClient(object):
                                               vehicle_access_token=self.access_token,
                                               cloud_url=api_url)
 
-    def request_json(self, endpoint, json_data=None, timeout=20):
+    def request_json(self, endpoint, json_data=None, timeout=20, retries=None, hedge=False, fields=None):
         """ Send a GET or POST request to the vehicle and get a parsed JSON response.
+        Idempotent requests are retried with jittered exponential backoff until the deadline.
         Args:
             endpoint (str): the path to request.
             json_data (dict): an optional JSON dictionary to send.
-            timeout (int): number of seconds to wait for a response.
+            timeout (int): deadline in seconds for the whole call, including retries.
+            retries (int): override the number of retries. Defaults to max_retries for
+                idempotent requests and 0 otherwise.
+            hedge (bool): send a second attempt if the first has not answered within the
+                endpoint's p95 latency, and use whichever answers first.
+            fields (tuple): only decode these '/' separated paths of the response data, see
+                ResponseDecoder. Defaults to all of it.
         Raises:
             HTTPError: if the server responds with 4XX or 5XX status code
             IOError: if the response body cannot be read.
+            Timeout: if the deadline passes before the vehicle answers.
+            CircuitOpenError: if the vehicle is currently considered unreachable.
             RuntimeError: if the response is poorly formatted.
         Returns:
             dict: the servers JSON response
@@ -148,23 +1102,110 @@ class HTTPClient(object):
             headers['Authorization'] = 'Bearer {}'.format(self.access_token)
         if json_data is not None:
             headers['Content-Type'] = 'application/json'
-            res = requests.post(url, json=json_data, headers=headers)
-        else:
-            res = requests.get(url, headers=headers)
-
-        try:
-            res.raise_for_status()
-        except requests.HTTPError as err:
-            #print(err.message)
-            raise
-
+        if retries is None:
+            retries = self.max_retries if self._is_idempotent(endpoint, json_data) else 0
+        key = endpoint.split('/')[0]
+        deadline = monotonic() + timeout
+        seconds, failures = self._metrics_for(key)
+        with TRACER.span('request_json', endpoint=endpoint):
+            attempt = 0
+            while True:
+                remaining = deadline - monotonic()
+                if remaining <= 0:
+                    raise requests.Timeout('Deadline exceeded for {}'.format(endpoint))
+                if not self.breaker.allow():
+                    raise CircuitOpenError('Vehicle unreachable, not sending {}'.format(endpoint))
+                start = monotonic()
+                try:
+                    try:
+                        if hedge:
+                            res = self._hedged_send(key, url, json_data, headers, deadline)
+                        else:
+                            res = self._send(url, json_data, headers, remaining)
+                        res.raise_for_status()
+                    except requests.RequestException as err:
+                        # Anything else requests raises, like a truncated chunked body, counts as a
+                        # connection failure.
+                        server_error = isinstance(err, requests.HTTPError) and err.response.status_code >= 500
+                        if isinstance(err, requests.HTTPError) and not server_error:
+                            # The vehicle answered, it just didn't like the request. Retrying won't help.
+                            self.breaker.record_success()
+                            raise
+                        self.breaker.record_failure()
+                        failures.inc()
+                        if attempt >= retries:
+                            raise
+                        # Full jitter keeps retries from several threads from arriving in lockstep.
+                        delay = random.uniform(0, self.backoff * 2 ** attempt)
+                        sleep(max(0, min(delay, deadline - monotonic())))
+                        attempt += 1
+                        continue
+                finally:
+                    # A half-open probe must never stay outstanding, however the attempt ended.
+                    self.breaker.release()
+                self.breaker.record_success()
+                elapsed = monotonic() - start
+                self.latency.record(key, elapsed)
+                seconds.record(elapsed)
+                return self._decode(res, fields)
+
+    def _is_idempotent(self, endpoint, json_data):
+        if json_data is None:
+            return True
+        key = endpoint.split('/')[0]
+        if key == 'async_command':
+            return json_data.get('command') in IDEMPOTENT_COMMANDS
+        return key in IDEMPOTENT_ENDPOINTS
+
+    def _metrics_for(self, key):
+        metrics = self._endpoint_metrics.get(key)
+        if metrics is None:
+            metrics = self._endpoint_metrics.setdefault(key, (
+                METRICS.histogram('hedo_request_seconds', 'Round trip time of successful requests.', endpoint=key),
+                METRICS.counter('hedo_request_failures_total', 'Failed request attempts.', endpoint=key)))
+        return metrics
+
+    def _send(self, url, json_data, headers, timeout):
+        """ Send a single request, giving up after timeout seconds. """
+        with TRACER.span('send', url=url):
+            if json_data is not None:
+                return self._session.post(url, json=json_data, headers=headers, timeout=timeout)
+            return self._session.get(url, headers=headers, timeout=timeout)
+
+    def _hedged_send(self, key, url, json_data, headers, deadline):
+        """
+        Send a request, and a duplicate if the first is slower than the usual p95. Each attempt has a
+        thread of its own, so attempts stuck on a lossy link can't hold up anyone's hedges. The one
+        that loses is left to time out by the deadline.
+        """
+        delay = self.latency.percentile(key, 95, default=self.hedge_delay)
+        first = in_thread(self._send, url, json_data, headers, deadline - monotonic())
+        done, _ = wait([first], timeout=min(delay, max(0, deadline - monotonic())))
+        if done:
+            return first.result()
+
+        second = in_thread(self._send, url, json_data, headers, deadline - monotonic())
+        pending = set([first, second])
+        error = None
+        while pending:
+            done, pending = wait(pending, timeout=max(0, deadline - monotonic()),
+                                 return_when=FIRST_COMPLETED)
+            if not done:
+                break
+            for future in done:
+                if future.exception() is None:
+                    return future.result()
+                error = future.exception()
+        raise error or requests.Timeout('Deadline exceeded for {}'.format(url))
+
+    def _decode(self, res, fields=None):
+        """ Unwrap the 'data' field of a JSON response, or return the raw response. """
         if res.headers['Content-Type'] == 'application/json':
             try:
-                reply = res.json()
+                return self.decoder.decode(res.content, fields)
             except ValueError as err:
-                print('unable to decode json')
+                fmt_err('unable to decode json\n')
                 raise
-            return reply['data']
         return res
 
     def send_custom_comms(self, skill_key, data, no_response=False):
@@ -179,7 +1220,8 @@ class HTTPClient(object):
         """
 
         rpc_request = {
-            'data': base64.b64encode(data),
+            # b64encode returns bytes, which json can't serialise on Python 3.
+            'data': base64.b64encode(data).decode('ascii'),
             'skill_key': skill_key,
             'no_response': no_response,  # this key is option and defaults to False
         }
@@ -201,6 +1243,8 @@ class HTTPClient(object):
         """ Ping the vehicle to keep session alive and get status back.
         The session will expire after 10 seconds of inactivity from the pilot.
         If the session expires, the video stream will stop.
+        Returns:
+            dict: the status_fields of the response. Use request_json('status') for the rest.
         """
         args = {
             'inForeground': True,
@@ -213,8 +1257,14 @@ class HTTPClient(object):
             args['sessionId'] = self.session_id
         if self.stream_settings:
             args['streamSettings'] = self.stream_settings
-        response = self.request_json('status', args)
+        now = monotonic()
+        if self._last_refresh is not None:
+            self._refresh_interval.record(now - self._last_refresh)
+        self._last_refresh = now
+        response = self.request_json('status', args, fields=self.status_fields)
+        self.history.record(time(), response, monotonic() - now)
         self.session_id = response['sessionId']
+        self.flight.update(response.get('flightPhase'))
         return response
 
     def takeoff(self):
@@ -222,13 +1272,27 @@ class HTTPClient(object):
         if self.access_level != 'PILOT':
             fmt_err('Cannot takeoff: not pilot\n')
             return
+        if not self.flight.request('takeoff'):
+            return
+        # A land sent at any point from here on abandons the takeoff, even if it is over by the next check.
+        landings = self.flight.sent['land']
+        try:
+            with TRACER.span('takeoff'):
+                self._takeoff(landings)
+        finally:
+            self.flight.done('takeoff')
 
+    def _takeoff(self, landings):
+        self.faults.start()
         self.update_pilot_status()
         self.disable_faults()
 
         while True:
             sleep(2)  # downsample to prevent spamming the endpoint
             phase = self.update_pilot_status().get('flightPhase')
+            if self.flight.sent['land'] != landings:
+                fmt_out('Takeoff abandoned for landing\n')
+                return
             if not phase:
                 continue
             # fmt_out('flight phase = {}\n', phase)
@@ -249,32 +1313,60 @@ class HTTPClient(object):
 
             else:
                 # print the active faults, remove after debug
-                fmt_out('Faults = {}\n', ','.join(self.get_blocking_faults()))
+                fmt_out('Faults = {}\n', ','.join(self.faults.blocking_faults()))
 
     def land(self):
         """ Land the vehicle. Blocks until on the ground. """
         if self.access_level != 'PILOT':
             fmt_err('Cannot land: not pilot\n')
             return
+        # Concurrent land requests collapse into the one already in progress.
+        if not self.flight.request('land'):
+            return
+        try:
+            with TRACER.span('land'):
+                self._land()
+        finally:
+            self.flight.done('land')
 
-        phase = 'FLYING'
-        while phase == 'FLYING':
-            fmt_out('Sending LAND\n')
-            self.request_json('async_command', {'command': 'land'})
+    def _land(self, resend_interval=5):
+        sent_at = None
+        while True:
+            # The command is retried and hedged, so only repeat it if the vehicle ignores it.
+            if sent_at is None or monotonic() - sent_at >= resend_interval:
+                fmt_out('Sending LAND\n')
+                try:
+                    # Landing is latency critical, hedge it rather than wait out a lost packet.
+                    self.request_json('async_command', {'command': 'land'}, timeout=5, hedge=True)
+                    sent_at = monotonic()
+                except IOError as err:
+                    fmt_err('Land request failed: {}\n', err)
+                    sleep(1)
+                    continue
             sleep(1)
-            new_phase = self.update_pilot_status().get('flightPhase')
-            if not new_phase:
+            try:
+                phase = self.update_pilot_status().get('flightPhase')
+            except IOError as err:
+                fmt_err('Status update failed: {}\n', err)
                 continue
-            phase = new_phase
+            if phase and phase != 'FLYING':
+                return
 
     def set_skill(self, skill_key):
         """ Request a specific skill to be active. """
         if self.access_level != 'PILOT':
             fmt_err('Cannot switch skills: not pilot\n')
             return
-        fmt_out("Requesting {} skill\n", skill_key)
-        endpoint = 'set_skill/{}'.format(skill_key)
-        self.request_json(endpoint, {'args': {}})
+        if not self.flight.request('set_skill', skill_key):
+            return
+        ok = False
+        try:
+            fmt_out("Requesting {} skill\n", skill_key)
+            endpoint = 'set_skill/{}'.format(skill_key)
+            self.request_json(endpoint, {'args': {}})
+            ok = True
+        finally:
+            self.flight.done('set_skill', skill_key, ok)
 
     def get_blocking_faults(self):
         faults = self.request_json('active_faults').get('faults', {})
@@ -287,17 +1379,21 @@ class HTTPClient(object):
             'LOST_PHONE_COMMS_SHORT': 2,
             'LOST_PHONE_COMMS_LONG': 3,
         }
-        for _, fault_id in faults.items():
-            self.request_json('set_fault_override/{}'.format(fault_id),
-                              {'override_on': True, 'fault_active': False})
+        # The overrides are independent, send them all at once.
+        futures = [self._request_pool.submit(TRACER.bind(self.request_json), 'set_fault_override/{}'.format(fault_id),
+                                             {'override_on': True, 'fault_active': False})
+                   for fault_id in faults.values()]
+        for future in futures:
+            future.result()
 
     def check_min_api_version(self, major=18.0, minor=5.0):
-        info = self.request_json('status')['config']['deployInfo']
+        info = self.request_json('status', fields=('config/deployInfo',))['config']['deployInfo']
         return info.get('api_version_major') >= major and info.get('api_version_minor') >= minor
 
     def get_udp_link_address(self):
         """ Get the dynamic port and hostname for the udp link. """
-        resp = self.request_json('status')['config']
+        resp = self.request_json('status', fields=('config/lcmProxyUdpHostname', 'config/lcmProxyUdpPort'))
+        resp = resp.get('config', {})
         udp_hostname = resp.get('lcmProxyUdpHostname')
         if not udp_hostname:
             udp_hostname = urlparse(self.baseurl).netloc.split(':')[0]
@@ -312,10 +1408,10 @@ class HTTPClient(object):
         import cv2
         import numpy
 
-        t1 = time.time()
+        t1 = time()
         # Fetch the image metadata for the latest color image.
-        data = self.request_json('channel/SUBJECT_CAMERA_RIG_NATIVE')
-        t2 = time.time()
+        data = self.request_json('channel/SUBJECT_CAMERA_RIG_NATIVE', fields=('json/images',))
+        t2 = time()
         fmt_out('Got metadata in {}ms\n', int(1000 * (t2 - t1)))
         images = data['json']['images']
         if not images:
@@ -333,7 +1429,7 @@ class HTTPClient(object):
         except requests.HTTPError as err:
             fmt_err('Got error for url {} {}\n', image_path, err)
             return
-        t3 = time.time()
+        t3 = time()
         fmt_out('Got image data in {}ms\n', int(1000 * (t3 - t2)))
 
         # Convert and save as a PNG
@@ -356,7 +1452,7 @@ class HTTPClient(object):
         input_array.shape = (height, width, bytes_per_pixel)
         bgr_array = cv2.cvtColor(input_array, conversion_format)
         cv2.imwrite(filename, bgr_array)
-        t4 = time.time()
+        t4 = time()
         fmt_out('Saved image in {}ms\n', int(1000 * (t4 - t3)))
 
         return filename
@@ -370,404 +1466,2083 @@ class HTTPClient(object):
             'run_mode_name': mode_name,
             'action': action,
         })
-        print(resp)
+        fmt_out('{}\n', resp)
 
-# Setup
-stream_settings = {'source': 'NATIVE', 'port': 55004}
+class FleetController(object):
+    """
+    Fly several vehicles from one pair of gloves.
+    Exposes the same takeoff/land/set_skill calls as HTTPClient, but fans each one out to every
+    vehicle through a bounded worker pool, so commanding the fleet takes about as long as the
+    slowest vehicle. Landing has a pool of its own with a worker per vehicle, so it never queues
+    behind takeoffs that are still in progress; they give way to it. Each vehicle gets its own
+    heartbeat thread.
+    Args:
+        baseurls (list): the url of each vehicle, see HTTPClient.
+        max_workers (int): size of the worker pool. Defaults to one worker per vehicle, up to 16.
+        heartbeat_interval (float): seconds between status updates to each vehicle.
+        **client_kwargs: passed on to every HTTPClient.
+    """
 
-# Create Client
-try:
-    client = HTTPClient('http://192.168.10.1',
-                        pilot=True,
-                        token_file=0,
-                        stream_settings=stream_settings)
-except(OSError):
-    print("Failed to connect to drone! Exiting...")
-    exit()
+    def __init__(self, baseurls, max_workers=None, heartbeat_interval=2, **client_kwargs):
+        self.heartbeat_interval = heartbeat_interval
+        self._pool = ThreadPoolExecutor(max_workers=max_workers or min(len(baseurls), 16))
+        self._land_pool = ThreadPoolExecutor(max_workers=len(baseurls))
+        # Authenticate with every vehicle at once, any failure is fatal like it is for one vehicle.
+        futures = [self._pool.submit(HTTPClient, url, **client_kwargs) for url in baseurls]
+        self.clients = [future.result() for future in futures]
+        for vehicle in self.clients:
+            thread = threading.Thread(target=self._heartbeat, args=(vehicle,))
+            thread.daemon = True
+            thread.start()
+
+    def _heartbeat(self, vehicle):
+        while True:
+            try:
+                vehicle.update_pilot_status()
+            except IOError as err:
+                fmt_err('{}: status update failed: {}\n', vehicle.baseurl, err)
+            sleep(self.heartbeat_interval)
 
+    def broadcast(self, method, *args, **kwargs):
+        """
+        Call an HTTPClient method on every vehicle concurrently.
+        Returns:
+            dict: the result, or the raised exception, for each vehicle's baseurl.
+        """
+        return self._fan_out(self._pool, method, args, kwargs)
+
+    def _fan_out(self, pool, method, args, kwargs):
+        futures = dict((vehicle.baseurl, pool.submit(TRACER.bind(getattr(vehicle, method)), *args, **kwargs))
+                       for vehicle in self.clients)
+        results = {}
+        for baseurl, future in futures.items():
+            error = future.exception()
+            if error is not None:
+                fmt_err('{}: {} failed: {}\n', baseurl, method, error)
+            results[baseurl] = error if error is not None else future.result()
+        return results
 
-# Periodically poll the status endpoint to keep ourselves the active pilot.
-def update_loop():
-    while True:
-        client.update_pilot_status()
-        sleep(2)
+    def takeoff(self):
+        """ Take off with every vehicle. Blocks until they are all flying or have failed. """
+        return self.broadcast('takeoff')
 
+    def land(self):
+        """ Land every vehicle. Blocks until they are all on the ground or have failed. """
+        # A second land while one is in progress returns at once, so a worker per vehicle is enough.
+        return self._fan_out(self._land_pool, 'land', (), {})
 
-status_thread = threading.Thread(target=update_loop)
-status_thread.setDaemon(True)
-status_thread.start()
+    def set_skill(self, skill_key):
+        return self.broadcast('set_skill', skill_key)
 
-# This script utilizes multiple threads in order to interact with both gloves independently of each other.
+    def wait_for_phase(self, phase, timeout=60, poll=1):
+        """
+        Wait for every vehicle to report a flight phase.
+        Returns:
+            dict: for each vehicle's baseurl, whether it reached phase before the timeout.
+        """
+        deadline = monotonic() + timeout
 
-leftHand = Forte_CreateDataGloveIO(1, "")  # 1 for left-handed glove
-rightHand = Forte_CreateDataGloveIO(0, "")  # 0 for right-handed glove
+        def wait_one(vehicle):
+            while monotonic() < deadline:
+                try:
+                    if vehicle.update_pilot_status().get('flightPhase') == phase:
+                        return True
+                except IOError:
+                    pass
+                sleep(poll)
+            return False
 
-#adjust this value to control haptic playback speed (int ranging from 0 to 127)
-note = 60
+        futures = dict((vehicle.baseurl, self._pool.submit(TRACER.bind(wait_one), vehicle)) for vehicle in self.clients)
+        return dict((baseurl, future.result()) for baseurl, future in futures.items())
 
-#adjust this value to control haptic amplitude (float ranging from 0.0 to 1.0)
-amplitude = 1
 
-def calibrate():
-    neutralL = 0
-    neutralR = 0
-    initial = 0
-    x = 0
+# Header for each message inside a batched custom_comms payload: payload length and flags.
+# Replies come back as a sequence of COMMS_REPLY_HEADER length-prefixed payloads, one per
+# message that wanted a response, in the order they were sent.
+COMMS_FRAME_HEADER = struct.Struct('<IB')
+COMMS_REPLY_HEADER = struct.Struct('<I')
+COMMS_FLAG_NO_RESPONSE = 1
 
-    try:
 
-        while (neutralL == 0 and neutralR == 0):
-            try:
-                if(initial == 0):
+class CustomCommsBatcher(object):
+    """
+    Queue custom comms messages per skill and send each queue as one framed custom_comms request.
+    The receiving Skill must unpack COMMS_FRAME_HEADER framed messages and reply with
+    COMMS_REPLY_HEADER framed responses.
+    Args:
+        client (HTTPClient): the client to send batches with.
+        max_batch_bytes (int): flush a skill's queue once its framed payload reaches this size.
+        max_delay (float): flush a skill's queue once its oldest message has waited this long.
+    """
 
-                    # prevents the glove from calibrating before the user is ready
-                    previousXL = 1000
-                    previousYL = 1000
-                    previousZL = 1000
+    def __init__(self, client, max_batch_bytes=8192, max_delay=0.02):
+        self.client = client
+        self.max_batch_bytes = max_batch_bytes
+        self.max_delay = max_delay
+        self.batches_sent = 0
+        self._queues = {}
+        self._cond = threading.Condition()
+        self._running = True
+        self._thread = threading.Thread(target=self._run)
+        self._thread.daemon = True
+        self._thread.start()
+
+    def send(self, skill_key, data, no_response=False):
+        """
+        Queue a message for a Skill.
+        Returns:
+            Future: resolves to the Skill's reply bytes, or to None straight away for no_response.
+        """
+        future = Future()
+        with self._cond:
+            queue = self._queues.get(skill_key)
+            if queue is None:
+                queue = self._queues[skill_key] = {'since': monotonic(), 'size': 0, 'messages': []}
+            elif not queue['messages']:
+                queue['since'] = monotonic()
+            queue['messages'].append((data, no_response, future))
+            queue['size'] += COMMS_FRAME_HEADER.size + len(data)
+            # The worker only has to wake up for a new max_delay deadline or a full queue.
+            if len(queue['messages']) == 1 or queue['size'] >= self.max_batch_bytes:
+                self._cond.notify()
+        if no_response:
+            future.set_result(None)
+        return future
+
+    def flush(self):
+        """ Send everything that is queued now, and block until it has been sent. """
+        with self._cond:
+            batches = self._take(lambda queue: True)
+        for skill_key, messages in batches:
+            self._send_batch(skill_key, messages)
+
+    def close(self):
+        with self._cond:
+            self._running = False
+            self._cond.notify()
+        self._thread.join()
+        self.flush()
+
+    def _take(self, ready):
+        """ Remove and return the queued messages of every skill for which ready(queue) holds. """
+        batches = []
+        for skill_key, queue in self._queues.items():
+            if queue['messages'] and ready(queue):
+                batches.append((skill_key, queue['messages']))
+                queue['messages'] = []
+                queue['size'] = 0
+        return batches
+
+    def _run(self):
+        while True:
+            with self._cond:
+                if not self._running:
+                    return
+                now = monotonic()
+                batches = self._take(lambda queue: queue['size'] >= self.max_batch_bytes or
+                                     now - queue['since'] >= self.max_delay)
+                if not batches:
+                    pending = [q['since'] for q in self._queues.values() if q['messages']]
+                    timeout = (min(pending) + self.max_delay - now) if pending else None
+                    self._cond.wait(timeout)
+                    continue
+            for skill_key, messages in batches:
+                self._send_batch(skill_key, messages)
+
+    def _send_batch(self, skill_key, messages):
+        parts = []
+        no_response = True
+        for data, quiet, _ in messages:
+            parts.append(COMMS_FRAME_HEADER.pack(len(data), COMMS_FLAG_NO_RESPONSE if quiet else 0))
+            parts.append(data)
+            no_response = no_response and quiet
+        rpc_request = {
+            'data': base64.b64encode(b''.join(parts)).decode('ascii'),
+            'skill_key': skill_key,
+            'no_response': no_response,
+        }
+        waiting = [future for _, quiet, future in messages if not quiet]
+        try:
+            rpc_response = self.client.request_json('custom_comms', rpc_request)
+            self.batches_sent += 1
+            if no_response:
+                return
+            replies = self._unpack_replies(base64.b64decode(rpc_response['data']))
+        except Exception as error:  # pylint: disable=broad-except
+            fmt_err('Comms Error: {}\n', error)
+            for future in waiting:
+                future.set_exception(error)
+            return
 
-                    previousXR = 1000
-                    previousYR = 1000
-                    previousZR = 1000
+        for i, future in enumerate(waiting):
+            if i < len(replies):
+                future.set_result(replies[i])
+            else:
+                future.set_exception(RuntimeError('No reply from {} for batched message'.format(skill_key)))
+
+    @staticmethod
+    def _unpack_replies(payload):
+        replies = []
+        offset = 0
+        view = memoryview(payload)
+        while offset + COMMS_REPLY_HEADER.size <= len(payload):
+            length, = COMMS_REPLY_HEADER.unpack_from(payload, offset)
+            offset += COMMS_REPLY_HEADER.size
+            replies.append(view[offset:offset + length].tobytes())
+            offset += length
+        return replies
+
+
+# Wire format of a velocity setpoint datagram, 32 bytes, little-endian:
+#   magic     4s   SETPOINT_MAGIC
+#   seq       u32  increments by one per datagram and wraps, to drop reordered or duplicate ones
+#   time      f64  sender's monotonic clock in seconds, only meaningful as a difference
+#   vx vy vz  f32  body-frame velocity in m/s, forward, sideways and vertical (vz is always 0),
+#                  with the signs orientation_to_velocity gives them
+#   yaw_rate  f32  rad/s
+# Nothing on a stock vehicle decodes this. The vehicle needs a Skill that listens on the UDP link
+# port (lcmProxyUdpPort), checks the magic, keeps the highest seq seen and hands the velocity to
+# its motion controller, and that stops the vehicle itself if datagrams stop arriving.
+SETPOINT_STRUCT = struct.Struct('<4sIdffff')
+SETPOINT_MAGIC = b'HEDV'
+
+
+def _scale_axis(angle, deadband, full_scale, limit):
+    """ Map an angle in degrees to [-limit, limit] with a deadband around zero. """
+    if -deadband <= angle <= deadband:
+        return 0.0
+    span = full_scale - deadband
+    value = (abs(angle) - deadband) / span * limit
+    value = min(value, limit)
+    return value if angle > 0 else -value
+
+
+def orientation_to_velocity(imu, max_speed=2.0, max_yaw_rate=1.0, deadband=10.0, full_scale=45.0):
+    """
+    Map glove Euler angles to a velocity setpoint.
+    Tilting the hand forward or back (X) commands forward speed, rolling it (Y) commands
+    sideways speed and twisting it (Z) commands yaw rate. Altitude is held.
+    Args:
+        imu (list): Euler angles as returned by Forte_GetEulerAngles.
+        max_speed (float): speed in m/s commanded at full_scale degrees of tilt.
+        max_yaw_rate (float): yaw rate in rad/s commanded at full_scale degrees of twist.
+        deadband (float): degrees around the calibrated home-point that command nothing.
+        full_scale (float): degrees of tilt that command the maximum.
+    Returns:
+        tuple: (vx, vy, vz, yaw_rate)
+    """
+    X = imu[2]
+    Z = imu[1]
+    Y = imu[0]
+    return (_scale_axis(X, deadband, full_scale, max_speed),
+            _scale_axis(Y, deadband, full_scale, max_speed),
+            0.0,
+            _scale_axis(Z, deadband, full_scale, max_yaw_rate))
 
-                    #pause to allow gloves to to finish connecting, so PRINT commands don't get buried
-                    sleep(5)
 
-                    for i in range(6):
-                        Forte_SelectHapticWave(leftHand, i, 15)
-                        Forte_SelectHapticWave(rightHand, i, 15)
+class VelocityStreamer(object):
+    """
+    Stream velocity setpoints to the vehicle at a fixed rate over the UDP link.
+    Setpoints are packed into a preallocated SETPOINT_STRUCT buffer, so sending costs no
+    allocations. The vehicle needs a Skill that decodes them, see SETPOINT_STRUCT. If update() is
+    not called for deadman_timeout seconds the streamer commands zero velocity, and changes in the
+    commanded velocity are slew limited. It can be stopped and started again, the sampler stops it
+    for every land and starts it again once a takeoff has the vehicle flying.
+    Args:
+        address (tuple): (hostname, port) of the vehicle's UDP link, see get_udp_link_address.
+        rate (float): messages per second.
+        deadman_timeout (float): seconds without an update before commanding a stop.
+        max_accel (float): maximum change in commanded speed, in m/s per second.
+        max_yaw_accel (float): maximum change in commanded yaw rate, in rad/s per second.
+    """
+
+    def __init__(self, address, rate=50.0, deadman_timeout=0.25, max_accel=2.0, max_yaw_accel=2.0):
+        self.address = address
+        self.period = 1.0 / rate
+        self.deadman_timeout = deadman_timeout
+        self.limits = (max_accel, max_accel, max_accel, max_yaw_accel)
+        self.sent = 0
+        self._sock = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+        self._buffer = bytearray(SETPOINT_STRUCT.size)
+        self._target = (0.0, 0.0, 0.0, 0.0)
+        self._command = [0.0, 0.0, 0.0, 0.0]
+        self._updated_at = 0.0
+        self._running = False
+        self._thread = None
+
+    def update(self, vx, vy, vz, yaw_rate):
+        """ Set the velocity to stream. Must be called more often than deadman_timeout. """
+        self._target = (vx, vy, vz, yaw_rate)
+        self._updated_at = monotonic()
+
+    def start(self):
+        """ Start streaming, from a standstill. Does nothing if already streaming. """
+        if self._running:
+            return
+        self._command = [0.0, 0.0, 0.0, 0.0]
+        self._running = True
+        self._thread = threading.Thread(target=self._run)
+        self._thread.daemon = True
+        self._thread.start()
+
+    def stop(self):
+        """ Stop streaming, after sending a final zero setpoint. Does nothing if already stopped. """
+        if not self._running:
+            return
+        self._running = False
+        if self._thread is not threading.current_thread():
+            self._thread.join()
+        self._command = [0.0, 0.0, 0.0, 0.0]
+        self._send(monotonic())
+
+    def _run(self):
+        next_tick = monotonic()
+        while self._running:
+            now = monotonic()
+            self._step(now)
+            # Schedule against absolute deadlines so send jitter doesn't accumulate into drift.
+            next_tick += self.period
+            delay = next_tick - monotonic()
+            if delay > 0:
+                sleep(delay)
+            else:
+                next_tick = monotonic()
+
+    def _step(self, now):
+        target = self._target
+        if now - self._updated_at > self.deadman_timeout:
+            target = (0.0, 0.0, 0.0, 0.0)
+        command = self._command
+        for i in range(4):
+            step = self.limits[i] * self.period
+            delta = target[i] - command[i]
+            if delta > step:
+                delta = step
+            elif delta < -step:
+                delta = -step
+            command[i] += delta
+        self._send(now)
+
+    def _send(self, now):
+        command = self._command
+        SETPOINT_STRUCT.pack_into(self._buffer, 0, SETPOINT_MAGIC, self.sent & 0xFFFFFFFF, now,
+                                  command[0], command[1], command[2], command[3])
+        try:
+            self._sock.sendto(self._buffer, self.address)
+        except socket.error as err:
+            fmt_err('Setpoint send failed: {}\n', err)
+        self.sent += 1
+
+
+# Gesture thresholds used by classify_hand, tuned by hand on real gloves. Finger values are
+# normalized bend (0 = flat, as calibrated), angles are degrees from the calibrated IMU home-point.
+# A positive thumbs_up_roll means Y must be at least that, a negative one means at most that.
+GESTURE_THRESHOLDS = {
+    'left': {
+        'bent': 0.243,  # bend difference between a curled and an extended finger
+        'peace_thumb': 0.04049,
+        'fist_thumb': 0.12146,
+        'fist_total': 2.22672,
+        'flat': 0.080972,
+        'thumbs_up_roll': 60,
+        'palm_away_pitch': (-120, 0),
+        'palm_away_roll': (-25, 25),
+        'flat_pitch': (-25, 25),
+        'flat_roll': (-25, 25),
+    },
+}
+GESTURE_THRESHOLDS['right'] = dict(GESTURE_THRESHOLDS['left'], thumbs_up_roll=-60, flat_roll=(-15, 25))
+
+
+def load_thresholds(path):
+    """ Update GESTURE_THRESHOLDS from a JSON file written by test_scripts/tune_thresholds.py. """
+    with open(path) as f:
+        tuned = json.load(f)
+    for side, settings in tuned.items():
+        for key, value in settings.items():
+            GESTURE_THRESHOLDS[side][key] = tuple(value) if isinstance(value, list) else value
+
+
+# Haptic actuators pulsed to acknowledge each gesture, and what to announce after the pulse.
+# actuatorIDs: 0 = thumb, 1 = index, 2 = middle, 3 = ring, 4 = pinky, 5 = palm
+GESTURE_ACKS = {
+    'THUMBS UP': ((0, 5), "TAKING OFF"),
+    'PEACE': ((1, 2), "Sentry Mode Active"),
+    'GO BULLS': ((1, 4), "SCANNING AREA"),
+    'HALT': ((5,), None),  # skill to be inserted here
+    'LAND': ((0, 1, 2, 3, 4, 5), "LANDING"),
+    'EMERGENCY LAND': ((0, 1, 2, 3, 4, 5), "EMERGENCY LANDING"),
+}
+
+# Client call made for each gesture, as (method name, args...).
+GESTURE_COMMANDS = {
+    'left': {
+        'THUMBS UP': ('takeoff',),
+        'PEACE': ('set_skill', 'security_bot'),
+        'GO BULLS': ('set_skill', 'pano'),
+        'LAND': ('land',),
+    },
+    'right': {
+        'THUMBS UP': ('takeoff',),
+        'GO BULLS': ('set_skill', 'pano'),
+        'LAND': ('land',),
+    },
+    'both': {
+        'EMERGENCY LAND': ('land',),
+    },
+}
+
+# Gestures made with both hands at once, keyed by (left gesture, right gesture).
+JOINT_GESTURES = {
+    ('LAND', 'LAND'): 'EMERGENCY LAND',
+}
+
+# When the hands disagree, these win over whatever the other hand is doing. Any other
+# disagreement is ambiguous and sends nothing.
+OVERRIDING_GESTURES = ('LAND',)
+
+# One synchronized sample of both gloves.
+TwoHandFrame = namedtuple('TwoHandFrame', 'timestamp left_fingers left_imu right_fingers right_imu')
+
+
+def read_frame(left, right):
+    """ Read both gloves back to back into a single TwoHandFrame. """
+    timestamp = monotonic()
+    left_fingers, left_imu = left.fingers(), left.euler()
+    between = monotonic()
+    right_fingers, right_imu = right.fingers(), right.euler()
+    GLOVE_READ_SECONDS['left'].record(between - timestamp)
+    GLOVE_READ_SECONDS['right'].record(monotonic() - between)
+    return TwoHandFrame(timestamp, left_fingers, left_imu, right_fingers, right_imu)
+
+
+def classify_frame(frame):
+    """
+    Recognise what both hands are doing and decide on at most one gesture to act on.
+    Returns:
+        tuple: (side, gesture), where side is 'left', 'right' or 'both'. (None, None) if nothing
+            should happen, including when the hands ask for conflicting commands.
+    """
+    left = classify_hand(frame.left_fingers, frame.left_imu, 'left')
+    right = classify_hand(frame.right_fingers, frame.right_imu, 'right')
+    joint = JOINT_GESTURES.get((left, right))
+    if joint:
+        return 'both', joint
+    if left and right and left != right:
+        if left in OVERRIDING_GESTURES:
+            return 'left', left
+        if right in OVERRIDING_GESTURES:
+            return 'right', right
+        return None, None
+    if left:
+        return 'left', left
+    if right:
+        return 'right', right
+    return None, None
+
+
+def classify_hand(fingers, imu, side):
+    """
+    Recognise a gesture from one glove sample.
+    Args:
+        fingers (list): as returned by Forte_GetFingersNormalized.
+        imu (list): Euler angles as returned by Forte_GetEulerAngles.
+        side (str): 'left' or 'right'.
+    Returns:
+        str: a key of GESTURE_ACKS, or None.
+    """
+    t = GESTURE_THRESHOLDS[side]
+    thumb = round(fingers[0], 4)
+    index = round(fingers[1], 4)
+    middle = round(fingers[2], 4)
+    ring = round(fingers[3], 4)
+    pinky = round(fingers[4], 4)
+    hand = thumb + index + middle + ring + pinky
+
+    X = imu[2]
+    Y = imu[0]
+
+    bent = t['bent']
+    thumbs_up_roll = t['thumbs_up_roll']
+    palm_away = (t['palm_away_pitch'][0] <= X <= t['palm_away_pitch'][1] and
+                 t['palm_away_roll'][0] <= Y <= t['palm_away_roll'][1])
+
+    # THUMBS-UP
+    if (index - thumb >= bent and middle - thumb >= bent and ring - thumb >= bent and pinky - thumb >= bent and
+            (Y >= thumbs_up_roll if thumbs_up_roll > 0 else Y <= thumbs_up_roll)):
+        return 'THUMBS UP'
+    # PEACE SIGN
+    if ring - middle >= bent and pinky - index >= bent and thumb >= t['peace_thumb']:
+        return 'PEACE'
+    # GO BULLS (PALM POINTING AWAY FROM YOU)
+    if middle - index >= bent and ring - pinky >= bent and index <= bent and pinky <= bent and palm_away:
+        return 'GO BULLS'
+    # RAISED FIST ('HALT')
+    if thumb >= t['fist_thumb'] and index >= bent and middle >= bent and hand >= t['fist_total'] and palm_away:
+        return 'HALT'
+    # FLAT PALM WITH FINGERS EXTENDED ('LAND')
+    flat = t['flat']
+    if (thumb <= flat and index <= flat and middle <= flat and ring <= flat and pinky <= flat and
+            t['flat_pitch'][0] <= X <= t['flat_pitch'][1] and t['flat_roll'][0] <= Y <= t['flat_roll'][1]):
+        return 'LAND'
+    return None
+
+
+# Layout of a TwoHandFrame flattened into one array for filtering: five fingers per hand, then
+# the three Euler angles per hand. The angle channels wrap around at +-180 degrees.
+FINGER_CHANNELS = 5
+FRAME_CHANNELS = 2 * FINGER_CHANNELS + 6
+ANGLE_CHANNELS = slice(2 * FINGER_CHANNELS, FRAME_CHANNELS)
+
+
+def frame_to_array(frame, out=None):
+    """ Flatten a TwoHandFrame into a float array with FRAME_CHANNELS channels. """
+    if out is None:
+        out = np.empty(FRAME_CHANNELS)
+    n = FINGER_CHANNELS
+    out[0:n] = frame.left_fingers[:n]
+    out[n:2 * n] = frame.right_fingers[:n]
+    out[2 * n:2 * n + 3] = frame.left_imu[:3]
+    out[2 * n + 3:2 * n + 6] = frame.right_imu[:3]
+    return out
+
+
+def array_to_frame(timestamp, values):
+    """ The inverse of frame_to_array. The fields are views into values. """
+    n = FINGER_CHANNELS
+    return TwoHandFrame(timestamp, values[0:n], values[2 * n:2 * n + 3], values[n:2 * n], values[2 * n + 3:])
+
+
+def wrap_angle(angle):
+    """ Wrap degrees into [-180, 180). Works on scalars and arrays. """
+    return (angle + 180.0) % 360.0 - 180.0
+
+
+class EMAFilter(object):
+    """
+    Exponential moving average over every channel at once.
+    Args:
+        alpha (float or array): smoothing factor per channel, 1 means no smoothing.
+        channels (int): number of channels.
+        angle_channels (slice): the channels holding angles in degrees, which are averaged
+            across the +-180 wrap-around.
+    """
+
+    def __init__(self, alpha=0.5, channels=FRAME_CHANNELS, angle_channels=ANGLE_CHANNELS):
+        self.alpha = np.broadcast_to(np.asarray(alpha, dtype=float), (channels,)).copy()
+        self.angle_channels = angle_channels
+        self.state = np.zeros(channels)
+        self._delta = np.zeros(channels)
+        self._primed = False
+
+    def reset(self):
+        self._primed = False
+
+    def __call__(self, values, timestamp=None):
+        """ Filter one sample in place of the filter state, and return the state. """
+        if not self._primed:
+            self.state[:] = values
+            self._primed = True
+            return self.state
+        delta = np.subtract(values, self.state, out=self._delta)
+        delta[self.angle_channels] = wrap_angle(delta[self.angle_channels])
+        self.state += self.alpha * delta
+        self.state[self.angle_channels] = wrap_angle(self.state[self.angle_channels])
+        return self.state
+
+    def apply(self, frame):
+        """ Filter a TwoHandFrame and return the filtered frame. """
+        return array_to_frame(frame.timestamp, self(frame_to_array(frame), frame.timestamp))
+
+    def filter_array(self, samples, timestamps=None, rate=None):
+        """
+        Filter a recording of shape (samples, channels) from a fresh state, for offline tuning.
+        Args:
+            samples (array): the recording.
+            timestamps (array): the time of each sample in seconds.
+            rate (float): samples per second, for a recording without timestamps.
+        """
+        if timestamps is None and rate:
+            timestamps = np.arange(len(samples)) / float(rate)
+        self.reset()
+        out = np.empty_like(samples, dtype=float)
+        for i in range(len(samples)):
+            out[i] = self(samples[i], None if timestamps is None else timestamps[i])
+        return out
 
-                        Forte_SendHaptic(leftHand, i, note, amplitude)
-                        Forte_SendHaptic(rightHand, i, note, amplitude)
 
-                    print("Please hold both hands flat with fingers extended and palms towards the ground for calibration:")
+class OneEuroFilter(EMAFilter):
+    """
+    One-Euro filter (Casiez et al. 2012) over every channel at once: an EMA whose cutoff frequency
+    rises with the signal's speed, so a held gesture is smooth but a moving hand isn't lagged.
+    Args:
+        min_cutoff (float or array): cutoff frequency in Hz while a channel is still.
+        beta (float or array): how fast the cutoff rises with speed (per channel unit per second).
+        d_cutoff (float): cutoff frequency in Hz for the speed estimate.
+        channels (int): number of channels.
+        angle_channels (slice): the channels holding angles in degrees.
+    """
 
+    def __init__(self, min_cutoff=1.0, beta=0.0, d_cutoff=1.0, channels=FRAME_CHANNELS,
+                 angle_channels=ANGLE_CHANNELS):
+        super(OneEuroFilter, self).__init__(1.0, channels, angle_channels)
+        self.min_cutoff = np.broadcast_to(np.asarray(min_cutoff, dtype=float), (channels,)).copy()
+        self.beta = np.broadcast_to(np.asarray(beta, dtype=float), (channels,)).copy()
+        self.d_cutoff = d_cutoff
+        self.speed = np.zeros(channels)
+        self._last = None
+
+    def reset(self):
+        super(OneEuroFilter, self).reset()
+        self.speed[:] = 0
+        self._last = None
+
+    @staticmethod
+    def _alpha(dt, cutoff):
+        return 1.0 / (1.0 + 1.0 / (2 * np.pi * cutoff * dt))
+
+    def filter_array(self, samples, timestamps=None, rate=None):
+        # The cutoff depends on the time between samples, the time they are filtered at would make
+        # the result depend on how fast this machine is.
+        if timestamps is None and not rate:
+            raise ValueError('OneEuroFilter needs the timestamps or the sample rate of a recording')
+        return super(OneEuroFilter, self).filter_array(samples, timestamps, rate)
+
+    def __call__(self, values, timestamp=None):
+        """ Filter one sample taken at timestamp, by default now for a live sample. """
+        timestamp = monotonic() if timestamp is None else timestamp
+        if not self._primed or timestamp <= self._last:
+            self._last = timestamp
+            return super(OneEuroFilter, self).__call__(values)
+        dt = timestamp - self._last
+        self._last = timestamp
+        delta = np.subtract(values, self.state, out=self._delta)
+        delta[self.angle_channels] = wrap_angle(delta[self.angle_channels])
+        self.speed += self._alpha(dt, self.d_cutoff) * (delta / dt - self.speed)
+        self.alpha = self._alpha(dt, self.min_cutoff + self.beta * np.abs(self.speed))
+        self.state += self.alpha * delta
+        self.state[self.angle_channels] = wrap_angle(self.state[self.angle_channels])
+        return self.state
+
+
+def default_frame_filter():
+    """ One-Euro settings for the sampler's frame_filter: finger bends are 0-1, angles are degrees. """
+    min_cutoff = np.full(FRAME_CHANNELS, 1.5)
+    beta = np.full(FRAME_CHANNELS, 5.0)
+    min_cutoff[ANGLE_CHANNELS] = 1.0
+    beta[ANGLE_CHANNELS] = 0.05
+    return OneEuroFilter(min_cutoff, beta)
+
+
+def is_still(previous, current, tolerance=10):
+    """ True if two Euler angle samples are within tolerance degrees of each other on every axis. """
+    if previous is None:
+        return False
+    return all(-tolerance <= c - p <= tolerance for p, c in zip(previous, current))
+
+
+class GloveDriver(object):
+    """
+    A data-glove. ForteGlove drives Bebop gloves, SimulatedGlove stands in for them.
+    Reads and haptic calls raise GloveDisconnectedException while the glove is disconnected.
+    Subclasses implement fingers(), euler(), connected(), reconnect(), destroy() and the
+    underscored hardware calls, this class keeps track of calibration and of what is playing.
+    Args:
+        handedness (int): 1 for the left-handed glove, 0 for the right-handed glove.
+        note (int): haptic playback speed (0 to 127).
+        amplitude (float): haptic amplitude (0.0 to 1.0).
+    """
 
-                    sleep(0.75)
-                    Forte_SilenceHaptics(leftHand)
-                    Forte_SilenceHaptics(rightHand)
-                    initial = 1
+    def __init__(self, handedness, note=60, amplitude=1):
+        self.handedness = handedness
+        self.note = note
+        self.amplitude = amplitude
+        self.calibrated = False
+        # Actuators and wave of the tracked pulse currently playing, if any.
+        self.playing = None
 
-                sleep(1)
-                print("Calibrating...")
+    def fingers(self):
+        """ Normalized bend of the thumb, index, middle, ring and pinky fingers. """
+        raise NotImplementedError
 
-                Forte_SendHaptic(leftHand, 5, note, amplitude)
-                Forte_SendHaptic(rightHand, 5, note, amplitude)
-                sleep(0.1)
-                Forte_SilenceHaptics(leftHand)
-                Forte_SilenceHaptics(rightHand)
+    def euler(self):
+        """ Euler angles of the hand in degrees, as Forte_GetEulerAngles. """
+        raise NotImplementedError
+
+    def connected(self):
+        raise NotImplementedError
+
+    def reconnect(self):
+        """ Start over with a fresh connection. The IMU home-point is lost. """
+        raise NotImplementedError
 
+    def destroy(self):
+        raise NotImplementedError
 
-                leftIMU = Forte_GetEulerAngles(leftHand)
-                XL = leftIMU[2]
-                ZL = leftIMU[1]
-                YL = leftIMU[0]
+    def calibrate(self):
+        """ Set the current position of the finger sensors to 0, and set the IMU home-point. """
+        self._calibrate_flat()
+        self._home_imu()
+        self.calibrated = True
 
-                rightIMU = Forte_GetEulerAngles(rightHand)
-                XR = rightIMU[2]
-                ZR = rightIMU[1]
-                YR = rightIMU[0]
+    def pulse(self, actuators, wave=15, amplitude=None, track=True):
+        """
+        Start playing a haptic wave on each actuator. Call silence() to stop.
+        amplitude overrides the glove's amplitude for this pulse, 0 stops the actuators.
+        With track False the pulse is left out of playing, so restore() won't replay it, for
+        short-lived pulses whose sender plays them again itself.
+        """
+        start = monotonic()
+        actuators = tuple(actuators)
+        if track:
+            self.playing = (actuators, wave, amplitude)
+        self._pulse(actuators, wave, self.amplitude if amplitude is None else amplitude)
+        HAPTIC_DISPATCH_SECONDS.record(monotonic() - start)
+
+    def silence(self, track=True):
+        """ Stop every actuator. With track False, restore() still replays the tracked pulse. """
+        if track:
+            self.playing = None
+        self._silence()
+
+    def select_wave(self, actuator, wave):
+        """
+        Load a wave into one actuator without playing it, half of what pulse() does per actuator.
+        For timing the hardware calls on their own: it isn't tracked in playing, so restore() won't
+        replay it.
+        """
+        self._select_wave(actuator, wave)
 
-                if (-10 <= XL - previousXL <= 10 and -10 <= YL - previousYL <= 10 and -10 <= ZL - previousZL <= 10 and -10 <= XR - previousXR <= 10 and -10 <= YR - previousYR <= 10 and -10 <= ZR - previousZR <= 10):
+    def send_haptic(self, actuator, amplitude=None):
+        """ Play the wave selected on one actuator at the glove's note. Not tracked either. """
+        self._send_haptic(actuator, self.amplitude if amplitude is None else amplitude)
 
-                    # set current position of finger sensors to 0, and set IMU home-point
-                    Forte_CalibrateFlat(leftHand)
-                    Forte_HomeIMU(leftHand)
+    def restore(self, home_imu=True):
+        """ Reload the saved finger calibration, optionally re-home the IMU, and replay any pulse. """
+        if self.calibrated:
+            self._load_calibration()
+            if home_imu:
+                self._home_imu()
+        playing = self.playing
+        self._silence()
+        if playing:
+            self.pulse(*playing)
 
-                    Forte_CalibrateFlat(rightHand)
-                    Forte_HomeIMU(rightHand)
-                    print("CALIBRATION SUCCESSFUL!  Commands can now be sent.")
+    def _calibrate_flat(self):
+        raise NotImplementedError
 
-                    # Send 2 quick haptic pulses to all actuators to signal that the gloves are calibrated.
-                    for i in range(6):
-                        Forte_SelectHapticWave(leftHand, i, 15)
-                        Forte_SelectHapticWave(rightHand, i, 15)
+    def _load_calibration(self):
+        raise NotImplementedError
 
-                        Forte_SendHaptic(leftHand, i, note, amplitude)
-                        Forte_SendHaptic(rightHand, i, note, amplitude)
+    def _home_imu(self):
+        raise NotImplementedError
 
-                    sleep(0.3)
-                    Forte_SilenceHaptics(leftHand)
-                    Forte_SilenceHaptics(rightHand)
-                    for i in range(6):
-                        Forte_SelectHapticWave(leftHand, i, 15)
-                        Forte_SelectHapticWave(rightHand, i, 15)
-
-                        Forte_SendHaptic(leftHand, i, note, amplitude)
-                        Forte_SendHaptic(rightHand, i, note, amplitude)
-                    sleep(0.5)
-                    Forte_SilenceHaptics(leftHand)
-                    Forte_SilenceHaptics(rightHand)
-                    sleep(2)
+    def _pulse(self, actuators, wave, amplitude):
+        for i in actuators:
+            self._select_wave(i, wave)
+            self._send_haptic(i, amplitude)
 
-                    # prevent the calibration procedure from being reentered
-                    neutralL = 1
-                    neutralR = 1
+    def _select_wave(self, actuator, wave):
+        raise NotImplementedError
 
-                # saves the previous hand data to track motion
-                previousXL = XL
-                previousYL = YL
-                previousZL = ZL
+    def _send_haptic(self, actuator, amplitude):
+        raise NotImplementedError
 
-                previousXR = XR
-                previousYR = YR
-                previousZR = ZR
+    def _silence(self):
+        raise NotImplementedError
 
 
-            except(GloveDisconnectedException):
-                print("Disconnected...")
-                sleep(1)
+class ForteGlove(GloveDriver):
+    """
+    A Bebop Forte data-glove.
+    Args:
+        handedness (int): 1 for the left-handed glove, 0 for the right-handed glove.
+        note (int): haptic playback speed (0 to 127).
+        amplitude (float): haptic amplitude (0.0 to 1.0).
+        calibration_slot (int): slot in the glove's memory that calibrate() saves the finger
+            calibration to, so it can be restored after a reconnect.
+    """
+
+    def __init__(self, handedness, note=60, amplitude=1, calibration_slot=0):
+        super(ForteGlove, self).__init__(handedness, note, amplitude)
+        self.calibration_slot = calibration_slot
+        self.handle = Forte_CreateDataGloveIO(handedness, "")
+
+    def fingers(self):
+        return Forte_GetFingersNormalized(self.handle)
+
+    def euler(self):
+        return Forte_GetEulerAngles(self.handle)
+
+    def connected(self):
+        return bool(Forte_GetConnectionState(self.handle))
+
+    def reconnect(self):
+        Forte_DestroyDataGloveIO(self.handle)
+        self.handle = Forte_CreateDataGloveIO(self.handedness, "")
+
+    def destroy(self):
+        Forte_DestroyDataGloveIO(self.handle)
+
+    def _calibrate_flat(self):
+        Forte_CalibrateFlat(self.handle)
+        Forte_SaveCalibration(self.handle, self.calibration_slot)
+
+    def _load_calibration(self):
+        Forte_LoadCalibration(self.handle, self.calibration_slot)
+
+    def _home_imu(self):
+        Forte_HomeIMU(self.handle)
+
+    def _select_wave(self, actuator, wave):
+        Forte_SelectHapticWave(self.handle, actuator, wave)
+
+    def _send_haptic(self, actuator, amplitude):
+        Forte_SendHaptic(self.handle, actuator, self.note, amplitude)
+
+    def _silence(self):
+        Forte_SilenceHaptics(self.handle)
+
+
+# Left-hand fingers (thumb to pinky) and Euler angles (roll, yaw, pitch, as Forte_GetEulerAngles)
+# that the default GESTURE_THRESHOLDS recognise, for SimulatedGlove. '' is a relaxed hand that
+# isn't any gesture. The right hand rolls the other way for a thumbs up.
+SIMULATED_POSES = {
+    '': ((0.15, 0.15, 0.15, 0.15, 0.15), (0.0, 0.0, 0.0)),
+    'THUMBS UP': ((0.0, 0.6, 0.6, 0.6, 0.6), (80.0, 0.0, 0.0)),
+    'PEACE': ((0.5, 0.05, 0.05, 0.6, 0.6), (0.0, 0.0, 0.0)),
+    'GO BULLS': ((0.5, 0.05, 0.6, 0.6, 0.05), (0.0, 0.0, -60.0)),
+    'HALT': ((0.5, 0.6, 0.6, 0.6, 0.6), (0.0, 0.0, -60.0)),
+    'LAND': ((0.02, 0.02, 0.02, 0.02, 0.02), (0.0, 0.0, 0.0)),
+}
+
+
+class SimulatedGlove(GloveDriver):
+    """
+    A glove that plays a scripted loop of gestures, for running and stress testing the pipeline
+    without hardware. Samples are produced at rate Hz: fingers() blocks until the next one is due
+    and euler() returns the IMU half of the same sample. Poses from SIMULATED_POSES blend into
+    each other over transition seconds, readings get Gaussian noise and the sample period gets
+    Gaussian jitter. Disconnects come at random, disconnect_rate per second on average, or on
+    demand from disconnect().
+    Args:
+        handedness (int): 1 for the left-handed glove, 0 for the right-handed glove.
+        note (int): haptic playback speed, recorded only.
+        amplitude (float): haptic amplitude, recorded only.
+        script (tuple): (gesture, seconds) pairs, played in a loop.
+        rate (float): samples per second, up to a few kHz.
+        transition (float): seconds to move from one pose to the next.
+        finger_noise (float): standard deviation of the finger readings.
+        angle_noise (float): standard deviation of the Euler angles, in degrees.
+        jitter (float): standard deviation of the sample period, in seconds.
+        disconnect_rate (float): average disconnects per second.
+        disconnect_seconds (tuple): shortest and longest disconnect.
+        seed (int): makes the noise, jitter and disconnects repeatable.
+    """
+
+    def __init__(self, handedness, note=60, amplitude=1, script=(('', 3), ('THUMBS UP', 1), ('', 5), ('LAND', 1)),
+                 rate=50.0, transition=0.2, finger_noise=0.01, angle_noise=1.0, jitter=0.0, disconnect_rate=0.0,
+                 disconnect_seconds=(0.5, 2.0), seed=None):
+        super(SimulatedGlove, self).__init__(handedness, note, amplitude)
+        self.side = 'left' if handedness == 1 else 'right'
+        self.script = tuple(script)
+        self.rate = rate
+        self.transition = transition
+        self.finger_noise = finger_noise
+        self.angle_noise = angle_noise
+        self.jitter = jitter
+        self.disconnect_rate = disconnect_rate
+        self.disconnect_seconds = disconnect_seconds
+        self.samples = 0
+        self.disconnects = 0
+        self.haptic_calls = 0
+        self._random = random.Random(seed)
+        self._length = sum(seconds for _, seconds in self.script)
+        self._start = monotonic()
+        self._index = 0
+        self._imu = SIMULATED_POSES[''][1]
+        self._down_until = 0
+        self._next_disconnect = self._schedule_disconnect(self._start)
+
+    def pose_at(self, t):
+        """ The noiseless (fingers, euler) the script calls for t seconds after the glove was created. """
+        t %= self._length
+        previous = self.script[-1][0]
+        for gesture, seconds in self.script:
+            if t < seconds:
+                break
+            t -= seconds
+            previous = gesture
+        fingers, euler = self._pose(gesture)
+        if t < self.transition:
+            weight = t / self.transition
+            old_fingers, old_euler = self._pose(previous)
+            fingers = [a + (b - a) * weight for a, b in zip(old_fingers, fingers)]
+            euler = [a + (b - a) * weight for a, b in zip(old_euler, euler)]
+        return list(fingers), list(euler)
+
+    def _pose(self, gesture):
+        fingers, euler = SIMULATED_POSES[gesture]
+        if gesture == 'THUMBS UP' and self.side == 'right':
+            euler = (-euler[0],) + tuple(euler[1:])
+        return fingers, euler
+
+    def fingers(self):
+        # Each sample is due on a fixed schedule, give or take the jitter, so the jitter and late
+        # wake-ups don't change the average rate.
+        self._index += 1
+        due = self._index / self.rate
+        if self.jitter:
+            due += self._random.gauss(0, self.jitter)
+        delay = self._start + due - monotonic()
+        if delay > 0:
+            sleep(delay)
+        elif delay < -0.05:
+            # A slow reader gets the current sample rather than a burst of late ones.
+            self._index = int((monotonic() - self._start) * self.rate)
+        self._check()
+        self.samples += 1
+        gauss = self._random.gauss
+        fingers, euler = self.pose_at(due)
+        self._imu = [a + gauss(0, self.angle_noise) for a in euler]
+        return [min(1.0, max(0.0, f + gauss(0, self.finger_noise))) for f in fingers]
+
+    def euler(self):
+        self._check()
+        return list(self._imu)
+
+    def disconnect(self, seconds):
+        """ Drop the connection for seconds. """
+        self._down_until = monotonic() + seconds
+        self.disconnects += 1
+
+    def connected(self):
+        return monotonic() >= self._down_until
+
+    def reconnect(self):
+        pass
+
+    def destroy(self):
+        pass
+
+    def _schedule_disconnect(self, now):
+        if not self.disconnect_rate:
+            return float('inf')
+        return now + self._random.expovariate(self.disconnect_rate)
+
+    def _check(self):
+        now = monotonic()
+        if now >= self._next_disconnect:
+            self.disconnect(self._random.uniform(*self.disconnect_seconds))
+            self._next_disconnect = self._schedule_disconnect(self._down_until)
+        if now < self._down_until:
+            raise GloveDisconnectedException("Glove Is Disconnected")
+
+    def _calibrate_flat(self):
+        self._check()
+
+    def _load_calibration(self):
+        self._check()
+
+    def _home_imu(self):
+        pass
+
+    def _select_wave(self, actuator, wave):
+        self._check()
+        self.haptic_calls += 1
+
+    def _send_haptic(self, actuator, amplitude):
+        self._check()
+        self.haptic_calls += 1
+
+    def _silence(self):
+        self._check()
+        self.haptic_calls += 1
+
+
+GLOVE_DRIVERS = {'forte': ForteGlove, 'simulated': SimulatedGlove}
+
+
+def open_glove(handedness, driver='forte', **options):
+    """ Create a glove with the named driver from GLOVE_DRIVERS, passing options to it. """
+    return GLOVE_DRIVERS[driver](handedness, **options)
+
+
+class GloveWatchdog(object):
+    """
+    Reconnects one glove in the background after the sampler reports it disconnected.
+    The sampler calls report() when a read raises GloveDisconnectedException and skips sampling
+    while any watchdog is not ok. The watchdog polls the connection with bounded exponential
+    backoff, replacing the SDK handle after recreate_after failed polls, then restores the glove's
+    calibration and haptic state. A replaced handle loses the IMU home-point, so the operator is
+    prompted with a pulse to hold the hand flat and still, as in calibration, before it is re-homed.
+    Args:
+        glove (GloveDriver): the glove to watch.
+        side (str): 'left' or 'right', for log messages and metrics.
+        min_backoff (float): seconds before the first connection check.
+        max_backoff (float): upper bound on the seconds between checks.
+        recreate_after (int): failed checks before the SDK handle is replaced.
+    """
+
+    def __init__(self, glove, side, min_backoff=0.25, max_backoff=2.0, recreate_after=5):
+        self.glove = glove
+        self.side = side
+        self.min_backoff = min_backoff
+        self.max_backoff = max_backoff
+        self.recreate_after = recreate_after
+        self.ok = True
+        self.outages = 0
+        self.down_since = None
+        self._lock = threading.Lock()
+        self._recovery = METRICS.histogram('hedo_glove_recovery_seconds', 'Time from disconnect to restored glove.',
+                                           side=side)
+
+    def report(self):
+        """ Mark the glove disconnected and start reconnecting, unless that is already under way. """
+        with self._lock:
+            if not self.ok:
+                return
+            self.ok = False
+            self.outages += 1
+            self.down_since = monotonic()
+        fmt_out('{} glove disconnected, reconnecting...\n', self.side)
+        thread = threading.Thread(target=self._recover)
+        thread.daemon = True
+        thread.start()
+
+    def _recover(self):
+        backoff = self.min_backoff
+        failures = 0
+        recreated = False
+        while True:
+            sleep(backoff * random.uniform(0.5, 1))
+            try:
+                if self.glove.connected():
+                    if recreated:
+                        self._wait_until_still()
+                    self.glove.restore(home_imu=recreated)
+                    break
+            except GloveDisconnectedException:
                 pass
+            except Exception as err:  # pylint: disable=broad-except
+                # Whatever the driver raises, keep trying. A watchdog that gives up leaves the glove down.
+                fmt_err('{} glove recovery failed: {}: {}\n', self.side, type(err).__name__, err)
+            failures += 1
+            if failures % self.recreate_after == 0:
+                # Even a reconnect that fails part way may have lost the IMU home-point.
+                recreated = True
+                try:
+                    self.glove.reconnect()
+                except Exception as err:  # pylint: disable=broad-except
+                    fmt_err('{} glove reconnect failed: {}: {}\n', self.side, type(err).__name__, err)
+            backoff = min(backoff * 2, self.max_backoff)
+        elapsed = monotonic() - self.down_since
+        self._recovery.record(elapsed)
+        with self._lock:
+            self.ok = True
+        fmt_out('{} glove reconnected after {:.1f}s\n', self.side, elapsed)
+
+    def _wait_until_still(self, period=1):
+        """ Prompt the operator and wait for two consecutive still IMU readings. """
+        if not self.glove.calibrated:
+            return
+        previous = None
+        while True:
+            # Untracked, so restore() replays whatever the rest of the program last asked the glove to play.
+            self.glove.pulse((5,), track=False)
+            sleep(0.1)
+            self.glove.silence(track=False)
+            current = self.glove.euler()
+            if is_still(previous, current):
+                break
+            previous = current
+            sleep(period)
 
-    except(KeyboardInterrupt):
-        Forte_DestroyDataGloveIO(leftHand)
-        Forte_DestroyDataGloveIO(rightHand)
-        exit()
 
-def left_hand():
+def report_disconnects(watchdogs):
+    """ After a GloveDisconnectedException, hand every glove that has lost its connection to its watchdog. """
+    for watchdog in watchdogs:
+        if not watchdog.glove.connected():
+            watchdog.report()
 
-   #function to receive input from the left hand
 
-    try:
+class OperatorSession(object):
+    """
+    One operator: a glove pair, its calibration and a drone client.
+    Does the same work as calibrate() and sampler_loop(), but one non-blocking step at a time so a
+    SessionHost can multiplex many sessions onto a few threads. Haptic pulses, the gesture cooldown
+    and heartbeats are deadlines rather than sleeps. Client calls run on the host's pools, apart from
+    lands, which get a thread of their own so nothing another session is doing can hold them up.
+    Args:
+        name (str): used in log messages and metrics.
+        client (HTTPClient): the operator's vehicle.
+        left (ForteGlove): the left-handed glove.
+        right (ForteGlove): the right-handed glove.
+        sample_period (float): seconds between glove samples.
+        heartbeat_interval (float): seconds between status updates to the vehicle.
+        cooldown (float): seconds after a gesture during which gestures are ignored.
+        frame_filter (EMAFilter): optional filter applied to every frame before classification.
+            Each session needs its own, the filter keeps per-channel state.
+    """
+
+    def __init__(self, name, client, left, right, sample_period=0.02, heartbeat_interval=2, cooldown=2,
+                 frame_filter=None):
+        self.name = name
+        self.client = client
+        self.gloves = (('left', left), ('right', right))
+        self.frame_filter = frame_filter
+        self.sample_period = sample_period
+        self.heartbeat_interval = heartbeat_interval
+        self.cooldown = cooldown
+        self.state = 'calibrating'
+        self.last_error = None
+        self.metrics = {
+            'steps': 0,
+            'late_steps': 0,
+            'gestures': 0,
+            'commands': 0,
+            'dropped_commands': 0,
+            'command_failures': 0,
+            'heartbeat_failures': 0,
+            'disconnects': 0,
+            'errors': 0,
+        }
+        self._previous = {}
+        self._next_calibration = 0
+        self._silence_at = None
+        self._cooldown_until = 0
+        self._next_heartbeat = 0
+        self._heartbeat = None
+        self._command = None
+        self._outage = False
+        self.watchdogs = [GloveWatchdog(glove, side) for side, glove in self.gloves]
+
+    def step(self, now, io_pool, heartbeat_pool):
+        """
+        Do whatever is due at time now, and return the time this session next wants to run.
+        Commands are sent on io_pool and heartbeats on heartbeat_pool.
+        """
+        self.metrics['steps'] += 1
+        if self._silence_at is not None and now >= self._silence_at:
+            for _, glove in self.gloves:
+                glove.silence()
+            self._silence_at = None
+        if now >= self._next_heartbeat and not self._busy(self._heartbeat, 'heartbeat_failures'):
+            self._heartbeat = heartbeat_pool.submit(self.client.update_pilot_status)
+            self._next_heartbeat = now + self.heartbeat_interval
+
+        try:
+            if self.state == 'calibrating':
+                return self._calibrate(now)
+            if not all(watchdog.ok for watchdog in self.watchdogs):
+                return now + 0.1
+            TRACER.new_trace()
+            with TRACER.span('read', session=self.name):
+                frame = read_frame(self.gloves[0][1], self.gloves[1][1])
+            self._outage = False
+            if self.frame_filter:
+                frame = self.frame_filter.apply(frame)
+            start = monotonic()
+            with TRACER.span('classify'):
+                side, gesture = classify_frame(frame)
+            CLASSIFY_SECONDS.record(monotonic() - start)
+            if gesture and now >= self._cooldown_until:
+                self._act(side, gesture, now, io_pool)
+        except GloveDisconnectedException:
+            report_disconnects(self.watchdogs)
+            if not self._outage:
+                # Fail-safe to land the drone if connection is lost, once per outage. A takeoff in
+                # progress gives way to it.
+                self._outage = True
+                self.metrics['disconnects'] += 1
+                self._command = self._land()
+            return now + 0.1
+        return now + self.sample_period
+
+    def _busy(self, future, failure_metric):
+        """ True if future is still running. Counts it as a failure if it finished with an error. """
+        if future is None:
+            return False
+        if not future.done():
+            return True
+        if future.exception() is not None and not getattr(future, 'counted', False):
+            future.counted = True
+            self.metrics[failure_metric] += 1
+            self.last_error = future.exception()
+        return False
+
+    def _pulse(self, glove, actuators, now, length=0.1):
+        glove.pulse(actuators)
+        self._silence_at = now + length
+
+    def _calibrate(self, now):
+        if now < self._next_calibration:
+            return self._next_calibration
+        self._next_calibration = now + 1
+        still = True
+        for side, glove in self.gloves:
+            imu = glove.euler()
+            still = is_still(self._previous.get(side), imu) and still
+            self._previous[side] = imu
+            self._pulse(glove, (5,), now)
+        if still:
+            for _, glove in self.gloves:
+                glove.calibrate()
+                self._pulse(glove, range(6), now, length=0.3)
+            self.state = 'running'
+            self._cooldown_until = now + self.cooldown
+            fmt_out('{}: CALIBRATION SUCCESSFUL!  Commands can now be sent.\n', self.name)
+        return min(self._next_calibration, self._silence_at)
+
+    def _act(self, side, gesture, now, io_pool):
+        self.metrics['gestures'] += 1
+        self._cooldown_until = now + self.cooldown
+        actuators, _ = GESTURE_ACKS[gesture]
+        with TRACER.span('haptic_ack', gesture=gesture):
+            for glove_side, glove in self.gloves:
+                if side in (glove_side, 'both'):
+                    self._pulse(glove, actuators, now)
+        command = GESTURE_COMMANDS[side].get(gesture)
+        if not command:
+            return
+        # One command in flight per vehicle, a takeoff can take a while. Landing is always let through,
+        # a takeoff in progress gives way to it as it does to the fail-safe.
+        if self._busy(self._command, 'command_failures') and command[0] != 'land':
+            self.metrics['dropped_commands'] += 1
+            return
+        self.metrics['commands'] += 1
+        fmt_out('{}: {}\n', self.name, gesture)
+        if command[0] == 'land':
+            self._command = self._land()
+        else:
+            self._command = io_pool.submit(TRACER.bind(getattr(self.client, command[0])), *command[1:])
+
+    def _land(self):
+        return in_thread(self.client.land)
+
+
+class SessionHost(object):
+    """
+    Run many OperatorSessions in one process on a small fixed pool of worker threads.
+    Sessions are kept in a heap ordered by when they next want to run. A worker pops the earliest
+    due session, steps it and pushes it back. A session that raises is rescheduled, and is retired
+    after max_errors failures without affecting the others.
+    Args:
+        workers (int): threads stepping sessions.
+        io_workers (int): threads for commands. A takeoff holds one until the vehicle is flying.
+        heartbeat_workers (int): threads for heartbeats, kept apart so commands can't delay them.
+        max_errors (int): errors after which a session is retired.
+    """
+
+    def __init__(self, workers=2, io_workers=8, heartbeat_workers=8, max_errors=10):
+        self.workers = workers
+        self.max_errors = max_errors
+        self.sessions = []
+        self.io_pool = ThreadPoolExecutor(max_workers=io_workers)
+        self.heartbeat_pool = ThreadPoolExecutor(max_workers=heartbeat_workers)
+        self._heap = []
+        self._order = itertools.count()
+        self._cond = threading.Condition()
+        self._running = False
+        self._threads = []
+
+    def add(self, session):
+        with self._cond:
+            self.sessions.append(session)
+            heapq.heappush(self._heap, (monotonic(), next(self._order), session))
+            self._cond.notify()
+
+    def start(self):
+        self._running = True
+        for _ in range(self.workers):
+            thread = threading.Thread(target=self._work)
+            thread.daemon = True
+            thread.start()
+            self._threads.append(thread)
+
+    def stop(self):
+        with self._cond:
+            self._running = False
+            self._cond.notify_all()
+        for thread in self._threads:
+            thread.join()
+        self._threads = []
+
+    def metrics(self):
+        """ Return a copy of each session's metrics, keyed by session name. """
+        return dict((s.name, dict(s.metrics, state=s.state)) for s in self.sessions)
+
+    def _work(self):
         while True:
+            with self._cond:
+                while self._running:
+                    delay = self._heap[0][0] - monotonic() if self._heap else None
+                    if delay is not None and delay <= 0:
+                        break
+                    self._cond.wait(delay)
+                if not self._running:
+                    return
+                due, _, session = heapq.heappop(self._heap)
+
+            now = monotonic()
+            if now - due > session.sample_period:
+                session.metrics['late_steps'] += 1
             try:
+                next_due = session.step(now, self.io_pool, self.heartbeat_pool)
+            except Exception as err:  # pylint: disable=broad-except
+                session.metrics['errors'] += 1
+                session.last_error = err
+                if session.metrics['errors'] >= self.max_errors:
+                    session.state = 'failed'
+                    fmt_err('{}: retired after {} errors, last: {}\n', session.name, self.max_errors, err)
+                    continue
+                next_due = now + 1
+
+            with self._cond:
+                heapq.heappush(self._heap, (next_due, next(self._order), session))
+                self._cond.notify()
+
+
+# Layout of one record in a SampleRing. seq is written first and seq_end last, so a reader that
+# sees them equal (and equal to the sequence number it wanted) has read a record that wasn't
+# being overwritten at the time.
+RING_RECORD = np.dtype([
+    ('seq', '<i8'),
+    ('timestamp', '<f8'),
+    ('flags', '<u4'),
+    ('values', '<f8', (FRAME_CHANNELS,)),
+    ('seq_end', '<i8'),
+], align=True)
+RING_HEADER_BYTES = 64
+RING_DISCONNECTED = 1
+
+
+class SampleRing(object):
+    """
+    Fixed-size ring of glove frames in shared memory, written by one process and read by others.
+    There are no locks. The writer publishes a record by bumping the sequence counter in the
+    header, and readers check each record's sequence numbers to detect that it was overwritten.
+    Args:
+        capacity (int): number of records in the ring.
+        name (str): attach to an existing ring with this name instead of creating one.
+    """
+
+    def __init__(self, capacity=256, name=None):
+        from multiprocessing import shared_memory
+
+        self.capacity = capacity
+        size = RING_HEADER_BYTES + capacity * RING_RECORD.itemsize
+        self.shm = shared_memory.SharedMemory(name=name, create=name is None, size=size)
+        self.name = self.shm.name
+        self.head = np.ndarray((1,), dtype='<i8', buffer=self.shm.buf)
+        self.records = np.ndarray((capacity,), dtype=RING_RECORD, buffer=self.shm.buf,
+                                  offset=RING_HEADER_BYTES)
+        if name is None:
+            self.head[0] = 0
+            self.records['seq'] = -1
+            self.records['seq_end'] = -1
+
+    def write(self, timestamp, values, flags=0):
+        """ Append a record. Only one process may write to a ring. """
+        seq = int(self.head[0]) + 1
+        record = self.records[seq % self.capacity]
+        record['seq'] = seq
+        record['timestamp'] = timestamp
+        record['flags'] = flags
+        record['values'] = values
+        record['seq_end'] = seq
+        self.head[0] = seq
+
+    def read(self, seq, out):
+        """
+        Copy record seq's values into out.
+        Returns:
+            tuple: (timestamp, flags), or None if the record has already been overwritten.
+        """
+        record = self.records[seq % self.capacity]
+        if record['seq_end'] != seq:
+            return None
+        timestamp = float(record['timestamp'])
+        flags = int(record['flags'])
+        out[:] = record['values']
+        if record['seq'] != seq:
+            return None
+        return timestamp, flags
+
+    def close(self, unlink=False):
+        # Drop the views first, shared memory can't be closed while they are alive.
+        self.head = self.records = None
+        self.shm.close()
+        if unlink:
+            self.shm.unlink()
+
+
+class RingReader(object):
+    """
+    Turn the records of a SampleRing back into TwoHandFrames.
+    The returned frames are views into a buffer that the next call overwrites. A writer that has
+    died, or has stopped writing for stale_after seconds, reads as disconnected gloves. The glove
+    process keeps writing records while the gloves are disconnected, so only a stuck or dead
+    process goes quiet.
+    Args:
+        ring (SampleRing): the ring to read.
+        poll (float): seconds to sleep while waiting for a new record.
+        stale_after (float): seconds without a new record, once there has been one, after which
+            the writer is taken for stuck.
+        alive (callable): returns False once the writer has died, like Process.is_alive.
+    """
 
-                #LEFT HAND SETUP
+    def __init__(self, ring, poll=0.0005, stale_after=1.0, alive=None):
+        self.ring = ring
+        self.poll = poll
+        self.stale_after = stale_after
+        self.alive = alive
+        self.last = int(ring.head[0])
+        self.skipped = 0
+        self._values = np.zeros(FRAME_CHANNELS)
+        self._advanced_at = None
+
+    def next_frame(self):
+        """ Block until a newer record than the last one returned is available, and return it. """
+        while True:
+            head = int(self.ring.head[0])
+            if head <= self.last:
+                # Calibration comes before the first record, and can take as long as the operator does.
+                stale = self._advanced_at is not None and monotonic() - self._advanced_at > self.stale_after
+                if stale or (self.alive is not None and not self.alive()):
+                    raise GloveDisconnectedException('Glove process stopped writing')
+                sleep(self.poll)
+                continue
+            self._advanced_at = monotonic()
+            # Only the newest frame matters for gesture recognition, skip any backlog.
+            self.skipped += head - self.last - 1
+            self.last = head
+            result = self.ring.read(head, self._values)
+            if result is None:
+                continue
+            timestamp, flags = result
+            if flags & RING_DISCONNECTED:
+                raise GloveDisconnectedException()
+            return array_to_frame(timestamp, self._values)
 
-                for i in range(6):
-                    Forte_SelectHapticWave(leftHand, i, 15)
 
-                leftfingers = Forte_GetFingersNormalized(leftHand)
-                Lthumb = round(leftfingers[0], 4)
-                Lindex = round(leftfingers[1], 4)
-                Lmiddle = round(leftfingers[2], 4)
-                Lring = round(leftfingers[3], 4)
-                Lpinky = round(leftfingers[4], 4)
+class RemoteGlove(object):
+    """ Stand-in for a ForteGlove that lives in the glove process. Forwards haptic calls to it. """
 
-                Lhand = Lthumb + Lindex + Lmiddle + Lring + Lpinky
+    def __init__(self, side, haptics):
+        self.side = side
+        self.haptics = haptics
 
-                leftIMU = Forte_GetEulerAngles(leftHand)
-                XL = leftIMU[2]
-                ZL = leftIMU[1]
-                YL = leftIMU[0]
+    def pulse(self, actuators, wave=15, amplitude=None, track=True):
+        self.haptics.put((self.side, 'pulse' if track else 'untracked_pulse', tuple(actuators), wave, amplitude))
 
-                # LEFT HAND GESTURES
-                # THUMBS-UP
-                if (
-                        Lindex - Lthumb >= 0.243 and Lmiddle - Lthumb >= 0.243 and Lring - Lthumb >= 0.243 and Lpinky - Lthumb >= 0.243 and YL >= 60):
-                    print("THUMBS UP")
+    def silence(self, track=True):
+        self.haptics.put((self.side, 'silence' if track else 'untracked_silence', (), None, None))
 
-                    Forte_SendHaptic(leftHand, 0, note, amplitude)
-                    Forte_SendHaptic(leftHand, 5, note, amplitude)
-                    sleep(0.1)
-                    Forte_SilenceHaptics(leftHand)
+    def destroy(self):
+        self.haptics.put((self.side, 'destroy', (), None, None))
 
-                    droneidle = False
-                    print("TAKING OFF")
-                    client.takeoff()
-                    sleep(2)
 
-                # PEACE SIGN
-                elif (Lring - Lmiddle >= 0.243 and Lpinky - Lindex >= 0.243 and Lthumb >= 0.04049):
-                    print("PEACE")
+HAPTIC_ACTUATORS = 6
 
-                    Forte_SendHaptic(leftHand, 1, note, amplitude)
-                    Forte_SendHaptic(leftHand, 2, note, amplitude)
-                    sleep(0.1)
-                    Forte_SilenceHaptics(leftHand)
+# Patterns HapticFeedback plays, as (actuators, amplitude, seconds) steps played back to back.
+FEEDBACK_PATTERNS = {
+    # Two taps on the thumb and palm once the vehicle is flying.
+    'airborne': (((0, 5), 1.0, 0.15), ((), 0.0, 0.1), ((0, 5), 1.0, 0.15)),
+    # One long buzz on the fingers when it is back on the ground.
+    'grounded': (((1, 2, 3, 4), 1.0, 0.4),),
+    # A light tap on the palm for any other phase change.
+    'phase': (((5,), 0.6, 0.1),),
+    'fault_raised': ((tuple(range(HAPTIC_ACTUATORS)), 1.0, 0.25), ((), 0.0, 0.15)) * 3,
+    'fault_cleared': (((5,), 0.6, 0.1), ((), 0.0, 0.1), ((5,), 0.6, 0.1)),
+}
 
-                    droneidle = False
-                    print("Sentry Mode Active")
-                    client.set_skill("security_bot")
-                    sleep(2)
 
-                # GO BULLS (PALM POINTING AWAY FROM YOU)
-                elif (
-                        Lmiddle - Lindex >= 0.243 and Lring - Lpinky >= 0.243 and Lindex <= 0.243 and Lpinky <= 0.243 and (
-                        0 >= XL >= -120) and (25 >= YL >= -25)):
-                    print("GO BULLS")
+class HapticFeedback(object):
+    """
+    Haptic cues for the vehicle's flight phase, blocking faults and, if the status reports it, how
+    close the nearest obstacle is, played on the gloves from a thread of its own.
+    A cue is either a pattern from FEEDBACK_PATTERNS, which replaces any pattern still playing, or
+    a level: a steady amplitude on some actuators, like the proximity buzz. Each actuator only
+    keeps the amplitude it should have now and gets at most max_rate updates a second, anything in
+    between is coalesced with the latest value winning. So bursts of telemetry never back up on
+    the glove link or hold up sampling, at the cost of pattern steps shorter than 1 / max_rate.
+    Cues are played untracked, so a reconnected glove's restore() doesn't replay a stale one.
+    Call silenced() for a reconnected glove instead, and the cues that should be playing are sent again.
+    Args:
+        gloves (dict): the GloveDriver or RemoteGlove for each side.
+        max_rate (float): updates per second per actuator.
+        wave (int): wave slot every cue is played with.
+        min_change (float): smallest change of a level worth sending.
+        proximity_field (str): '/' separated path of a status field with the distance in metres to
+            the nearest obstacle, or None.
+        proximity_range (tuple): distances at which the proximity buzz is strongest and starts.
+        proximity_actuators (tuple): actuators the proximity buzz is played on.
+        retry_after (float): seconds to leave a disconnected glove alone.
+    """
 
-                    Forte_SendHaptic(leftHand, 1, note, amplitude)
-                    Forte_SendHaptic(leftHand, 4, note, amplitude)
-                    sleep(0.1)
-                    Forte_SilenceHaptics(leftHand)
+    def __init__(self, gloves, max_rate=10.0, wave=15, min_change=0.05, proximity_field=None,
+                 proximity_range=(0.5, 5.0), proximity_actuators=(5,), retry_after=0.5):
+        self.gloves = gloves
+        self.max_rate = max_rate
+        self.wave = wave
+        self.min_change = min_change
+        self.proximity_field = proximity_field
+        self.proximity_range = proximity_range
+        self.proximity_actuators = proximity_actuators
+        self.retry_after = retry_after
+        self.cues = METRICS.counter('hedo_feedback_cues_total', 'Haptic feedback cues requested.')
+        self.updates = dict((side, METRICS.counter('hedo_feedback_updates_total',
+                                                   'Actuator updates sent for haptic feedback.', side=side))
+                            for side in gloves)
+        self._levels = [0.0] * HAPTIC_ACTUATORS
+        self._pattern = None
+        self._silenced = set()
+        self._changed = False
+        # Amplitude last sent to each actuator of each glove, None if unknown, and when. Only the
+        # feedback thread uses it.
+        self._sent = dict(((side, actuator), (0.0, float('-inf')))
+                          for side in gloves for actuator in range(HAPTIC_ACTUATORS))
+        self._phases = {}
+        self._condition = threading.Condition()
+        self._thread = None
+
+    def attach(self, client):
+        """ Subscribe to the status and faults of an HTTPClient, or of every vehicle of a FleetController. """
+        for vehicle in getattr(client, 'clients', [client]):
+            vehicle.history.subscribe(lambda timestamp, status, url=vehicle.baseurl: self.on_status(url, status))
+            vehicle.faults.subscribe(self.on_faults)
+            if self.proximity_field and self.proximity_field not in vehicle.status_fields:
+                vehicle.status_fields += (self.proximity_field,)
+            vehicle.faults.start()
+
+    def start(self):
+        """ Start playing cues, if not already started. """
+        if self._thread:
+            return
+        self._thread = threading.Thread(target=self._run)
+        self._thread.daemon = True
+        self._thread.start()
+
+    def play(self, name):
+        """ Play the pattern FEEDBACK_PATTERNS[name], replacing any pattern still playing. """
+        with self._condition:
+            self._pattern = (monotonic(), FEEDBACK_PATTERNS[name])
+            self.cues.inc()
+            self._changed = True
+            self._condition.notify()
+
+    def set_level(self, actuators, amplitude):
+        """ Hold actuators at amplitude (0.0 to 1.0) on every glove until the next call. """
+        with self._condition:
+            for actuator in actuators:
+                self._levels[actuator] = amplitude
+            self.cues.inc()
+            self._changed = True
+            self._condition.notify()
+
+    def silenced(self, sides):
+        """ Tell the feedback that the gloves of sides were silenced behind its back, so it plays its cues again. """
+        with self._condition:
+            self._silenced.update(sides)
+            self._changed = True
+            self._condition.notify()
+
+    def on_status(self, vehicle, status):
+        phase = status.get('flightPhase')
+        previous = self._phases.get(vehicle)
+        if phase:
+            self._phases[vehicle] = phase
+        if previous and phase and phase != previous:
+            if phase == 'FLYING':
+                self.play('airborne')
+            elif phase in GROUND_PHASES and previous not in GROUND_PHASES:
+                self.play('grounded')
+            else:
+                self.play('phase')
+        if self.proximity_field:
+            distance = _as_float(_get_path(status, self.proximity_field.split('/')))
+            near, far = self.proximity_range
+            level = min(1.0, max(0.0, (far - distance) / (far - near))) if distance == distance else 0.0
+            self.set_level(self.proximity_actuators, level)
+
+    def on_faults(self, raised, cleared):
+        if raised:
+            self.play('fault_raised')
+        elif cleared:
+            self.play('fault_cleared')
+
+    def _targets(self, now):
+        """ The amplitude each actuator should have now, and when the pattern next changes it. """
+        targets = list(self._levels)
+        change = float('inf')
+        if self._pattern:
+            start, steps = self._pattern
+            t = now - start
+            for actuators, amplitude, seconds in steps:
+                if t < seconds:
+                    for actuator in actuators:
+                        targets[actuator] = max(targets[actuator], amplitude)
+                    change = now + seconds - t
+                    break
+                t -= seconds
+            else:
+                self._pattern = None
+        return targets, change
 
-                    droneidle = False
-                    print("SCANNING AREA")
-                    client.set_skill("pano")
-                    sleep(2)
+    def _run(self):
+        while True:
+            with self._condition:
+                self._changed = False
+                now = monotonic()
+                targets, wake = self._targets(now)
+                silenced, self._silenced = self._silenced, set()
+            for (side, actuator), (_, at) in list(self._sent.items()):
+                if side in silenced:
+                    self._sent[side, actuator] = (0.0, at)
+            # The gloves are driven without the lock, so cues never wait on the glove link.
+            for side, glove in self.gloves.items():
+                wake = min(wake, self._send(side, glove, targets, now))
+            with self._condition:
+                if not self._changed:
+                    self._condition.wait(max(0.0, wake - monotonic()) if wake != float('inf') else None)
+
+    def _send(self, side, glove, targets, now):
+        """ Send the targets of one glove that the rate cap allows. Returns when the next held-back one is due. """
+        period = 1.0 / self.max_rate
+        due = float('inf')
+        changes = {}
+        for actuator, amplitude in enumerate(targets):
+            last, at = self._sent[side, actuator]
+            if last is not None and (amplitude == last or (amplitude and last and abs(amplitude - last) < self.min_change)):
+                continue
+            if now < at + period:
+                due = min(due, at + period)
+                continue
+            changes.setdefault(amplitude, []).append(actuator)
+        try:
+            if changes and due == float('inf') and not any(targets):
+                glove.silence(track=False)
+            else:
+                for amplitude, actuators in changes.items():
+                    glove.pulse(actuators, self.wave, amplitude, track=False)
+        except GloveDisconnectedException:
+            # Send everything again once the glove is back.
+            for actuator in range(HAPTIC_ACTUATORS):
+                self._sent[side, actuator] = (None, now + self.retry_after - period)
+            return min(due, now + self.retry_after)
+        for amplitude, actuators in changes.items():
+            for actuator in actuators:
+                self._sent[side, actuator] = (amplitude, now)
+            self.updates[side].inc(len(actuators))
+        return due
 
-                # RAISED FIST ('HALT')
-                elif (Lthumb >= 0.12146 and Lindex >= 0.243 and Lmiddle >= 0.243 and Lhand >= 2.22672 and (
-                        0 >= XL >= -120) and (25 >= YL >= -25)):
-                    print("HALT")
 
-                    Forte_SendHaptic(leftHand, 5, note, amplitude)
-                    sleep(0.1)
-                    Forte_SilenceHaptics(leftHand)
+# Setup
+stream_settings = {'source': 'NATIVE', 'port': 55004}
 
-                    droneidle = False
-                    # skill to be inserted here
-                    sleep(2)
+#add more vehicle urls to this list to fly a fleet with one pair of gloves
+vehicle_urls = ['http://192.168.10.1']
 
-                # FLAT PALM WITH FINGERS EXTENDED ('LAND')
-                elif (Lthumb <= 0.080972 and Lindex <= 0.080972 and Lmiddle <= 0.080972 and Lring <= 0.080972 and Lpinky <= 0.080972 and (-25 <= XL <= 25) and (-25 <= YL <= 25)):
-                    print("LAND")
+#adjust this value to control haptic playback speed (int ranging from 0 to 127)
+note = 60
 
-                    for i in range(6):
-                        Forte_SendHaptic(leftHand, i, note, amplitude)
-                    sleep(0.1)
-                    Forte_SilenceHaptics(leftHand)
+#adjust this value to control haptic amplitude (float ranging from 0.0 to 1.0)
+amplitude = 1
 
-                    droneidle = False
-                    print("LANDING")
-                    client.land()
-                    sleep(2)
+#glove driver from GLOVE_DRIVERS: 'forte' for the Bebop gloves, 'simulated' to run without them
+glove_driver = 'forte'
 
+#extra keyword arguments for the glove driver, e.g. {'rate': 1000, 'disconnect_rate': 0.05} for SimulatedGlove
+glove_options = {}
 
-            except(GloveDisconnectedException):
-                print("Gloves are disconnected...")
-                sleep(1)
+#set to True to fly proportionally with the right hand's orientation, streamed over the UDP link
+continuous_control = False
+streamer = None
 
-                # Fail-safe to land the drone if connection is lost.  Otherwise it would continue to fly
-                # until receiving a new signal.
-                client.land()
-                pass
+#set to default_frame_filter() to smooth the glove data before gestures are recognised, None uses the raw data
+frame_filter = None
 
-    except(KeyboardInterrupt):
-        Forte_DestroyDataGloveIO(leftHand)
+#path to a JSON file of gesture thresholds exported by test_scripts/tune_thresholds.py, or None
+thresholds_file = None
+
+#set to True to read the gloves in their own process, so nothing else in this one can delay sampling
+process_mode = False
+
+#path to also write every log record to as JSON lines, or None
+log_file = None
+
+#port to serve Prometheus metrics on at http://127.0.0.1:<port>/metrics, or None
+metrics_port = None
+
+#seconds between metrics summaries in the log, or None
+metrics_interval = 60
+
+#set to True to feel the vehicle's flight phase and blocking faults through the gloves
+haptic_feedback = False
+
+#extra keyword arguments for HapticFeedback, e.g. {'proximity_field': 'obstacleDistance', 'max_rate': 10}
+feedback_options = {}
+feedback = None
+
+#path to write a Chrome trace of recent gestures and commands to, or None to leave tracing off.
+#The trace is written on SIGUSR1 (Ctrl+Break on Windows) and on exit.
+trace_file = None
+
+
+def connect():
+    """ Create the client for vehicle_urls, or exit if the vehicle can't be reached. """
+    try:
+        if len(vehicle_urls) > 1:
+            # The fleet keeps each vehicle's session alive itself.
+            return FleetController(vehicle_urls,
+                                   pilot=True,
+                                   token_file=0,
+                                   stream_settings=stream_settings)
+        return HTTPClient(vehicle_urls[0],
+                          pilot=True,
+                          token_file=0,
+                          stream_settings=stream_settings)
+    except(OSError):
+        fmt_err("Failed to connect to drone! Exiting...\n")
         exit()
 
 
-def right_hand():
-   # Function to receive input from the right hand
+# Periodically poll the status endpoint to keep ourselves the active pilot.
+def update_loop():
+    while True:
+        try:
+            client.update_pilot_status()
+        except IOError as err:
+            fmt_err('Status update failed: {}\n', err)
+        sleep(2)
+
+
+# This script reads both gloves together in one sampler thread, after a calibration thread has finished.
+
+def calibrate():
+    calibrated = False
+    initial = 0
 
     try:
-        while True:
+
+        while not calibrated:
             try:
+                if(initial == 0):
 
-                #RIGHT HAND SETUP
+                    # prevents the glove from calibrating before the user is ready
+                    previousL = None
+                    previousR = None
 
-                for i in range(6):
-                    Forte_SelectHapticWave(rightHand, i, 15)
+                    #pause to allow gloves to to finish connecting, so PRINT commands don't get buried
+                    sleep(5)
 
-                rightfingers = Forte_GetFingersNormalized(rightHand)
-                Rthumb = round(rightfingers[0], 4)
-                Rindex = round(rightfingers[1], 4)
-                Rmiddle = round(rightfingers[2], 4)
-                Rring = round(rightfingers[3], 4)
-                Rpinky = round(rightfingers[4], 4)
+                    leftHand.pulse(range(6))
+                    rightHand.pulse(range(6))
 
-                Rhand = Rthumb + Rindex + Rmiddle + Rring + Rpinky
+                    fmt_out("Please hold both hands flat with fingers extended and palms towards the ground for calibration:\n")
 
-                rightIMU = Forte_GetEulerAngles(rightHand)
-                XR = rightIMU[2]
-                ZR = rightIMU[1]
-                YR = rightIMU[0]
 
-                # RIGHT HAND GESTURES
-                # THUMBS-UP
-                if (
-                        Rindex - Rthumb >= 0.243 and Rmiddle - Rthumb >= 0.243 and Rring - Rthumb >= 0.243 and Rpinky - Rthumb >= 0.243 and YR <= -60):
-                    print("THUMBS UP")
+                    sleep(0.75)
+                    leftHand.silence()
+                    rightHand.silence()
+                    initial = 1
 
-                    Forte_SendHaptic(rightHand, 0, note, amplitude)
-                    Forte_SendHaptic(rightHand, 5, note, amplitude)
-                    sleep(0.1)
-                    Forte_SilenceHaptics(rightHand)
+                sleep(1)
+                fmt_out("Calibrating...\n")
 
-                    droneidle = False
-                    print("TAKING OFF")
-                    client.takeoff()
-                    sleep(2)
+                leftHand.pulse((5,))
+                rightHand.pulse((5,))
+                sleep(0.1)
+                leftHand.silence()
+                rightHand.silence()
+
+                leftIMU = leftHand.euler()
+                rightIMU = rightHand.euler()
 
-                # PEACE SIGN
-                elif (Rring - Rmiddle >= 0.243 and Rpinky - Rindex >= 0.243 and Rthumb >= 0.04049):
-                    print("PEACE")
+                if is_still(previousL, leftIMU) and is_still(previousR, rightIMU):
 
-                    Forte_SendHaptic(rightHand, 1, note, amplitude)
-                    Forte_SendHaptic(rightHand, 2, note, amplitude)
-                    sleep(0.1)
-                    Forte_SilenceHaptics(rightHand)
+                    leftHand.calibrate()
+                    rightHand.calibrate()
+                    fmt_out("CALIBRATION SUCCESSFUL!  Commands can now be sent.\n")
 
-                    droneidle = False
-                    print("Sentry Mode Active")
-                    #client.set_skill("security_bot")
+                    # Send 2 quick haptic pulses to all actuators to signal that the gloves are calibrated.
+                    leftHand.pulse(range(6))
+                    rightHand.pulse(range(6))
+                    sleep(0.3)
+                    leftHand.silence()
+                    rightHand.silence()
+                    leftHand.pulse(range(6))
+                    rightHand.pulse(range(6))
+                    sleep(0.5)
+                    leftHand.silence()
+                    rightHand.silence()
                     sleep(2)
 
-                # GO BULLS (PALM POINTING AWAY FROM YOU)
-                elif (Rmiddle - Rindex >= 0.243 and Rring - Rpinky >= 0.243 and Rindex <= 0.243 and Rpinky <= 0.243 and (0 >= XR >= -120) and (25 >= YR >= -25)):
-                    print("GO BULLS")
+                    # prevent the calibration procedure from being reentered
+                    calibrated = True
 
-                    Forte_SendHaptic(rightHand, 1, note, amplitude)
-                    Forte_SendHaptic(rightHand, 4, note, amplitude)
-                    sleep(0.1)
-                    Forte_SilenceHaptics(rightHand)
+                # saves the previous hand data to track motion
+                previousL = leftIMU
+                previousR = rightIMU
 
-                    droneidle = False
-                    print("SCANNING AREA")
-                    client.set_skill("pano")
-                    sleep(2)
 
-                # RAISED FIST ('HALT')
-                elif (Rthumb >= 0.12146 and Rindex >= 0.243 and Rmiddle >= 0.243 and Rhand >= 2.22672 and (0 >= XR >= -120) and (25 >= YR >= -25)):
-                    print("HALT")
+            except(GloveDisconnectedException):
+                fmt_out("Disconnected...\n")
+                sleep(1)
+                pass
 
-                    Forte_SendHaptic(rightHand, 5, note, amplitude)
-                    sleep(0.1)
-                    Forte_SilenceHaptics(rightHand)
+    except(KeyboardInterrupt):
+        leftHand.destroy()
+        rightHand.destroy()
+        exit()
 
-                    droneidle = False
-                    # skill to be inserted here
-                    sleep(2)
 
-                # FLAT PALM WITH FINGERS EXTENDED ('LAND')
-                elif (Rthumb <= 0.080972 and Rindex <= 0.080972 and Rmiddle <= 0.080972 and Rring <= 0.080972 and Rpinky <= 0.080972 and (-25 <= XR <= 25) and (-15 <= YR <= 25)):
-                    print("LAND")
+def act_on_gesture(side, gesture):
+    """ Acknowledge a gesture with a haptic pulse and hand its command to send_command(). """
+    actuators, message = GESTURE_ACKS[gesture]
+    fmt_out("{}\n", gesture)
 
-                    for i in range(6):
-                        Forte_SendHaptic(rightHand, i, note, amplitude)
-                    sleep(0.1)
-                    Forte_SilenceHaptics(rightHand)
+    gloves = [glove for glove_side, glove in (('left', leftHand), ('right', rightHand)) if side in (glove_side, 'both')]
+    with TRACER.span('haptic_ack', gesture=gesture):
+        for glove in gloves:
+            glove.pulse(actuators)
+        sleep(0.1)
+        for glove in gloves:
+            glove.silence()
+    if feedback:
+        feedback.silenced(('left', 'right') if side == 'both' else (side,))
 
-                    droneidle = False
-                    print("LANDING")
-                    client.land()
-                    sleep(2)
+    if message:
+        fmt_out("{}\n", message)
+    command = GESTURE_COMMANDS[side].get(gesture)
+    if command:
+        send_command(command)
+
+
+# The one thread gesture commands are sent from, and the command it is working on.
+command_worker = ThreadPoolExecutor(max_workers=1)
+current_command = None
+
+
+def send_command(command):
+    """
+    Send a command from the command worker, so the sampler keeps reading the gloves while the vehicle
+    carries it out. A command is dropped while another is in progress, except a land, which goes
+    straight out on its own thread so a takeoff in progress can give way to it.
+    """
+    global current_command
+    if command[0] == 'land':
+        land_in_background()
+        return
+    if current_command is not None and not current_command.done():
+        fmt_err("Dropped {}: another command is in progress\n", command[0])
+        return
+    current_command = command_worker.submit(TRACER.bind(run_command), command)
+
+
+def run_command(command):
+    try:
+        with TRACER.span('command', command=command[0]):
+            getattr(client, command[0])(*command[1:])
+        # A takeoff that gave way to a land returns too, only stream to a vehicle that is flying.
+        if streamer and command[0] == 'takeoff' and client.flight.known_phase() in AIRBORNE_PHASES:
+            streamer.start()
+    except IOError as err:
+        # A failed command must not kill the worker, the next gesture will try again.
+        fmt_err("Command failed: {}\n", err)
+
+
+def sampler_loop(read=None):
+
+    # function to receive input from both hands. Both gloves are read every tick, so the two hands
+    # can never send conflicting commands. read returns the next TwoHandFrame, by default straight
+    # from the gloves.
+
+    outage = False
+    cooldown_until = 0
+    try:
+        while True:
+            try:
+                if not all(watchdog.ok for watchdog in watchdogs):
+                    sleep(0.05)
+                    continue
+                TRACER.new_trace()
+                with TRACER.span('read'):
+                    frame = read() if read else read_frame(leftHand, rightHand)
+                if outage and feedback:
+                    # The gloves came back silent from restore(), play the feedback's cues again.
+                    feedback.silenced(('left', 'right'))
+                outage = False
+                if frame_filter:
+                    frame = frame_filter.apply(frame)
+
+                if streamer:
+                    streamer.update(*orientation_to_velocity(frame.right_imu))
+
+                start = monotonic()
+                with TRACER.span('classify'):
+                    side, gesture = classify_frame(frame)
+                CLASSIFY_SECONDS.record(monotonic() - start)
+                # Gestures are ignored for a while after one, but sampling carries on.
+                if gesture and monotonic() >= cooldown_until:
+                    act_on_gesture(side, gesture)
+                    cooldown_until = monotonic() + 2
 
             except(GloveDisconnectedException):
-                print("Gloves are disconnected...")
-                sleep(1)
+                report_disconnects(watchdogs)
+                if not outage:
+                    outage = True
+                    fmt_out("Gloves are disconnected...\n")
 
-                # Fail-safe to land the drone if connection is lost.  Otherwise it would continue to fly
-                # until receiving a new signal.
-                client.land()
-                pass
+                    # Fail-safe to land the drone if connection is lost.  Otherwise it would continue to fly
+                    # until receiving a new signal. Once per outage, the watchdogs reconnect the gloves.
+                    land_in_background()
+                sleep(0.05)
 
     except(KeyboardInterrupt):
-        Forte_DestroyDataGloveIO(rightHand)
+        if streamer:
+            streamer.stop()
+        leftHand.destroy()
+        rightHand.destroy()
         exit()
 
-if __name__ == "__main__":
+def land_in_background():
+    """
+    Land from a background thread, so the sampler keeps running while the vehicle comes down.
+    Setpoint streaming stops first, so it can't fight the land.
+    """
+    if streamer:
+        streamer.stop()
+    def land():
+        try:
+            with TRACER.span('command', command='land'):
+                client.land()
+        except IOError as err:
+            fmt_err("Land failed: {}\n", err)
+    thread = threading.Thread(target=TRACER.bind(land))
+    thread.daemon = True
+    thread.start()
 
-    # Creating bootup thread to calibrate both gloves
-    t0 = threading.Thread(target=calibrate)
 
-    # Starting calibration procedure threaad:
-    t0.start()
+def dump_trace(*_):
+    count = TRACER.dump(trace_file)
+    fmt_out('Wrote {} trace spans to {}\n', count, trace_file)
 
-    # Pause once calibration is successful, then move onto the two main threads
-    t0.join()
-    sleep(3)
 
-    # Creating threads for left and right hands to run simultaneously
-    left = threading.Thread(target=left_hand)
-    right = threading.Thread(target=right_hand)
+def glove_process(ring_name, capacity, haptics, note, amplitude, driver='forte', options=None):
+    """ Entry point of the glove process in process_mode: calibrate, then sample into the ring. """
+    try:
+        _sample_into_ring(ring_name, capacity, haptics, note, amplitude, driver, options)
+    finally:
+        # The process ends with os._exit, which skips the atexit flush.
+        LOG.flush()
+
+
+def _sample_into_ring(ring_name, capacity, haptics, note, amplitude, driver, options):
+    global leftHand, rightHand
+    leftHand = open_glove(1, driver, note=note, amplitude=amplitude, **(options or {}))
+    rightHand = open_glove(0, driver, note=note, amplitude=amplitude, **(options or {}))
+    gloves = {'left': leftHand, 'right': rightHand}
+    watchdogs = [GloveWatchdog(leftHand, 'left'), GloveWatchdog(rightHand, 'right')]
+    ring = SampleRing(capacity, name=ring_name)
+    values = np.zeros(FRAME_CHANNELS)
+
+    calibrate()
+    while True:
+        try:
+            # Haptic requests from the main process are handled between samples. A glove that is
+            # reconnecting remembers them and catches up when it is restored.
+            while True:
+                try:
+                    side, action, actuators, wave, amplitude = haptics.get_nowait()
+                except Empty:
+                    break
+                if action in ('pulse', 'untracked_pulse'):
+                    gloves[side].pulse(actuators, wave, amplitude, track=action == 'pulse')
+                elif action in ('silence', 'untracked_silence'):
+                    gloves[side].silence(track=action == 'silence')
+                elif action == 'destroy':
+                    leftHand.destroy()
+                    rightHand.destroy()
+                    return
+            if not all(watchdog.ok for watchdog in watchdogs):
+                ring.write(monotonic(), values, RING_DISCONNECTED)
+                sleep(0.1)
+                continue
+            frame = read_frame(leftHand, rightHand)
+            ring.write(frame.timestamp, frame_to_array(frame, values))
+        except(GloveDisconnectedException):
+            report_disconnects(watchdogs)
+            ring.write(monotonic(), values, RING_DISCONNECTED)
+            sleep(0.05)
+
+if __name__ == "__main__":
 
-    # Starting thread 1
-    left.start()
-    # Starting thread 2
-    right.start()
+    if log_file:
+        LOG.json_stream = open(log_file, 'a')
+    if metrics_port:
+        METRICS.serve(metrics_port)
+    if metrics_interval:
+        METRICS.dump_every(metrics_interval)
+    if trace_file:
+        TRACER.enabled = True
+        signal.signal(getattr(signal, 'SIGUSR1', None) or signal.SIGBREAK, dump_trace)
+        atexit.register(dump_trace)
+
+    if thresholds_file:
+        load_thresholds(thresholds_file)
+
+    client = connect()
+    if isinstance(client, HTTPClient):
+        status_thread = threading.Thread(target=update_loop)
+        status_thread.setDaemon(True)
+        status_thread.start()
+
+    read = None
+    if process_mode:
+        # The glove process calibrates the gloves itself, the sampler waits for its first frame.
+        ring = SampleRing()
+        haptics = multiprocessing.Queue()
+        glove_proc = multiprocessing.Process(target=glove_process,
+                                             args=(ring.name, ring.capacity, haptics, note, amplitude,
+                                                   glove_driver, glove_options))
+        glove_proc.daemon = True
+        glove_proc.start()
+        leftHand = RemoteGlove('left', haptics)
+        rightHand = RemoteGlove('right', haptics)
+        # The glove process reconnects its own gloves.
+        watchdogs = []
+        read = RingReader(ring, alive=glove_proc.is_alive).next_frame
+    else:
+        leftHand = open_glove(1, glove_driver, note=note, amplitude=amplitude, **glove_options)  # 1 for left-handed glove
+        rightHand = open_glove(0, glove_driver, note=note, amplitude=amplitude, **glove_options)  # 0 for right-handed glove
+        watchdogs = [GloveWatchdog(leftHand, 'left'), GloveWatchdog(rightHand, 'right')]
+
+        # Creating bootup thread to calibrate both gloves
+        t0 = threading.Thread(target=calibrate)
+
+        # Starting calibration procedure threaad:
+        t0.start()
+
+        # Pause once calibration is successful, then move onto the sampler thread
+        t0.join()
+        sleep(3)
+
+    if continuous_control and isinstance(client, HTTPClient):
+        streamer = VelocityStreamer(client.get_udp_link_address())
+        streamer.start()
+
+    if haptic_feedback:
+        feedback = HapticFeedback({'left': leftHand, 'right': rightHand}, **feedback_options)
+        feedback.attach(client)
+        feedback.start()
+
+    # Creating one thread to sample both hands
+    sampler = threading.Thread(target=sampler_loop, args=(read,))
+    sampler.start()
 
     # Thread closing
-    left.join()
-    right.join()
+    sampler.join()
+    if process_mode:
+        ring.close(unlink=True)
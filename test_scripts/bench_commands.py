@@ -0,0 +1,99 @@
+"""Count the requests a gesture stream costs with and without HEDO.FlightStateMachine's command filter.
+
+Replays the same stream of left hand gestures through HEDO.send_command, as the sampler hands
+them over, against a StubVehicle (vehicle_stub.py) that starts on the ground. A gesture held
+repeats every two seconds, as with the sampler's cooldown. The operator gives LAND and PEACE on
+the ground, holds THUMBS UP through the takeoff, holds PEACE and then GO BULLS once flying, and
+holds LAND until down. A heartbeat keeps the flight phase fresh, as in main. The second run swaps
+the client's FlightStateMachine for one that lets every intent through. Prints the requests each
+run made to every endpoint, from the stub's per-endpoint Counter, and what the filter dropped.
+
+Example:
+    python bench_commands.py --heartbeat 1
+"""
+
+import argparse
+import contextlib
+import io
+import os
+import sys
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from time import monotonic, sleep
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+import HEDO
+from vehicle_stub import StubVehicle
+
+# (seconds from the start, gesture, seconds held)
+GESTURES = (
+    (0, 'LAND', 3),
+    (2, 'PEACE', 3),
+    (6, 'THUMBS UP', 7),
+    (14, 'PEACE', 5),
+    (20, 'GO BULLS', 3),
+    (24, 'LAND', 5),
+)
+
+
+class Unfiltered(HEDO.FlightStateMachine):
+    """ Tracks the phase like FlightStateMachine, but lets every intent through. """
+
+    def _reject_reason(self, intent, arg, phase):
+        return None
+
+
+def replay(flight, heartbeat, settle):
+    """ Replay GESTURES against a fresh vehicle. Returns its request Counter and the client's filter. """
+    vehicle = StubVehicle()
+    HEDO.client = HEDO.HTTPClient(vehicle.url, pilot=True)
+    if flight:
+        HEDO.client.flight = flight
+    # As main does, the phase is known before the first gesture.
+    HEDO.client.update_pilot_status()
+    HEDO.command_worker = ThreadPoolExecutor(max_workers=1)
+    HEDO.current_command = None
+    stop = threading.Event()
+
+    def beat():
+        while not stop.wait(heartbeat):
+            HEDO.client.update_pilot_status()
+
+    thread = threading.Thread(target=beat)
+    thread.daemon = True
+    thread.start()
+    start = monotonic()
+    for at, gesture, held in GESTURES:
+        for repeat in range(0, held, 2):
+            sleep(max(0.0, start + at + repeat - monotonic()))
+            HEDO.send_command(HEDO.GESTURE_COMMANDS['left'][gesture])
+    sleep(settle)
+    stop.set()
+    thread.join()
+    HEDO.command_worker.shutdown()
+    requests = vehicle.requests.copy()
+    vehicle.close()
+    return requests, HEDO.client.flight
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--heartbeat', type=float, default=1.0, help='seconds between status heartbeats')
+    parser.add_argument('--settle', type=float, default=5.0, help='seconds to let the last commands finish')
+    args = parser.parse_args()
+
+    with contextlib.redirect_stdout(io.StringIO()), contextlib.redirect_stderr(io.StringIO()):
+        filtered, flight = replay(None, args.heartbeat, args.settle)
+        unfiltered, _ = replay(Unfiltered(), args.heartbeat, args.settle)
+    gestures = sum(len(range(0, held, 2)) for _, _, held in GESTURES)
+    print('{} gestures replayed'.format(gestures))
+    print('{:18s} {:>9s} {:>11s}'.format('endpoint', 'filtered', 'unfiltered'))
+    for endpoint in sorted(set(filtered) | set(unfiltered)):
+        print('{:18s} {:9d} {:11d}'.format(endpoint, filtered[endpoint], unfiltered[endpoint]))
+    print('{:18s} {:9d} {:11d}'.format('total', sum(filtered.values()), sum(unfiltered.values())))
+    for reason, count in sorted(flight.dropped.items()):
+        print('dropped {}: {}'.format(reason, count))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,61 @@
+"""Benchmark custom comms throughput, one request per message against CustomCommsBatcher.
+
+Sends messages to a local StubVehicle (vehicle_stub.py), which echoes every message back
+reversed, first with one send_custom_comms request each and then through a CustomCommsBatcher,
+and prints messages per second for both. Every fourth batched message is sent with no_response.
+Also times a lone batched message, which should go out after max_delay.
+
+Example:
+    python bench_comms.py --messages 2000 --size 64
+"""
+
+import argparse
+import os
+import sys
+from time import monotonic
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+import HEDO
+from vehicle_stub import StubVehicle
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--messages', type=int, default=2000)
+    parser.add_argument('--size', type=int, default=16, help='bytes per message')
+    parser.add_argument('--max-batch-bytes', type=int, default=8192)
+    parser.add_argument('--max-delay', type=float, default=0.02)
+    args = parser.parse_args()
+
+    vehicle = StubVehicle()
+    client = HEDO.HTTPClient(vehicle.url, pilot=True)
+    messages = [os.urandom(args.size) for _ in range(args.messages)]
+
+    start = monotonic()
+    for message in messages:
+        reply = client.send_custom_comms('plain', message)
+        assert reply['data'] == message[::-1]
+    unbatched = args.messages / (monotonic() - start)
+
+    batcher = HEDO.CustomCommsBatcher(client, args.max_batch_bytes, args.max_delay)
+    before = vehicle.requests['custom_comms']
+    start = monotonic()
+    futures = [batcher.send('framed', message, no_response=i % 4 == 0) for i, message in enumerate(messages)]
+    for i, (message, future) in enumerate(zip(messages, futures)):
+        assert future.result() == (None if i % 4 == 0 else message[::-1])
+    batched = args.messages / (monotonic() - start)
+    requests = vehicle.requests['custom_comms'] - before
+
+    start = monotonic()
+    batcher.send('framed', b'lone').result(timeout=5)
+    lone = monotonic() - start
+    batcher.close()
+    vehicle.close()
+
+    print('one request per message: {:.0f} msg/s'.format(unbatched))
+    print('batched:                 {:.0f} msg/s in {} requests'.format(batched, requests))
+    print('lone message answered after {:.3f}s (max_delay {}s)'.format(lone, args.max_delay))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,84 @@
+"""Time decoding a vehicle status response with each HEDO.ResponseDecoder backend.
+
+Builds a synthetic status reply of about --kb KB, shaped like a real vehicle's: the few fields the
+client reads on every heartbeat, next to a large nested config. For the json module, orjson and
+simdjson, whichever are installed, prints the time to decode the whole reply and to decode only
+HEDO.STATUS_FIELDS, and the peak memory tracemalloc sees during one decode. The first line is the
+json module on the text of the body, which is what the client did before ResponseDecoder.
+
+Example:
+    python bench_decode.py --kb 96 --repeat 500
+"""
+
+import argparse
+import json
+import os
+import random
+import sys
+import tracemalloc
+from timeit import default_timer
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+import HEDO
+
+
+def blob(rng, depth):
+    if depth == 0:
+        return rng.choice([rng.random(), 'value {}'.format(rng.randint(0, 10 ** 6)), True, None,
+                           rng.randint(0, 10 ** 6)])
+    return dict(('key{}'.format(i), blob(rng, depth - 1)) for i in range(rng.randint(3, 6)))
+
+
+def status_body(kb, seed=1):
+    """ A status reply of about kb kilobytes, as bytes. """
+    rng = random.Random(seed)
+    data = {
+        'sessionId': 'bench-session',
+        'flightPhase': 'FLYING',
+        'accessLevel': 'PILOT',
+        'config': {'deployInfo': {'api_version_major': 18, 'api_version_minor': 5}, 'skills': []},
+    }
+    while len(json.dumps(data)) < kb * 1024:
+        data['config']['skills'].append(blob(rng, 3))
+    return json.dumps({'data': data}).encode()
+
+
+def measure(decode, repeat):
+    """ Microseconds per call and peak KB allocated by one call. """
+    for _ in range(min(repeat, 20)):
+        decode()
+    start = default_timer()
+    for _ in range(repeat):
+        decode()
+    seconds = (default_timer() - start) / repeat
+    tracemalloc.start()
+    decode()
+    _, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    return seconds * 1e6, peak / 1024.0
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--kb', type=float, default=96, help='size of the status reply')
+    parser.add_argument('--repeat', type=int, default=500, help='decodes per measurement')
+    args = parser.parse_args()
+
+    body = status_body(args.kb)
+    print('status reply of {:.1f} KB, projected to {}'.format(len(body) / 1024.0, ', '.join(HEDO.STATUS_FIELDS)))
+    cases = [('json text, whole', lambda: json.loads(body.decode('utf-8'))['data'])]
+    for backend, module in (('json', json), ('orjson', HEDO.orjson), ('simdjson', HEDO.simdjson)):
+        if module is None:
+            print('{} is not installed'.format(backend))
+            continue
+        decoder = HEDO.ResponseDecoder(backend)
+        cases.append(('{}, whole'.format(backend), lambda decoder=decoder: decoder.decode(body)))
+        cases.append(('{}, projected'.format(backend),
+                      lambda decoder=decoder: decoder.decode(body, HEDO.STATUS_FIELDS)))
+    for label, decode in cases:
+        micros, peak = measure(decode, args.repeat)
+        print('{:20s} {:9.1f} us   peak {:8.1f} KB'.format(label, micros, peak))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,108 @@
+"""Measure what HEDO.default_frame_filter() does to gesture recognition, and what it costs per sample.
+
+Builds a recording of a left hand playing SCRIPT at --rate Hz, with the right hand held flat,
+from HEDO.SimulatedGlove's poses plus Gaussian noise of --finger-noise and --angle-noise. Every
+frame is classified with HEDO.classify_frame three times: without noise, with noise, and with
+noise after the filter. Prints for each the number of times the classification changed. The
+changes beyond those of the noiseless recording are spurious. Also prints how long after the
+noiseless recording each run recognised a new gesture, and the time per sample of the filter's
+apply() and of classify_frame.
+
+Example:
+    python bench_filter.py --seconds 60 --rate 200 --angle-noise 3
+"""
+
+import argparse
+import os
+import random
+import sys
+from timeit import default_timer
+
+import numpy as np
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+import HEDO
+
+SCRIPT = (('', 2), ('THUMBS UP', 2), ('', 2), ('PEACE', 2), ('', 2), ('GO BULLS', 2), ('', 2), ('LAND', 2))
+
+
+def recording(seconds, rate, finger_noise, angle_noise, seed=1):
+    """ Noiseless and noisy TwoHandFrames of the left hand playing SCRIPT. """
+    left = HEDO.SimulatedGlove(1, script=SCRIPT)
+    right = HEDO.SimulatedGlove(0, script=(('', 1),))
+    rng = random.Random(seed)
+    clean, noisy = [], []
+    for i in range(int(seconds * rate)):
+        t = i / float(rate)
+        (left_fingers, left_imu), (right_fingers, right_imu) = left.pose_at(t), right.pose_at(t)
+        clean.append(HEDO.TwoHandFrame(t, left_fingers, left_imu, right_fingers, right_imu))
+        noisy.append(HEDO.TwoHandFrame(
+            t, [min(1.0, max(0.0, f + rng.gauss(0, finger_noise))) for f in left_fingers],
+            [a + rng.gauss(0, angle_noise) for a in left_imu],
+            [min(1.0, max(0.0, f + rng.gauss(0, finger_noise))) for f in right_fingers],
+            [a + rng.gauss(0, angle_noise) for a in right_imu]))
+    return clean, noisy
+
+
+def changes(labels):
+    """ Times the classification changed to a gesture at, and the number of changes. """
+    onsets = []
+    count = 0
+    for i in range(1, len(labels)):
+        if labels[i][1] != labels[i - 1][1]:
+            count += 1
+            if labels[i][1]:
+                onsets.append((labels[i][0], labels[i][1]))
+    return onsets, count
+
+
+def delays(reference, labels):
+    """ Seconds from each gesture onset in reference until labels first show that gesture. """
+    out = []
+    for onset, gesture in reference:
+        found = next((t for t, label in labels if t >= onset and label == gesture), None)
+        if found is not None:
+            out.append(found - onset)
+    return np.array(out)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--seconds', type=float, default=60.0, help='length of the recording')
+    parser.add_argument('--rate', type=float, default=200.0, help='samples per second')
+    parser.add_argument('--finger-noise', type=float, default=0.03, help='standard deviation of finger bends')
+    parser.add_argument('--angle-noise', type=float, default=3.0, help='standard deviation of angles, degrees')
+    args = parser.parse_args()
+
+    clean, noisy = recording(args.seconds, args.rate, args.finger_noise, args.angle_noise)
+    start = default_timer()
+    runs = [(name, [(frame.timestamp, HEDO.classify_frame(frame)[1]) for frame in frames])
+            for name, frames in (('noiseless', clean), ('noisy', noisy))]
+    classify_seconds = (default_timer() - start) / (2 * len(clean))
+    # The filtered frame is a view of the filter's state, classify it before the next sample, as the sampler does.
+    frame_filter = HEDO.default_frame_filter()
+    labels = []
+    apply_seconds = []
+    for frame in noisy:
+        start = default_timer()
+        filtered = frame_filter.apply(frame)
+        apply_seconds.append(default_timer() - start)
+        labels.append((frame.timestamp, HEDO.classify_frame(filtered)[1]))
+    runs.append(('noisy, filtered', labels))
+
+    reference, ideal = changes(runs[0][1])
+    print('{:.0f}s at {:.0f} Hz, {} gestures, finger noise {}, angle noise {} deg'.format(
+        args.seconds, args.rate, len(reference), args.finger_noise, args.angle_noise))
+    for name, labels in runs:
+        _, count = changes(labels)
+        late = delays(reference, labels)
+        recognised = '{} of {} recognised, mean delay {:.0f} ms, max {:.0f} ms'.format(
+            len(late), len(reference), late.mean() * 1e3, late.max() * 1e3) if len(late) else 'none recognised'
+        print('{:16s} {:5d} changes, {:5d} spurious, {}'.format(name, count, count - ideal, recognised))
+    apply_seconds = np.array(apply_seconds) * 1e6
+    print('filter apply: {:.1f} us per sample, p99 {:.1f} us; classify_frame: {:.1f} us per sample'.format(
+        apply_seconds.mean(), np.percentile(apply_seconds, 99), classify_seconds * 1e6))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,67 @@
+"""Time landing a fleet through FleetController against landing the vehicles one by one.
+
+Starts one StubVehicle (vehicle_stub.py) per --land-seconds value, each taking that long to land
+from FLYING, and prints how long FleetController.land() takes next to the sum of the land times,
+which is what landing them one after another would cost.
+
+Then lands a fleet that is still taking off: every vehicle takes --takeoff-seconds to reach FLYING,
+and fleet.land() is called --land-after seconds into fleet.takeoff(). Prints how long the land
+took, how long the takeoffs took to give way, and each vehicle's phase at the end. Exits 1 if any
+vehicle isn't back on the ground, or if the land waited for the takeoffs to finish.
+
+Example:
+    python bench_fleet.py --land-seconds 1,2,3,2,1
+"""
+
+import argparse
+import os
+import sys
+import threading
+from time import monotonic, sleep
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+import HEDO
+from vehicle_stub import StubVehicle
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--land-seconds', default='1,2,3,2,1', help='land time of each vehicle')
+    parser.add_argument('--takeoff-seconds', type=float, default=10.0, help='takeoff time of each vehicle')
+    parser.add_argument('--land-after', type=float, default=3.0, help='seconds into the takeoff to land')
+    args = parser.parse_args()
+
+    delays = [float(d) for d in args.land_seconds.split(',')]
+    vehicles = [StubVehicle(phase='FLYING', land_seconds=delay) for delay in delays]
+    fleet = HEDO.FleetController([vehicle.url for vehicle in vehicles], pilot=True)
+    start = monotonic()
+    results = fleet.land()
+    elapsed = monotonic() - start
+    failures = [url for url, result in results.items() if isinstance(result, Exception)]
+    print('fleet of {} landed in {:.2f}s, one by one would take {:.2f}s, {} failed'.format(
+        len(vehicles), elapsed, sum(delays), len(failures)))
+    for vehicle in vehicles:
+        vehicle.close()
+
+    vehicles = [StubVehicle(takeoff_seconds=args.takeoff_seconds, land_seconds=1.0) for _ in delays]
+    fleet = HEDO.FleetController([vehicle.url for vehicle in vehicles], pilot=True)
+    takeoff = threading.Thread(target=fleet.takeoff)
+    takeoff.start()
+    sleep(args.land_after)
+    start = monotonic()
+    fleet.land()
+    landed = monotonic() - start
+    takeoff.join()
+    gave_way = monotonic() - start
+    phases = [vehicle.current_phase() for vehicle in vehicles]
+    print('fleet of {} landed {:.1f}s into a {:.0f}s takeoff in {:.2f}s, takeoffs gave way after {:.2f}s, '
+          'phases {}'.format(len(vehicles), args.land_after, args.takeoff_seconds, landed, gave_way,
+                             ', '.join(phases)))
+    for vehicle in vehicles:
+        vehicle.close()
+    on_ground = all(phase in HEDO.GROUND_PHASES for phase in phases)
+    sys.exit(0 if on_ground and landed < args.takeoff_seconds - args.land_after else 1)
+
+
+if __name__ == '__main__':
+    main()
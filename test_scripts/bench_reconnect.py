@@ -0,0 +1,100 @@
+"""Time how long HEDO.sampler_loop takes to get sampling again after a glove drops out.
+
+Runs the sampler on a pair of simulated gloves held flat, with a client that only counts land
+commands, and drops the gloves' connection in a few scenarios:
+    left:         the left glove is gone for --seconds.
+    left, stale:  as left, but its handle stays dead until the watchdog replaces it, so the IMU
+                  has to be re-homed while the hand is held still.
+    both:         both gloves are gone for --seconds.
+For each, prints when the connection came back, when sampling resumed, and how many land
+commands the outage caused. That should be exactly one.
+
+Example:
+    python bench_reconnect.py --seconds 2
+"""
+
+import argparse
+import os
+import sys
+import threading
+from time import monotonic, sleep
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+import HEDO
+
+
+class StaleHandleGlove(HEDO.SimulatedGlove):
+    """ A simulated glove whose handle can stay dead after an outage until reconnect(). """
+
+    stale = False
+
+    def disconnect(self, seconds, stale=False):
+        super(StaleHandleGlove, self).disconnect(seconds)
+        self.stale = stale
+
+    def connected(self):
+        return not self.stale and super(StaleHandleGlove, self).connected()
+
+    def reconnect(self):
+        self.stale = False
+
+
+class LandCounter(object):
+    def __init__(self):
+        self.lands = 0
+
+    def land(self):
+        self.lands += 1
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--seconds', type=float, default=2.0, help='length of each dropout')
+    parser.add_argument('--rate', type=float, default=200.0, help='glove samples per second')
+    parser.add_argument('--timeout', type=float, default=30.0, help='give up on a scenario after this long')
+    args = parser.parse_args()
+
+    HEDO.client = LandCounter()
+    HEDO.frame_filter = None
+    HEDO.leftHand = StaleHandleGlove(1, script=(('', 1),), rate=args.rate)
+    HEDO.rightHand = StaleHandleGlove(0, script=(('', 1),), rate=args.rate)
+    for glove in (HEDO.leftHand, HEDO.rightHand):
+        glove.calibrate()
+    HEDO.watchdogs = [HEDO.GloveWatchdog(HEDO.leftHand, 'left'), HEDO.GloveWatchdog(HEDO.rightHand, 'right')]
+    reads = []
+
+    def read():
+        frame = HEDO.read_frame(HEDO.leftHand, HEDO.rightHand)
+        reads.append(monotonic())
+        return frame
+
+    sampler = threading.Thread(target=HEDO.sampler_loop, args=(read,))
+    sampler.daemon = True
+    sampler.start()
+
+    failed = False
+    for name, gloves, stale in (('left', (HEDO.leftHand,), False),
+                                ('left, stale', (HEDO.leftHand,), True),
+                                ('both', (HEDO.leftHand, HEDO.rightHand), False)):
+        sleep(1)
+        lands = HEDO.client.lands
+        start = monotonic()
+        for glove in gloves:
+            glove.disconnect(args.seconds, stale)
+        back = start + args.seconds
+        while monotonic() - start < args.timeout:
+            sleep(0.01)
+            if reads[-1] > back and all(watchdog.ok for watchdog in HEDO.watchdogs):
+                break
+        else:
+            failed = True
+        resumed = next((t for t in reads if t > back), None)
+        print('{:12s}: connection back after {:.2f}s, sampling resumed after {}, {} land commands'.format(
+            name, back - start, '{:.2f}s'.format(resumed - start) if resumed else 'never',
+            HEDO.client.lands - lands))
+        failed = failed or HEDO.client.lands - lands != 1
+    sys.exit(1 if failed else 0)
+
+
+if __name__ == '__main__':
+    main()
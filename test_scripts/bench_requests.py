@@ -0,0 +1,80 @@
+"""Benchmark request_json's hedging and check that its circuit breaker recovers.
+
+Against a local StubVehicle (vehicle_stub.py):
+    hedging:  sends the land command requests times with and without hedge=True while a fraction
+              of replies are delayed, and prints p50/p99/max latency.
+    breaker:  fails five requests with 503 to open the circuit, waits for it to half-open, cuts
+              the probe's reply off mid-body, then lets the vehicle recover. Prints how long it
+              took until requests got through again.
+
+Example:
+    python bench_requests.py --requests 200 --slow-fraction 0.03 --slow-seconds 1
+"""
+
+import argparse
+import os
+import sys
+from time import monotonic, sleep
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+import HEDO
+from vehicle_stub import StubVehicle
+
+
+def hedging(client, vehicle, count, slow_fraction, slow_seconds):
+    vehicle.slow_fraction = slow_fraction
+    vehicle.slow_seconds = slow_seconds
+    for hedge in (False, True):
+        latencies = []
+        for _ in range(count):
+            start = monotonic()
+            client.request_json('async_command', {'command': 'land'}, hedge=hedge)
+            latencies.append(monotonic() - start)
+        latencies.sort()
+        pick = lambda p: latencies[min(len(latencies) - 1, int(len(latencies) * p / 100.0))]
+        print('hedge={:<5} p50 {:.3f}s  p99 {:.3f}s  max {:.3f}s'.format(str(hedge), pick(50), pick(99), latencies[-1]))
+    vehicle.slow_fraction = 0
+
+
+def breaker(client, vehicle, give_up=10.0):
+    threshold = client.breaker.failure_threshold
+    vehicle.errors.extend([503] * threshold)
+    for _ in range(threshold):
+        try:
+            client.request_json('status', {}, retries=0)
+        except IOError:
+            pass
+    print('circuit open: {}'.format(client.breaker.opened_at is not None))
+    sleep(client.breaker.reset_timeout + 0.2)
+    vehicle.truncate = 1
+    start = monotonic()
+    while monotonic() - start < give_up:
+        try:
+            client.request_json('status', {}, retries=0)
+            print('requests got through again {:.2f}s after the truncated probe'.format(monotonic() - start))
+            return True
+        except HEDO.CircuitOpenError:
+            sleep(0.1)
+        except IOError as err:
+            print('probe failed: {}'.format(type(err).__name__))
+    print('still failing with CircuitOpenError after {:.0f}s'.format(give_up))
+    return False
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--requests', type=int, default=200, help='requests per hedging run')
+    parser.add_argument('--slow-fraction', type=float, default=0.03, help='fraction of delayed replies')
+    parser.add_argument('--slow-seconds', type=float, default=1.0, help='delay of a slow reply')
+    args = parser.parse_args()
+
+    vehicle = StubVehicle()
+    client = HEDO.HTTPClient(vehicle.url, pilot=True)
+    hedging(client, vehicle, args.requests, args.slow_fraction, args.slow_seconds)
+    ok = breaker(client, vehicle)
+    vehicle.close()
+    sys.exit(0 if ok else 1)
+
+
+if __name__ == '__main__':
+    main()
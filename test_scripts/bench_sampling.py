@@ -0,0 +1,105 @@
+"""Compare glove sampling jitter with the gloves read in the main process and in process_mode.
+
+Reads a pair of simulated gloves (HEDO.SimulatedGlove) at --rate Hz for --seconds, while --load
+threads in the main process keep fetching a large status reply from a StubVehicle
+(vehicle_stub.py) and decoding it. That is the work that competes with the sampler for the GIL.
+Done once with the sampler in the main process, and once with HEDO.glove_process sampling into
+a SampleRing from its own process, as process_mode does. Prints the gaps between consecutive
+samples for each, and how many were over twice the sample period.
+
+Example:
+    python bench_sampling.py --rate 1000 --seconds 3 --load 3
+"""
+
+import argparse
+import multiprocessing
+import os
+import sys
+import threading
+from time import monotonic, sleep
+
+import numpy as np
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+import HEDO
+from vehicle_stub import StubVehicle
+
+
+def glove_process(*args):
+    # The simulated gloves are calibrated from the start, skip the hold-still procedure.
+    HEDO.calibrate = lambda: None
+    HEDO.glove_process(*args)
+
+
+def load(url, stop):
+    client = HEDO.HTTPClient(url, pilot=True)
+    while not stop.is_set():
+        client.request_json('status')
+
+
+def sample_here(rate, seconds):
+    left = HEDO.SimulatedGlove(1, script=(('', 1),), rate=rate)
+    right = HEDO.SimulatedGlove(0, script=(('', 1),), rate=rate)
+    timestamps = []
+    end = monotonic() + seconds
+    while monotonic() < end:
+        timestamps.append(HEDO.read_frame(left, right).timestamp)
+    return np.array(timestamps)
+
+
+def sample_in_process(rate, seconds):
+    ring = HEDO.SampleRing(int(rate * (seconds + 2)) + 1024)
+    haptics = multiprocessing.Queue()
+    process = multiprocessing.Process(target=glove_process,
+                                      args=(ring.name, ring.capacity, haptics, 60, 1, 'simulated',
+                                            {'script': (('', 1),), 'rate': rate}))
+    process.daemon = True
+    process.start()
+    while int(ring.head[0]) == 0:
+        sleep(0.01)
+    first = int(ring.head[0])
+    sleep(seconds)
+    last = int(ring.head[0])
+    haptics.put(('left', 'destroy', (), None, None))
+    process.join()
+    records = ring.records[(np.arange(first, last + 1)) % ring.capacity]
+    timestamps = records['timestamp'].copy()
+    ring.close(unlink=True)
+    return timestamps
+
+
+def summary(timestamps, rate):
+    # A late glove catches up with a burst of samples, so look at the long gaps rather than the median.
+    gaps = np.diff(timestamps) * 1e3
+    period = 1e3 / rate
+    return '{} samples, gap p99 {:.3f} ms, max {:.3f} ms, {} gaps over {:.0f} ms'.format(
+        len(timestamps), np.percentile(gaps, 99), gaps.max(), int(np.sum(gaps > 2 * period)), 2 * period)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--rate', type=float, default=1000.0, help='glove samples per second')
+    parser.add_argument('--seconds', type=float, default=3.0, help='sampling time per mode')
+    parser.add_argument('--load', type=int, default=3, help='threads fetching status replies')
+    parser.add_argument('--padding', type=int, default=300, help='stub status config entries')
+    args = parser.parse_args()
+
+    vehicle = StubVehicle()
+    vehicle.status_padding = args.padding
+    for mode, sample in (('main process', sample_here), ('glove process', sample_in_process)):
+        stop = threading.Event()
+        threads = [threading.Thread(target=load, args=(vehicle.url, stop)) for _ in range(args.load)]
+        for thread in threads:
+            thread.daemon = True
+            thread.start()
+        timestamps = sample(args.rate, args.seconds)
+        stop.set()
+        for thread in threads:
+            thread.join()
+        print('{:13s}: {}'.format(mode, summary(timestamps, args.rate)))
+    print('status requests served: {}'.format(vehicle.requests['status']))
+    vehicle.close()
+
+
+if __name__ == '__main__':
+    main()
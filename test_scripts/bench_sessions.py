@@ -0,0 +1,138 @@
+"""Measure how many operator sessions one SessionHost keeps at their sample rate on one core.
+
+For each --sessions count, hosts that many OperatorSessions, each with a pair of simulated gloves
+held flat and an HTTPClient on a shared StubVehicle (vehicle_stub.py), plus one session whose
+gloves raise on every read, to show a broken session doesn't hold up the others. After the
+sessions have calibrated, prints the steps per second each session managed against the rate it
+asked for, the steps that ran late and the failed heartbeats. The process is pinned to one CPU
+where the platform allows it.
+
+Then checks that sessions stay isolated while others are busy. --takers sessions, each with a
+vehicle of its own that takes --takeoff-seconds to fly, all give THUMBS UP at once. That is more
+takeoffs than the host has command workers. A second later, one session on a flying vehicle gives
+LAND, while a few idle sessions keep their heartbeats going. Prints how long the land took to
+reach its vehicle and the heartbeats the idle sessions sent meanwhile. Exits 1 if the land took
+over a second, or if an idle session missed a heartbeat.
+
+Example:
+    python bench_sessions.py --sessions 10,50,200,500 --seconds 3 --takers 12
+"""
+
+import argparse
+import contextlib
+import io
+import os
+import sys
+from time import monotonic, sleep
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+import HEDO
+from vehicle_stub import StubVehicle
+
+
+class BrokenGlove(HEDO.SimulatedGlove):
+    def fingers(self):
+        raise ValueError('broken glove')
+
+
+def flat_glove(handedness, script=(('', 1),)):
+    # Reads never block, the session's own schedule sets the pace.
+    return HEDO.SimulatedGlove(handedness, script=script, rate=1e6, angle_noise=0.1)
+
+
+def run(url, count, seconds, workers, sample_period):
+    host = HEDO.SessionHost(workers=workers)
+    for i in range(count):
+        host.add(HEDO.OperatorSession('op{}'.format(i), HEDO.HTTPClient(url, pilot=True), flat_glove(1),
+                                      flat_glove(0), sample_period=sample_period))
+    host.add(HEDO.OperatorSession('broken', HEDO.HTTPClient(url, pilot=True), BrokenGlove(1), BrokenGlove(0),
+                                  sample_period=sample_period))
+    host.start()
+    # Calibration takes a couple of one second steps.
+    sleep(2.5)
+    before = host.metrics()
+    start = monotonic()
+    sleep(seconds)
+    after = host.metrics()
+    elapsed = monotonic() - start
+    host.stop()
+    names = [name for name in after if name != 'broken']
+    steps = sum(after[name]['steps'] - before[name]['steps'] for name in names)
+    late = sum(after[name]['late_steps'] - before[name]['late_steps'] for name in names)
+    heartbeat_failures = sum(after[name]['heartbeat_failures'] for name in names)
+    calibrating = sum(1 for name in names if after[name]['state'] == 'calibrating')
+    return steps / elapsed / count, late, heartbeat_failures, calibrating, after['broken']
+
+
+def isolation(takers, takeoff_seconds, idle_count=4, window=6.0):
+    """ Land one session while takers take off. Returns the land latency and the idle heartbeats. """
+    host = HEDO.SessionHost()
+    # The left hand is flat while the sessions calibrate, then gives its gesture once.
+    gesture_at = 3.0
+    vehicles = []
+    for i in range(takers):
+        vehicle = StubVehicle(takeoff_seconds=takeoff_seconds)
+        vehicles.append(vehicle)
+        host.add(HEDO.OperatorSession('taker{}'.format(i), HEDO.HTTPClient(vehicle.url, pilot=True),
+                                      flat_glove(1, (('', gesture_at), ('THUMBS UP', 1), ('', 1000))),
+                                      flat_glove(0)))
+    lander = StubVehicle(phase='FLYING', land_seconds=0.5)
+    host.add(HEDO.OperatorSession('lander', HEDO.HTTPClient(lander.url, pilot=True),
+                                  flat_glove(1, (('', gesture_at + 1), ('LAND', 1), ('', 1000))), flat_glove(0)))
+    idle = StubVehicle()
+    for i in range(idle_count):
+        host.add(HEDO.OperatorSession('idle{}'.format(i), HEDO.HTTPClient(idle.url, pilot=True), flat_glove(1),
+                                      flat_glove(0)))
+    start = monotonic()
+    host.start()
+    sleep(gesture_at + 0.5)
+    heartbeats = idle.requests['status']
+    landed_at = None
+    while monotonic() - start < gesture_at + 0.5 + window:
+        if landed_at is None and lander.requests['async_command']:
+            landed_at = monotonic()
+        sleep(0.01)
+    heartbeats = idle.requests['status'] - heartbeats
+    host.stop()
+    for vehicle in vehicles + [lander, idle]:
+        vehicle.close()
+    # The LAND pose is in place after the script's transition from flat.
+    land_latency = landed_at - (start + gesture_at + 1) if landed_at else None
+    return land_latency, heartbeats / float(idle_count)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--sessions', default='10,50,200,500', help='session counts to try')
+    parser.add_argument('--seconds', type=float, default=3.0, help='measuring time per count')
+    parser.add_argument('--workers', type=int, default=2, help='SessionHost worker threads')
+    parser.add_argument('--rate', type=float, default=50.0, help='samples per second per session')
+    parser.add_argument('--cpu', type=int, default=0, help='CPU to pin the process to')
+    parser.add_argument('--takers', type=int, default=12, help='sessions taking off in the isolation check')
+    parser.add_argument('--takeoff-seconds', type=float, default=20.0, help='takeoff time of their vehicles')
+    args = parser.parse_args()
+
+    if hasattr(os, 'sched_setaffinity'):
+        os.sched_setaffinity(0, {args.cpu})
+    vehicle = StubVehicle()
+    for count in [int(n) for n in args.sessions.split(',')]:
+        # Session start-up and calibration messages would drown the results.
+        with contextlib.redirect_stdout(io.StringIO()):
+            rate, late, heartbeat_failures, calibrating, broken = run(
+                vehicle.url, count, args.seconds, args.workers, 1.0 / args.rate)
+        print('{:4d} sessions: {:5.1f} steps/s per session (target {:.0f}), {} late, {} heartbeat failures, '
+              '{} still calibrating, broken session {} after {} errors'.format(
+                  count, rate, args.rate, late, heartbeat_failures, calibrating, broken['state'], broken['errors']))
+    vehicle.close()
+
+    window = 6.0
+    with contextlib.redirect_stdout(io.StringIO()):
+        land_latency, heartbeats = isolation(args.takers, args.takeoff_seconds, window=window)
+    landed = 'after {:.2f}s'.format(land_latency) if land_latency is not None else 'never'
+    print('{} sessions taking off: land reached its vehicle {}, idle sessions sent {:.1f} heartbeats each in '
+          '{:.0f}s (one per 2s expected)'.format(args.takers, landed, heartbeats, window))
+    sys.exit(0 if land_latency is not None and land_latency < 1.0 and heartbeats >= window / 2 - 1 else 1)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,116 @@
+"""Measure the rate and jitter of HEDO.VelocityStreamer's setpoints, as received by a local UDP sink.
+
+Streams to a socket on 127.0.0.1 at --rate Hz for --seconds while a second thread feeds it a
+tilted hand at --update-rate Hz, as the sampler does, and --load threads keep the GIL busy
+decoding JSON. Prints the received rate, the gaps between setpoints (sd, p99, max) and any lost
+sequence numbers. Then stops updating and prints how long the deadman took to bring the command
+to zero. Last, lands with HEDO.land_in_background() as the sampler would, and prints how many
+setpoints were sent afterwards and whether the last one was zero. Exits 1 if setpoints kept
+coming after the land, or the last one wasn't zero.
+
+Example:
+    python bench_setpoints.py --rate 50 --seconds 5 --load 2
+"""
+
+import argparse
+import json
+import os
+import socket
+import sys
+import threading
+from time import monotonic, sleep
+
+import numpy as np
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+import HEDO
+
+
+class Sink(object):
+    """ A UDP socket that records the arrival time and contents of every setpoint. """
+
+    def __init__(self):
+        self.sock = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+        self.sock.bind(('127.0.0.1', 0))
+        self.address = self.sock.getsockname()
+        self.received = []
+        thread = threading.Thread(target=self._receive)
+        thread.daemon = True
+        thread.start()
+
+    def _receive(self):
+        while True:
+            data = self.sock.recv(64)
+            self.received.append((monotonic(), HEDO.SETPOINT_STRUCT.unpack(data)))
+
+
+class LandCounter(object):
+    def __init__(self):
+        self.lands = 0
+
+    def land(self):
+        self.lands += 1
+
+
+def load(stop):
+    body = json.dumps({'data': [{'key{}'.format(i): i * 0.5} for i in range(2000)]})
+    while not stop.is_set():
+        json.loads(body)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--rate', type=float, default=50.0, help='setpoints per second')
+    parser.add_argument('--seconds', type=float, default=5.0, help='streaming time')
+    parser.add_argument('--update-rate', type=float, default=200.0, help='glove samples per second')
+    parser.add_argument('--load', type=int, default=0, help='threads decoding JSON meanwhile')
+    args = parser.parse_args()
+
+    sink = Sink()
+    streamer = HEDO.VelocityStreamer(sink.address, rate=args.rate)
+    velocity = HEDO.orientation_to_velocity([30, 0, 40])
+    stop = threading.Event()
+    threads = [threading.Thread(target=load, args=(stop,)) for _ in range(args.load)]
+    for thread in threads:
+        thread.daemon = True
+        thread.start()
+
+    streamer.start()
+    end = monotonic() + args.seconds
+    while monotonic() < end:
+        streamer.update(*velocity)
+        sleep(1.0 / args.update_rate)
+    streamed = list(sink.received)
+    updated_at = monotonic()
+    sleep(streamer.deadman_timeout + 2.0)
+    stop.set()
+    for thread in threads:
+        thread.join()
+
+    times = np.array([t for t, _ in streamed])
+    gaps = np.diff(times) * 1e3
+    sequence = np.array([setpoint[1] for _, setpoint in streamed])
+    rate = (len(times) - 1) / (times[-1] - times[0])
+    print('{} setpoints in {:.1f}s: {:.1f}/s (target {:.0f}), gap mean {:.2f} ms, sd {:.3f} ms, p99 {:.2f} ms, '
+          'max {:.2f} ms, {} lost'.format(len(times), times[-1] - times[0], rate, args.rate, gaps.mean(), gaps.std(),
+                                          np.percentile(gaps, 99), gaps.max(),
+                                          int(sequence[-1] - sequence[0] + 1 - len(sequence))))
+    stopped = next((t for t, setpoint in sink.received if t > updated_at and not any(setpoint[3:])), None)
+    print('deadman: zero velocity {} after the last update (timeout {:.2f}s, slew limited)'.format(
+        '{:.2f}s'.format(stopped - updated_at) if stopped else 'never', streamer.deadman_timeout))
+
+    HEDO.client = LandCounter()
+    HEDO.streamer = streamer
+    streamer.update(*velocity)
+    HEDO.land_in_background()
+    sent = streamer.sent
+    sleep(0.5)
+    after = streamer.sent - sent
+    last = sink.received[-1][1]
+    print('land: {} setpoints sent after land_in_background(), last setpoint {}, {} land command'.format(
+        after, 'zero' if not any(last[3:]) else 'moving', HEDO.client.lands))
+    sys.exit(0 if not after and not any(last[3:]) else 1)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,73 @@
+"""Run several simulated hours of status responses through HEDO.StatusHistory and print its memory use.
+
+Records a status every --interval seconds of simulated time, as the client's heartbeat does, for
+--hours hours, without waiting in real time. The flight phase cycles through a takeoff, a flight
+and a land every --flight-minutes minutes, the session id changes every hour as it would after a
+reconnect, and the round trip time is random. After every simulated hour prints the memory
+tracemalloc sees allocated by the history, the rows held in each of its series, and the time per
+record(). Exits 1 if memory grew by more than 1% after the first hour.
+
+Example:
+    python bench_status_history.py --hours 12 --interval 0.5
+"""
+
+import argparse
+import os
+import random
+import sys
+import tracemalloc
+from time import time
+from timeit import default_timer
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+import HEDO
+
+FLIGHT = (('READY_FOR_GROUND_TAKEOFF', 0.2), ('PREP', 0.05), ('FLYING', 0.6), ('LANDING', 0.05), ('REST', 0.1))
+
+
+def phase_at(t, flight_seconds):
+    """ The flight phase t seconds into the run, for flights of flight_seconds. """
+    t %= flight_seconds
+    for phase, share in FLIGHT:
+        if t < share * flight_seconds:
+            return phase
+        t -= share * flight_seconds
+    return FLIGHT[-1][0]
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--hours', type=int, default=12, help='simulated hours')
+    parser.add_argument('--interval', type=float, default=0.5, help='simulated seconds between statuses')
+    parser.add_argument('--flight-minutes', type=float, default=20.0, help='length of each simulated flight')
+    args = parser.parse_args()
+
+    rng = random.Random(1)
+    tracemalloc.start()
+    base = tracemalloc.get_traced_memory()[0]
+    history = HEDO.StatusHistory()
+    print('empty history: {:.1f} KB'.format((tracemalloc.get_traced_memory()[0] - base) / 1024.0))
+    start = time()
+    per_hour = int(3600 / args.interval)
+    first_hour = None
+    for hour in range(1, args.hours + 1):
+        began = default_timer()
+        for i in range((hour - 1) * per_hour, hour * per_hour):
+            t = i * args.interval
+            status = {'flightPhase': phase_at(t, args.flight_minutes * 60), 'accessLevel': 'PILOT',
+                      'sessionId': 'session-{}'.format(hour)}
+            history.record(start + t, status, rng.uniform(0.005, 0.05))
+        micros = (default_timer() - began) / per_hour * 1e6
+        used = tracemalloc.get_traced_memory()[0] - base
+        first_hour = first_hour or used
+        tiers = ', '.join('{:g}s rollup {}'.format(interval, len(series.view()))
+                          for interval, series, _ in history._rollups)
+        print('hour {:3d}: {:8.1f} KB, recent {} rows, {}, {} phase changes, {:.1f} us per record under '
+              'tracemalloc'.format(hour, used / 1024.0, len(history._recent.view()), tiers,
+                                   len(history._changes['flightPhase'].view()), micros))
+    tracemalloc.stop()
+    sys.exit(0 if used <= first_hour * 1.01 else 1)
+
+
+if __name__ == '__main__':
+    main()
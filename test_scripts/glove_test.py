@@ -1,11 +1,16 @@
-from dataglove import *
 from time import *
+from collections import deque
+import argparse
+import os
+import struct
+import sys
 import threading
 
-# This script utilizes multiple threads in order to interact with both gloves independently of each other.
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+from HEDO import GloveDisconnectedException, open_glove
 
-leftHand = Forte_CreateDataGloveIO(1, "")  # 1 for left-handed glove
-rightHand = Forte_CreateDataGloveIO(0, "")  # 0 for right-handed glove
+# This script utilizes multiple threads in order to interact with both gloves independently of each other.
+# The gloves are opened in the main block, Bebop gloves by default or simulated ones with --simulate.
 
 #adjust this value to control haptic playback speed (int ranging from 0 to 127)
 note = 50
@@ -37,37 +42,33 @@ def calibrate():
                     #pause to allow gloves to to finish connecting, so PRINT commands don't get buried
                     sleep(5)
 
-                    for i in range(6):
-                        Forte_SelectHapticWave(leftHand, i, 15)
-                        Forte_SelectHapticWave(rightHand, i, 15)
-
-                        Forte_SendHaptic(leftHand, i, note, amplitude)
-                        Forte_SendHaptic(rightHand, i, note, amplitude)
+                    leftHand.pulse(range(6))
+                    rightHand.pulse(range(6))
 
                     print("Please hold both hands flat with fingers extended and palms towards the ground for calibration:")
 
 
                     sleep(0.75)
-                    Forte_SilenceHaptics(leftHand)
-                    Forte_SilenceHaptics(rightHand)
+                    leftHand.silence()
+                    rightHand.silence()
                     initial = 1
 
                 sleep(1)
                 print("Calibrating...")
 
-                Forte_SendHaptic(leftHand, 5, note, amplitude)
-                Forte_SendHaptic(rightHand, 5, note, amplitude)
+                leftHand.pulse((5,))
+                rightHand.pulse((5,))
                 sleep(0.1)
-                Forte_SilenceHaptics(leftHand)
-                Forte_SilenceHaptics(rightHand)
+                leftHand.silence()
+                rightHand.silence()
 
 
-                leftIMU = Forte_GetEulerAngles(leftHand)
+                leftIMU = leftHand.euler()
                 XL = leftIMU[2]
                 ZL = leftIMU[1]
                 YL = leftIMU[0]
 
-                rightIMU = Forte_GetEulerAngles(rightHand)
+                rightIMU = rightHand.euler()
                 XR = rightIMU[2]
                 ZR = rightIMU[1]
                 YR = rightIMU[0]
@@ -77,32 +78,21 @@ def calibrate():
                 if (-10 <= XL - previousXL <= 10 and -10 <= YL - previousYL <= 10 and -10 <= ZL - previousZL <= 10 and -10 <= XR - previousXR <= 10 and -10 <= YR - previousYR <= 10 and -10 <= ZR - previousZR <= 10):
 
                     # set current position of finger sensors to 0, and set IMU home-point
-                    Forte_CalibrateFlat(leftHand)
-                    Forte_HomeIMU(leftHand)
-
-                    Forte_CalibrateFlat(rightHand)
-                    Forte_HomeIMU(rightHand)
+                    leftHand.calibrate()
+                    rightHand.calibrate()
                     print("CALIBRATION SUCCESSFUL!")
 
-                    for i in range(6):
-                        Forte_SelectHapticWave(leftHand, i, 15)
-                        Forte_SelectHapticWave(rightHand, i, 15)
-
-                        Forte_SendHaptic(leftHand, i, note, amplitude)
-                        Forte_SendHaptic(rightHand, i, note, amplitude)
+                    leftHand.pulse(range(6))
+                    rightHand.pulse(range(6))
 
                     sleep(0.3)
-                    Forte_SilenceHaptics(leftHand)
-                    Forte_SilenceHaptics(rightHand)
-                    for i in range(6):
-                        Forte_SelectHapticWave(leftHand, i, 15)
-                        Forte_SelectHapticWave(rightHand, i, 15)
-
-                        Forte_SendHaptic(leftHand, i, note, amplitude)
-                        Forte_SendHaptic(rightHand, i, note, amplitude)
+                    leftHand.silence()
+                    rightHand.silence()
+                    leftHand.pulse(range(6))
+                    rightHand.pulse(range(6))
                     sleep(0.4)
-                    Forte_SilenceHaptics(leftHand)
-                    Forte_SilenceHaptics(rightHand)
+                    leftHand.silence()
+                    rightHand.silence()
                     sleep(4)
 
                     # prevent the calibration procedure from being reentered
@@ -125,8 +115,8 @@ def calibrate():
                 pass
 
     except(KeyboardInterrupt):
-        Forte_DestroyDataGloveIO(leftHand)
-        Forte_DestroyDataGloveIO(rightHand)
+        leftHand.destroy()
+        rightHand.destroy()
         exit()
 
 def left_hand():
@@ -137,13 +127,7 @@ def left_hand():
         while True:
             try:
 
-                #LEFT HAND SETUP
-
-                for i in range(6):
-                    Forte_SelectHapticWave(leftHand, i, 15)
-
-
-                leftfingers = Forte_GetFingersNormalized(leftHand)
+                leftfingers = leftHand.fingers()
                 Lthumb = round(leftfingers[0], 4)
                 Lindex = round(leftfingers[1], 4)
                 Lmiddle = round(leftfingers[2], 4)
@@ -152,7 +136,7 @@ def left_hand():
 
                 Lhand = Lthumb + Lindex + Lmiddle + Lring + Lpinky
 
-                leftIMU = Forte_GetEulerAngles(leftHand)
+                leftIMU = leftHand.euler()
                 XL = leftIMU[2]
                 ZL = leftIMU[1]
                 YL = leftIMU[0]
@@ -168,20 +152,18 @@ def left_hand():
                         Lindex - Lthumb >= 0.243 and Lmiddle - Lthumb >= 0.243 and Lring - Lthumb >= 0.243 and Lpinky - Lthumb >= 0.243 and YL >= 60):
                     print("L: THUMBS UP")
 
-                    Forte_SendHaptic(leftHand, 0, note, amplitude)
-                    Forte_SendHaptic(leftHand, 5, note, amplitude)
+                    leftHand.pulse((0, 5))
                     sleep(0.1)
-                    Forte_SilenceHaptics(leftHand)
+                    leftHand.silence()
                     sleep(2)
 
                 # PEACE SIGN
                 elif (Lring - Lmiddle >= 0.243 and Lpinky - Lindex >= 0.243 and Lthumb >= 0.04049):
                     print("L: PEACE")
 
-                    Forte_SendHaptic(leftHand, 1, note, amplitude)
-                    Forte_SendHaptic(leftHand, 2, note, amplitude)
+                    leftHand.pulse((1, 2))
                     sleep(0.1)
-                    Forte_SilenceHaptics(leftHand)
+                    leftHand.silence()
                     sleep(2)
 
                 # GO BULLS (PALM POINTING AWAY FROM YOU)
@@ -190,10 +172,9 @@ def left_hand():
                         0 >= XL >= -120) and (25 >= YL >= -25)):
                     print("L: GO BULLS")
 
-                    Forte_SendHaptic(leftHand, 1, note, amplitude)
-                    Forte_SendHaptic(leftHand, 4, note, amplitude)
+                    leftHand.pulse((1, 4))
                     sleep(0.1)
-                    Forte_SilenceHaptics(leftHand)
+                    leftHand.silence()
                     sleep(2)
 
                 # RAISED FIST ('HALT')
@@ -201,19 +182,18 @@ def left_hand():
                         0 >= XL >= -120) and (25 >= YL >= -25)):
                     print("L: HALT")
 
-                    Forte_SendHaptic(leftHand, 5, note, amplitude)
+                    leftHand.pulse((5,))
                     sleep(0.1)
-                    Forte_SilenceHaptics(leftHand)
+                    leftHand.silence()
                     sleep(2)
 
                 # FLAT PALM WITH FINGERS EXTENDED ('LAND')
                 elif (Lthumb <= 0.080972 and Lindex <= 0.080972 and Lmiddle <= 0.080972 and Lring <= 0.080972 and Lpinky <= 0.080972 and (-25 <= XL <= 25) and (-25 <= YL <= 25)):
                     print("L: LAND")
 
-                    for i in range(6):
-                        Forte_SendHaptic(leftHand, i, note, amplitude)
+                    leftHand.pulse(range(6))
                     sleep(0.1)
-                    Forte_SilenceHaptics(leftHand)
+                    leftHand.silence()
                     sleep(2)
 
 
@@ -222,7 +202,7 @@ def left_hand():
                 sleep(1)
                 pass
     except(KeyboardInterrupt):
-        Forte_DestroyDataGloveIO(leftHand)
+        leftHand.destroy()
         exit()
 
 
@@ -234,12 +214,7 @@ def right_hand():
         while True:
             try:
 
-                #RIGHT HAND SETUP
-
-                for i in range(6):
-                    Forte_SelectHapticWave(rightHand, i, 15)
-
-                rightfingers = Forte_GetFingersNormalized(rightHand)
+                rightfingers = rightHand.fingers()
                 Rthumb = round(rightfingers[0], 4)
                 Rindex = round(rightfingers[1], 4)
                 Rmiddle = round(rightfingers[2], 4)
@@ -248,7 +223,7 @@ def right_hand():
 
                 Rhand = Rthumb + Rindex + Rmiddle + Rring + Rpinky
 
-                rightIMU = Forte_GetEulerAngles(rightHand)
+                rightIMU = rightHand.euler()
                 XR = rightIMU[2]
                 ZR = rightIMU[1]
                 YR = rightIMU[0]
@@ -264,49 +239,45 @@ def right_hand():
                         Rindex - Rthumb >= 0.243 and Rmiddle - Rthumb >= 0.243 and Rring - Rthumb >= 0.243 and Rpinky - Rthumb >= 0.243 and YR <= -60):
                     print("R: THUMBS UP")
 
-                    Forte_SendHaptic(rightHand, 0, note, amplitude)
-                    Forte_SendHaptic(rightHand, 5, note, amplitude)
+                    rightHand.pulse((0, 5))
                     sleep(0.1)
-                    Forte_SilenceHaptics(rightHand)
+                    rightHand.silence()
                     sleep(2)
 
                 # PEACE SIGN
                 elif (Rring - Rmiddle >= 0.243 and Rpinky - Rindex >= 0.243 and Rthumb >= 0.04049):
                     print("R: PEACE")
 
-                    Forte_SendHaptic(rightHand, 1, note, amplitude)
-                    Forte_SendHaptic(rightHand, 2, note, amplitude)
+                    rightHand.pulse((1, 2))
                     sleep(0.1)
-                    Forte_SilenceHaptics(rightHand)
+                    rightHand.silence()
                     sleep(2)
 
                 # GO BULLS (PALM POINTING AWAY FROM YOU)
                 elif (Rmiddle - Rindex >= 0.243 and Rring - Rpinky >= 0.243 and Rindex <= 0.243 and Rpinky <= 0.243 and (0 >= XR >= -120) and (25 >= YR >= -25)):
                     print("R: GO BULLS")
 
-                    Forte_SendHaptic(rightHand, 1, note, amplitude)
-                    Forte_SendHaptic(rightHand, 4, note, amplitude)
+                    rightHand.pulse((1, 4))
                     sleep(0.1)
-                    Forte_SilenceHaptics(rightHand)
+                    rightHand.silence()
                     sleep(2)
 
                 # RAISED FIST ('HALT')
                 elif (Rthumb >= 0.12146 and Rindex >= 0.243 and Rmiddle >= 0.243 and Rhand >= 2.22672 and (0 >= XR >= -120) and (25 >= YR >= -25)):
                     print("R: HALT")
 
-                    Forte_SendHaptic(rightHand, 5, note, amplitude)
+                    rightHand.pulse((5,))
                     sleep(0.1)
-                    Forte_SilenceHaptics(rightHand)
+                    rightHand.silence()
                     sleep(2)
 
                 # FLAT PALM WITH FINGERS EXTENDED ('LAND')
                 elif (Rthumb <= 0.080972 and Rindex <= 0.080972 and Rmiddle <= 0.080972 and Rring <= 0.080972 and Rpinky <= 0.080972 and (-25 <= XR <= 25) and (-15 <= YR <= 25)):
                     print("R: LAND")
 
-                    for i in range(6):
-                        Forte_SendHaptic(rightHand, i, note, amplitude)
+                    rightHand.pulse(range(6))
                     sleep(0.1)
-                    Forte_SilenceHaptics(rightHand)
+                    rightHand.silence()
                     sleep(2)
 
             except(GloveDisconnectedException):
@@ -314,12 +285,201 @@ def right_hand():
                 sleep(1)
                 pass
     except(KeyboardInterrupt):
-        Forte_DestroyDataGloveIO(rightHand)
+        rightHand.destroy()
         exit()
 
 
+# DIAGNOSTICS MODE
+# Samples both gloves as fast as they answer (or at a target rate), each from its own thread, and
+# redraws a summary twice a second from another thread so the terminal never slows the samplers.
+
+# Binary dump format: DUMP_MAGIC, then one DUMP_RECORD per sample: monotonic timestamp, glove
+# (0 = right, 1 = left), flags, 5 normalized fingers, 3 Euler angles, and the seconds spent reading
+# the fingers and the Euler angles.
+DUMP_MAGIC = b'GLVDIAG1'
+DUMP_RECORD = struct.Struct('<dBB5f3fff')
+FLAG_DUPLICATE = 1
+FLAG_DISCONNECTED = 2
+
+# number of recent samples percentiles are computed over
+WINDOW = 2000
+
+
+class GloveStats(object):
+    """ Counters and recent timings for one glove. Only its sampler thread writes to it. """
+
+    def __init__(self, name):
+        self.name = name
+        self.samples = 0
+        self.duplicates = 0
+        self.stale_runs = 0
+        self.disconnects = 0
+        self.connected = True
+        self.last_change = None
+        self.intervals = deque(maxlen=WINDOW)
+        self.fingers_latency = deque(maxlen=WINDOW)
+        self.euler_latency = deque(maxlen=WINDOW)
+        self.times = deque(maxlen=WINDOW)
+
+
+def percentiles(values, pcts=(50, 90, 99)):
+    values = sorted(values)
+    if not values:
+        return [float('nan')] * len(pcts)
+    return [values[min(len(values) - 1, int(len(values) * p / 100.0))] for p in pcts]
+
+
+def diagnose_glove(glove, stats, handedness, rate, stale_after, records, running):
+    """ Sample one glove until running is cleared, recording timings into stats and samples into records. """
+    period = 1.0 / rate if rate else 0
+    next_tick = monotonic()
+    previous = None
+    stale = False
+    last = None
+    while running.is_set():
+        if period:
+            next_tick += period
+            delay = next_tick - monotonic()
+            if delay > 0:
+                sleep(delay)
+            else:
+                next_tick = monotonic()
+        try:
+            start = monotonic()
+            fingers = glove.fingers()
+            middle = monotonic()
+            euler = glove.euler()
+            end = monotonic()
+        except(GloveDisconnectedException):
+            if stats.connected:
+                stats.connected = False
+                stats.disconnects += 1
+            if records is not None:
+                records.append((monotonic(), handedness, FLAG_DISCONNECTED, (0,) * 5, (0,) * 3, 0, 0))
+            sleep(0.1)
+            continue
+
+        stats.connected = True
+        stats.samples += 1
+        stats.fingers_latency.append(middle - start)
+        stats.euler_latency.append(end - middle)
+        stats.times.append(end)
+        if last is not None:
+            stats.intervals.append(end - last)
+        last = end
+
+        # A sample identical to the one before it means the SDK handed back its cached values.
+        sample = (tuple(fingers[:5]), tuple(euler))
+        flags = 0
+        if sample == previous:
+            stats.duplicates += 1
+            flags = FLAG_DUPLICATE
+            if not stale and stats.last_change is not None and end - stats.last_change >= stale_after:
+                stale = True
+                stats.stale_runs += 1
+        else:
+            stats.last_change = end
+            stale = False
+        previous = sample
+        if records is not None:
+            records.append((start, handedness, flags, sample[0], sample[1], middle - start, end - middle))
+
+
+def render(all_stats, elapsed):
+    lines = ['Glove diagnostics  {:.0f}s  (Ctrl+C to stop)'.format(elapsed), '']
+    lines.append('{:<6}{:>9}{:>9}{:>30}{:>22}{:>22}{:>7}{:>7}{:>7}'.format(
+        'glove', 'samples', 'Hz', 'interval p50/p90/p99 ms', 'fingers p50/p99 ms', 'euler p50/p99 ms',
+        'dup', 'stale', 'disc'))
+    for stats in all_stats:
+        times = list(stats.times)
+        # achieved rate over the last second of samples
+        recent = [t for t in times if t >= monotonic() - 1]
+        hz = len(recent) / (recent[-1] - recent[0]) if len(recent) > 1 and recent[-1] > recent[0] else 0.0
+        interval = percentiles(list(stats.intervals))
+        fingers = percentiles(list(stats.fingers_latency), (50, 99))
+        euler = percentiles(list(stats.euler_latency), (50, 99))
+        lines.append('{:<6}{:>9}{:>9.1f}{:>30}{:>22}{:>22}{:>7}{:>7}{:>7}'.format(
+            stats.name, stats.samples, hz,
+            '/'.join('{:.2f}'.format(v * 1000) for v in interval),
+            '/'.join('{:.2f}'.format(v * 1000) for v in fingers),
+            '/'.join('{:.2f}'.format(v * 1000) for v in euler),
+            stats.duplicates, stats.stale_runs,
+            stats.disconnects if stats.connected else '{}!'.format(stats.disconnects)))
+    return '\n'.join(lines) + '\n'
+
+
+def write_records(records, dump):
+    while records:
+        timestamp, handedness, flags, fingers, euler, fingers_latency, euler_latency = records.popleft()
+        dump.write(DUMP_RECORD.pack(timestamp, handedness, flags, *(tuple(fingers) + tuple(euler) +
+                                                                   (fingers_latency, euler_latency))))
+
+
+def diagnose(rate=0, duration=None, dump_path=None, stale_after=0.25, refresh=0.5):
+    """ Run the diagnostics view until Ctrl+C or for duration seconds, optionally dumping every sample. """
+    all_stats = [GloveStats('left'), GloveStats('right')]
+    running = threading.Event()
+    running.set()
+    records = deque() if dump_path else None
+    dump = open(dump_path, 'wb') if dump_path else None
+    if dump:
+        dump.write(DUMP_MAGIC)
+
+    threads = [threading.Thread(target=diagnose_glove, args=(glove, stats, handedness, rate, stale_after, records, running))
+               for glove, stats, handedness in ((leftHand, all_stats[0], 1), (rightHand, all_stats[1], 0))]
+    for thread in threads:
+        thread.daemon = True
+        thread.start()
+
+    start = monotonic()
+    try:
+        while duration is None or monotonic() - start < duration:
+            sleep(refresh)
+            # One write per refresh: move home, draw, clear anything left over from the last frame.
+            sys.stdout.write('\033[H' + render(all_stats, monotonic() - start) + '\033[J')
+            sys.stdout.flush()
+            if dump:
+                write_records(records, dump)
+    except(KeyboardInterrupt):
+        pass
+    running.clear()
+    for thread in threads:
+        thread.join()
+    print(render(all_stats, monotonic() - start))
+    if dump:
+        write_records(records, dump)
+        dump.close()
+        print("Wrote {}".format(dump_path))
+    leftHand.destroy()
+    rightHand.destroy()
+
+
 if __name__ == "__main__":
 
+    parser = argparse.ArgumentParser(description="Print recognized gestures, or with --diagnose, measure glove sampling.")
+    parser.add_argument('--diagnose', action='store_true', help='show sampling rate, jitter and BLE latency instead of gestures')
+    parser.add_argument('--rate', type=float, default=0, help='target samples per second per glove, 0 for as fast as possible')
+    parser.add_argument('--duration', type=float, help='stop after this many seconds')
+    parser.add_argument('--dump', help='write every sample to this binary file')
+    parser.add_argument('--calibrate', action='store_true', help='calibrate before diagnosing')
+    parser.add_argument('--simulate', type=float, metavar='HZ',
+                        help='use simulated gloves that produce HZ samples per second instead of the Bebop gloves')
+    args = parser.parse_args()
+
+    if args.simulate:
+        leftHand = open_glove(1, 'simulated', note=note, amplitude=amplitude, rate=args.simulate)
+        rightHand = open_glove(0, 'simulated', note=note, amplitude=amplitude, rate=args.simulate)
+    else:
+        leftHand = open_glove(1, note=note, amplitude=amplitude)  # 1 for left-handed glove
+        rightHand = open_glove(0, note=note, amplitude=amplitude)  # 0 for right-handed glove
+
+    if args.diagnose:
+        if args.calibrate:
+            calibrate()
+        sys.stdout.write('\033[2J')
+        diagnose(args.rate, args.duration, args.dump)
+        exit()
+
     # creating bootup thread to calibrate both gloves
     t0 = threading.Thread(target=calibrate)
 
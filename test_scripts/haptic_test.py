@@ -1,5 +1,14 @@
-from dataglove import *
 from time import *
+from collections import deque
+import argparse
+import itertools
+import json
+import os
+import sys
+import threading
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+from HEDO import GloveDisconnectedException, open_glove
 
 """This script allows for testing the 6 haptic actuators within the gloves (using only one glove for simplicity's sake)
 
@@ -9,36 +18,248 @@ The actuators contain 16 wav slots, numbered 0-15 with various sounds pre-loaded
 The final three slots are single-cycle waveforms---triangle, sawtooth, and sinusoid.
 
 amplitude = waveform amplitude (float ranging from 0.0 to 1.0)
-note = playback speed (int ranging from 0 to 127)"""
+note = playback speed (int ranging from 0 to 127)
 
-rightHand = Forte_CreateDataGloveIO(0, "") # 0 for right-hand, 1 for left-hand
+Run with --benchmark to measure how many haptic calls per second the gloves take before sensor
+reads start to suffer (see benchmark() below). --simulate runs either mode against simulated gloves."""
 
 note = 50
 amplitude = 1
 
-try:
+# driver and options for open_glove(), set from the command line
+driver = 'forte'
+driver_options = {}
 
-    while True:
-    
-        try:
 
-            print("Sending haptic pulse...")
+def pulse_loop():
+
+    rightHand = open_glove(0, driver, note=note, amplitude=amplitude, **driver_options) # 0 for right-hand, 1 for left-hand
+    try:
+
+        while True:
+
+            try:
+
+                print("Sending haptic pulse...")
+
+                rightHand.pulse(range(6), 15)
+
+                sleep(0.1)
+                rightHand.silence()
+                sleep(1)
+
 
-            for x in range(6):
-                Forte_SelectHapticWave(rightHand, x, 15)
-                Forte_SendHaptic(rightHand, x, note, amplitude)
+            except(GloveDisconnectedException):
+                print("Glove is Disconnected")
+                sleep(1)
+                pass
 
+    except(KeyboardInterrupt):
+        rightHand.destroy()
+        exit()
+
+
+# BENCHMARK MODE
+# For every combination of actuator count, wave slot, note and haptic call rate, one thread per
+# glove drives haptics at the target rate while another thread per glove reads the sensors flat
+# out. Each step is compared with a baseline taken without haptics. The results are JSON:
+#   baseline:   sensor read latency and rate per glove with no haptics.
+#   steps:      one entry per combination, with the achieved call rate, latency of each haptic call
+#               type, and sensor read latency/rate and their degradation against the baseline.
+#   saturation: for each actuator/wave/note combination, the highest target rate that still met
+#               the target and kept sensor reads within the allowed degradation, and the first that
+#               didn't (null if none failed).
+
+
+def summarize(values):
+    values = sorted(values)
+    if not values:
+        return None
+    pick = lambda p: values[min(len(values) - 1, int(len(values) * p / 100.0))]
+    return {'n': len(values), 'p50_ms': pick(50) * 1000, 'p99_ms': pick(99) * 1000, 'max_ms': values[-1] * 1000}
+
+
+def read_sensors(glove, running, latencies, errors):
+    """ Read one glove flat out until running is cleared, recording each full read's latency. """
+    while running.is_set():
+        try:
+            start = monotonic()
+            glove.fingers()
+            glove.euler()
+            latencies.append(monotonic() - start)
+        except(GloveDisconnectedException):
+            errors.append(monotonic())
             sleep(0.1)
-            Forte_SilenceHaptics(rightHand)
-            sleep(1)
 
 
+def drive_haptics(glove, running, actuators, wave, pitch, rate, calls):
+    """
+    Pulse actuators 0..actuators-1 with wave and pitch until running is cleared, pacing the
+    individual driver calls at rate per second (0 for flat out). calls collects (name, latency).
+    """
+    period = 1.0 / rate if rate else 0
+    next_call = monotonic()
+    glove.note = pitch
+
+    def call(name, func, *args):
+        if period:
+            delay = next_call - monotonic()
+            if delay > 0:
+                sleep(delay)
+        start = monotonic()
+        try:
+            func(*args)
         except(GloveDisconnectedException):
-            print("Glove is Disconnected")
-            sleep(1)
-            pass
+            calls.append((name + '_error', 0))
+            sleep(0.1)
+            return
+        calls.append((name, monotonic() - start))
+
+    while running.is_set():
+        for i in range(actuators):
+            call('select_wave', glove.select_wave, i, wave)
+            next_call += period
+            call('send_haptic', glove.send_haptic, i)
+            next_call += period
+        call('silence', glove.silence)
+        next_call += period
+        # Don't try to catch up on calls that fell behind, that's the saturation we're measuring.
+        next_call = max(next_call, monotonic())
+
+
+def run_step(gloves, seconds, actuators=None, wave=None, pitch=None, rate=None):
+    """ Run one step for seconds, with haptics if actuators is given. Returns its measurements. """
+    running = threading.Event()
+    running.set()
+    reads = dict((side, deque()) for side in gloves)
+    errors = dict((side, deque()) for side in gloves)
+    calls = dict((side, deque()) for side in gloves)
+    threads = []
+    for side, glove in gloves.items():
+        threads.append(threading.Thread(target=read_sensors, args=(glove, running, reads[side], errors[side])))
+        if actuators:
+            threads.append(threading.Thread(target=drive_haptics,
+                                            args=(glove, running, actuators, wave, pitch, rate, calls[side])))
+    start = monotonic()
+    for thread in threads:
+        thread.start()
+    sleep(seconds)
+    running.clear()
+    for thread in threads:
+        thread.join()
+    elapsed = monotonic() - start
+    if actuators:
+        for glove in gloves.values():
+            try:
+                glove.silence()
+            except(GloveDisconnectedException):
+                pass
+
+    result = {}
+    for side in gloves:
+        entry = {'sensor_read': summarize(reads[side]), 'sensor_hz': len(reads[side]) / elapsed,
+                 'disconnects': len(errors[side])}
+        if actuators:
+            by_name = {}
+            for name, latency in calls[side]:
+                by_name.setdefault(name, []).append(latency)
+            entry['calls_per_s'] = sum(len(v) for k, v in by_name.items() if not k.endswith('_error')) / elapsed
+            entry['call_errors'] = sum(len(v) for k, v in by_name.items() if k.endswith('_error'))
+            entry['calls'] = dict((name, summarize(v)) for name, v in by_name.items() if not name.endswith('_error'))
+        result[side] = entry
+    return result
+
+
+def benchmark(sides, actuator_counts, waves, notes, rates, seconds, max_degradation, min_rate_ratio, out):
+    gloves = {}
+    for side in sides:
+        gloves[side] = open_glove(0 if side == 'right' else 1, driver, note=note, amplitude=amplitude, **driver_options)
+    # pause to allow gloves to finish connecting
+    sleep(5)
+
+    baseline = run_step(gloves, seconds)
+    sys.stderr.write("baseline: " + ", ".join("{} {:.0f} Hz, read p99 {:.2f} ms".format(
+        side, b['sensor_hz'], b['sensor_read']['p99_ms'] if b['sensor_read'] else float('nan'))
+        for side, b in baseline.items()) + "\n")
+
+    steps = []
+    saturation = []
+    for actuators, wave, pitch in itertools.product(actuator_counts, waves, notes):
+        last_ok = None
+        first_bad = None
+        # Flat out (0) is the last and hardest step.
+        for rate in sorted(rates, key=lambda r: r or float('inf')):
+            result = run_step(gloves, seconds, actuators, wave, pitch, rate)
+            ok = True
+            for side, entry in result.items():
+                base = baseline[side]
+                if entry['sensor_read'] and base['sensor_read']:
+                    entry['read_p99_ratio'] = entry['sensor_read']['p99_ms'] / base['sensor_read']['p99_ms']
+                else:
+                    entry['read_p99_ratio'] = None
+                entry['sensor_hz_ratio'] = entry['sensor_hz'] / base['sensor_hz'] if base['sensor_hz'] else None
+                if entry['read_p99_ratio'] is None or entry['read_p99_ratio'] > max_degradation:
+                    ok = False
+                if rate and entry['calls_per_s'] < rate * min_rate_ratio:
+                    ok = False
+            steps.append({'actuators': actuators, 'wave': wave, 'note': pitch, 'target_rate': rate,
+                          'ok': ok, 'gloves': result})
+            sys.stderr.write("actuators {} wave {} note {} rate {}: {}  ".format(actuators, wave, pitch, rate or 'max', 'ok' if ok else 'SATURATED') +
+                             ", ".join("{} {:.0f} calls/s, read p99 x{:.2f}".format(side, e['calls_per_s'], e['read_p99_ratio'] or float('nan'))
+                                       for side, e in result.items()) + "\n")
+            if ok and first_bad is None:
+                last_ok = rate
+            elif not ok and first_bad is None:
+                first_bad = rate
+                break
+        saturation.append({'actuators': actuators, 'wave': wave, 'note': pitch,
+                           'max_ok_rate': last_ok, 'saturated_at': first_bad})
+
+    json.dump({'gloves': sorted(sides), 'step_seconds': seconds, 'max_degradation': max_degradation,
+               'min_rate_ratio': min_rate_ratio, 'baseline': baseline, 'steps': steps,
+               'saturation': saturation}, out, indent=2)
+    out.write("\n")
+    for glove in gloves.values():
+        glove.destroy()
+
+
+def int_list(text):
+    """ Parse "1,3,6" or ranges like "0-15". """
+    values = []
+    for part in text.split(','):
+        low, _, high = part.partition('-')
+        values.extend(range(int(low), int(high or low) + 1))
+    return values
+
+
+if __name__ == "__main__":
+
+    parser = argparse.ArgumentParser(description="Pulse the haptics, or with --benchmark, find the haptic call rate the gloves can take.")
+    parser.add_argument('--benchmark', action='store_true', help='sweep haptic load while sampling sensors')
+    parser.add_argument('--gloves', choices=('right', 'left', 'both'), default='right')
+    parser.add_argument('--actuators', type=int_list, default=[1, 6], help='actuator counts to sweep, e.g. 1,3,6')
+    parser.add_argument('--waves', type=int_list, default=[15], help='wave slots to sweep, e.g. 0-15')
+    parser.add_argument('--notes', type=int_list, default=[50], help='notes to sweep, e.g. 20,50,100')
+    parser.add_argument('--rates', type=int_list, default=[20, 50, 100, 200, 500, 0],
+                        help='target haptic calls per second per glove, 0 for as fast as possible')
+    parser.add_argument('--seconds', type=float, default=3, help='length of each step')
+    parser.add_argument('--max-degradation', type=float, default=2.0,
+                        help='largest acceptable ratio of sensor read p99 to the baseline')
+    parser.add_argument('--min-rate-ratio', type=float, default=0.9,
+                        help='fraction of the target call rate that must be achieved')
+    parser.add_argument('--output', help='write the JSON results here instead of stdout')
+    parser.add_argument('--simulate', type=float, metavar='HZ',
+                        help='use simulated gloves that produce HZ samples per second instead of the Bebop gloves')
+    args = parser.parse_args()
+
+    if args.simulate:
+        driver = 'simulated'
+        driver_options = {'rate': args.simulate}
 
-except(KeyboardInterrupt):
-    Forte_DestroyDataGloveIO(rightHand)
-    exit()
+    if not args.benchmark:
+        pulse_loop()
 
+    sides = ('left', 'right') if args.gloves == 'both' else (args.gloves,)
+    out = open(args.output, 'w') if args.output else sys.stdout
+    benchmark(sides, args.actuators, args.waves, args.notes, args.rates, args.seconds,
+              args.max_degradation, args.min_rate_ratio, out)
@@ -0,0 +1,264 @@
+"""Offline tuning of the gesture thresholds used by HEDO.py.
+
+Loads labelled glove recordings and sweeps grids of threshold values with NumPy broadcasting, so every
+sample is classified under every combination of thresholds at once. Prints the confusion matrix and
+per-gesture precision/recall for the best setting, the Pareto-optimal settings, and can export the
+chosen thresholds as JSON for HEDO.py (set thresholds_file there).
+
+Recordings are .npz files with:
+    frames: float array (samples, 16), laid out like HEDO.frame_to_array: left fingers 0-4,
+            right fingers 5-9, left Euler angles 10-12, right Euler angles 13-15.
+    left_labels, right_labels: string arrays (samples,) naming the gesture each hand was making,
+            '' for none.
+
+Example:
+    python tune_thresholds.py flight1.npz flight2.npz --side right \\
+        --sweep bent=0.18:0.30:13 --sweep flat=0.05:0.12:8 --sweep flat_roll[0]=-30:-5:6 \\
+        --export thresholds.json
+
+Before sweeping, the vectorized classifier is checked against HEDO.classify_hand on the starting
+thresholds, so the two can't drift apart unnoticed.
+"""
+
+import argparse
+import copy
+import json
+import os
+import sys
+from time import perf_counter
+
+import numpy as np
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+from HEDO import GESTURE_THRESHOLDS, classify_hand, load_thresholds
+
+# Class 0 is "no gesture". The order of the rest doesn't matter, HEDO.classify_hand's priority is
+# reproduced in classify() and checked by check_against_hedo().
+GESTURES = ['', 'THUMBS UP', 'PEACE', 'GO BULLS', 'HALT', 'LAND']
+
+# Sample x combination cells classified per batch, which bounds memory use to a few hundred MB.
+CHUNK_CELLS = 1 << 22
+
+
+def load_recordings(paths, side):
+    """ Return the finger (samples, 5) and Euler angle (samples, 3) arrays and label codes for one hand. """
+    fingers, imu, labels = [], [], []
+    first = 0 if side == 'left' else 5
+    angles = 10 if side == 'left' else 13
+    for path in paths:
+        data = np.load(path)
+        frames = data['frames']
+        fingers.append(frames[:, first:first + 5])
+        imu.append(frames[:, angles:angles + 3])
+        labels.append(data[side + '_labels'])
+    labels = np.concatenate(labels)
+    unknown = set(labels) - set(GESTURES)
+    if unknown:
+        sys.exit('Unknown gesture labels: {}'.format(', '.join(sorted(unknown))))
+    codes = np.array([GESTURES.index(label) for label in labels], dtype=np.int64)
+    return np.round(np.concatenate(fingers), 4), np.concatenate(imu), codes
+
+
+def parse_sweep(spec):
+    """ Parse name=start:stop:count (or name[i]=... for one end of a window) into (name, index, values). """
+    name, _, values = spec.partition('=')
+    index = None
+    if name.endswith(']'):
+        name, _, index = name[:-1].partition('[')
+        index = int(index)
+    start, stop, count = values.split(':')
+    return name, index, np.linspace(float(start), float(stop), int(count))
+
+
+def build_grid(base, sweeps):
+    """
+    Broadcast the swept values against each other.
+    Returns:
+        dict: every swept setting as an array of shape (combinations, 1), window settings as a
+            pair of such arrays. Settings that aren't swept have shape (1, 1), so their tests are
+            only evaluated once per sample.
+    """
+    grids = np.meshgrid(*[values for _, _, values in sweeps], indexing='ij') if sweeps else []
+    count = grids[0].size if sweeps else 1
+    params = {}
+    for key, value in base.items():
+        if isinstance(value, (tuple, list)):
+            params[key] = [np.full((1, 1), float(v)) for v in value]
+        else:
+            params[key] = np.full((1, 1), float(value))
+    for (name, index, _), grid in zip(sweeps, grids):
+        if index is None:
+            params[name] = grid.reshape(count, 1)
+        else:
+            params[name][index] = grid.reshape(count, 1)
+    return params, count
+
+
+def classify(fingers, imu, p, lo=0, hi=None):
+    """ Classify every sample under combinations lo:hi of the grid p. Returns codes (combinations, samples). """
+    def sl(value):
+        return value if len(value) == 1 else value[lo:hi]
+
+    thumb, index, middle, ring, pinky = (fingers[:, i] for i in range(5))
+    X = imu[:, 2]
+    Y = imu[:, 0]
+    # Reduce each gesture's finger tests to one value per sample, so each test against the grid is
+    # a single broadcast comparison.
+    thumb_tucked = np.minimum(np.minimum(index, middle), np.minimum(ring, pinky)) - thumb
+    peace_split = np.minimum(ring - middle, pinky - index)
+    bulls_split = np.minimum(middle - index, ring - pinky)
+    bulls_straight = np.maximum(index, pinky)
+    fist_curl = np.minimum(index, middle)
+    hand = fingers.sum(axis=1)
+    flatness = fingers.max(axis=1)
+
+    bent = sl(p['bent'])
+    roll = sl(p['thumbs_up_roll'])
+    palm_away = ((sl(p['palm_away_pitch'][0]) <= X) & (X <= sl(p['palm_away_pitch'][1])) &
+                 (sl(p['palm_away_roll'][0]) <= Y) & (Y <= sl(p['palm_away_roll'][1])))
+
+    thumbs_up = (thumb_tucked >= bent) & np.where(roll > 0, Y >= roll, Y <= roll)
+    peace = (peace_split >= bent) & (thumb >= sl(p['peace_thumb']))
+    go_bulls = (bulls_split >= bent) & (bulls_straight <= bent) & palm_away
+    halt = (thumb >= sl(p['fist_thumb'])) & (fist_curl >= bent) & (hand >= sl(p['fist_total'])) & palm_away
+    land = ((flatness <= sl(p['flat'])) &
+            (sl(p['flat_pitch'][0]) <= X) & (X <= sl(p['flat_pitch'][1])) &
+            (sl(p['flat_roll'][0]) <= Y) & (Y <= sl(p['flat_roll'][1])))
+
+    # Lowest priority first, so the earlier tests in classify_hand overwrite the later ones.
+    masks = [(5, land), (4, halt), (3, go_bulls), (2, peace), (1, thumbs_up)]
+    codes = np.zeros((max(mask.shape[0] for _, mask in masks), len(thumb)), dtype=np.int8)
+    for code, mask in masks:
+        codes[np.broadcast_to(mask, codes.shape)] = code
+    return codes
+
+
+def check_against_hedo(fingers, imu, side, base, samples):
+    """ Compare classify() with HEDO.classify_hand under base on about samples samples, and exit on any difference. """
+    step = max(1, len(fingers) // samples)
+    fingers, imu = fingers[::step], imu[::step]
+    params, _ = build_grid(base, [])
+    codes = classify(fingers, imu, params)[0]
+    expected = [GESTURES.index(classify_hand(f, a, side) or '') for f, a in zip(fingers.tolist(), imu.tolist())]
+    mismatches = np.flatnonzero(codes != np.array(expected))
+    if len(mismatches):
+        i = mismatches[0]
+        sys.exit('classify() disagrees with HEDO.classify_hand on {} of {} samples, first on fingers {} angles {}: '
+                 '{!r} against {!r}'.format(len(mismatches), len(codes), fingers[i].tolist(), imu[i].tolist(),
+                                            GESTURES[codes[i]], GESTURES[expected[i]]))
+    print('classify() agrees with HEDO.classify_hand on {} samples'.format(len(codes)))
+
+
+def confusion_matrices(fingers, imu, labels, params, count):
+    """ Return confusion matrices of shape (combinations, true class, predicted class). """
+    n = len(GESTURES)
+    matrices = np.zeros((count, n, n), dtype=np.int64)
+    chunk = max(1, CHUNK_CELLS // len(labels))
+    for lo in range(0, count, chunk):
+        hi = min(lo + chunk, count)
+        codes = classify(fingers, imu, params, lo, hi)
+        # One bincount for the whole chunk: each combination gets its own block of n * n bins.
+        flat = (np.arange(hi - lo)[:, None] * n * n + labels[None, :] * n + codes).ravel()
+        matrices[lo:hi] = np.bincount(flat, minlength=(hi - lo) * n * n).reshape(hi - lo, n, n)
+    return matrices
+
+
+def precision_recall(matrices):
+    """ Per-gesture precision and recall, shape (combinations, gestures), leaving out "no gesture". """
+    true_pos = np.diagonal(matrices, axis1=1, axis2=2)[:, 1:].astype(float)
+    predicted = matrices.sum(axis=1)[:, 1:]
+    actual = matrices.sum(axis=2)[:, 1:]
+    with np.errstate(invalid='ignore', divide='ignore'):
+        precision = np.where(predicted > 0, true_pos / predicted, 1.0)
+        recall = np.where(actual > 0, true_pos / actual, np.nan)
+    return precision, recall
+
+
+def pareto_front(precision, recall):
+    """ Indices of the combinations no other combination beats on both mean precision and mean recall. """
+    mean_p = precision.mean(axis=1)
+    mean_r = np.nanmean(recall, axis=1)
+    order = np.lexsort((-mean_r, -mean_p))
+    front = []
+    best_recall = -np.inf
+    for i in order:
+        if mean_r[i] > best_recall:
+            front.append(i)
+            best_recall = mean_r[i]
+    return front, mean_p, mean_r
+
+
+def settings_at(params, base, sweeps, i):
+    settings = copy.deepcopy(base)
+    for name, index, _ in sweeps:
+        if index is None:
+            settings[name] = round(float(params[name][i, 0]), 6)
+        else:
+            window = list(settings[name])
+            window[index] = round(float(params[name][index][i, 0]), 6)
+            settings[name] = window
+    return settings
+
+
+def print_report(matrix, precision, recall):
+    width = max(len(g) for g in GESTURES) + 1
+    names = [g or 'none' for g in GESTURES]
+    print('true \\ predicted'.ljust(width) + ''.join(n.rjust(width) for n in names))
+    for name, row in zip(names, matrix):
+        print(name.ljust(width) + ''.join(str(v).rjust(width) for v in row))
+    print()
+    for name, p, r in zip(names[1:], precision, recall):
+        print('{}precision {:.3f}  recall {:.3f}'.format(name.ljust(width), p, r))
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('recordings', nargs='+', help='.npz glove recordings')
+    parser.add_argument('--side', choices=('left', 'right'), required=True)
+    parser.add_argument('--base', help='JSON thresholds to start from instead of the built-in ones')
+    parser.add_argument('--sweep', action='append', default=[], metavar='NAME=START:STOP:COUNT',
+                        help='setting to sweep, NAME[0] or NAME[1] for one end of a window')
+    parser.add_argument('--export', help='write the best thresholds for both hands to this JSON file')
+    parser.add_argument('--check', type=int, default=10000, help='samples to check against HEDO.classify_hand')
+    args = parser.parse_args()
+
+    # HEDO's thresholds, as HEDO.py would load them, are used where a setting isn't swept.
+    if args.base:
+        load_thresholds(args.base)
+    thresholds = copy.deepcopy(GESTURE_THRESHOLDS)
+    base = thresholds[args.side]
+
+    fingers, imu, labels = load_recordings(args.recordings, args.side)
+    check_against_hedo(fingers, imu, args.side, base, args.check)
+    sweeps = [parse_sweep(spec) for spec in args.sweep]
+    params, count = build_grid(base, sweeps)
+
+    start = perf_counter()
+    matrices = confusion_matrices(fingers, imu, labels, params, count)
+    elapsed = perf_counter() - start
+    print('{} samples x {} combinations in {:.2f}s ({:.1f}M sample-combinations/s)\n'.format(
+        len(labels), count, elapsed, len(labels) * count / elapsed / 1e6))
+
+    precision, recall = precision_recall(matrices)
+    front, mean_p, mean_r = pareto_front(precision, recall)
+    with np.errstate(invalid='ignore'):
+        f1 = 2 * mean_p * mean_r / (mean_p + mean_r)
+    best = max(front, key=lambda i: f1[i])
+
+    print('Pareto-optimal settings (mean precision, mean recall):')
+    for i in front:
+        marker = '*' if i == best else ' '
+        print('{} {:.3f} {:.3f}  {}'.format(marker, mean_p[i], mean_r[i],
+                                            json.dumps(settings_at(params, base, sweeps, i))))
+    print('\nBest by F1:')
+    print_report(matrices[best], precision[best], recall[best])
+
+    if args.export:
+        thresholds[args.side] = settings_at(params, base, sweeps, best)
+        with open(args.export, 'w') as f:
+            json.dump(thresholds, f, indent=4)
+        print('\nWrote {}'.format(args.export))
+
+
+if __name__ == '__main__':
+    main()
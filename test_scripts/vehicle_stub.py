@@ -0,0 +1,196 @@
+"""A stand-in for a Skydio vehicle's HTTP API, for the benchmarks in this directory.
+
+Answers every endpoint HEDO.py uses with canned JSON from a local port. The knobs are attributes
+of StubVehicle and can be changed while requests are in flight:
+    phase:          flight phase reported by status. A ground_takeoff command makes it FLYING
+                    after takeoff_seconds, a land command makes it REST after land_seconds.
+                    A land on the ground is ignored, as a real vehicle does.
+    slow_fraction:  fraction of replies delayed by slow_seconds.
+    errors:         HTTP status codes to answer the next requests with, one each.
+    truncate:       number of upcoming replies to cut off halfway through a chunked body.
+    faults:         blocking fault names reported by active_faults.
+    status_padding: extra config entries in status replies, about 330 bytes each, to make them
+                    as large as a real vehicle's.
+custom_comms replies with the payload reversed. For the skills in framed_skills the payload is a
+batch (see HEDO.CustomCommsBatcher), and every framed message that wants a reply gets its own
+reversed. requests counts the requests to each endpoint.
+
+Run on its own to point HEDO.py's vehicle_urls at it:
+    python vehicle_stub.py --port 8080
+"""
+
+import argparse
+import base64
+import json
+import os
+import random
+import sys
+import threading
+from collections import Counter, deque
+from time import monotonic, sleep
+
+try:
+    from http.server import BaseHTTPRequestHandler, HTTPServer
+    from socketserver import ThreadingMixIn
+except ImportError:
+    from BaseHTTPServer import BaseHTTPRequestHandler, HTTPServer
+    from SocketServer import ThreadingMixIn
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+from HEDO import COMMS_FRAME_HEADER, COMMS_FLAG_NO_RESPONSE, COMMS_REPLY_HEADER
+
+
+class _Server(ThreadingMixIn, HTTPServer):
+    daemon_threads = True
+
+
+class _Handler(BaseHTTPRequestHandler):
+    protocol_version = 'HTTP/1.1'
+    # Headers and body are separate writes, which Nagle would hold up on a kept-alive connection.
+    disable_nagle_algorithm = True
+
+    def log_message(self, *args):
+        pass
+
+    def do_GET(self):
+        self.do_POST()
+
+    def do_POST(self):
+        vehicle = self.server.vehicle
+        length = int(self.headers.get('Content-Length') or 0)
+        body = json.loads(self.rfile.read(length) or b'{}')
+        endpoint = self.path[len('/api/'):]
+        vehicle.requests[endpoint.split('/')[0]] += 1
+
+        if vehicle.slow_fraction and random.random() < vehicle.slow_fraction:
+            sleep(vehicle.slow_seconds)
+        try:
+            code = vehicle.errors.popleft()
+        except IndexError:
+            code = 200
+        if code != 200:
+            self._reply(code, {'error': 'stub error'})
+            return
+        self._reply(200, {'data': vehicle.respond(endpoint, body)})
+
+    def _reply(self, code, payload):
+        out = json.dumps(payload).encode()
+        vehicle = self.server.vehicle
+        truncate = False
+        with vehicle.lock:
+            if vehicle.truncate > 0:
+                vehicle.truncate -= 1
+                truncate = True
+        self.send_response(code)
+        self.send_header('Content-Type', 'application/json')
+        if truncate:
+            # Promise the whole body in one chunk, send half of it and hang up.
+            self.send_header('Transfer-Encoding', 'chunked')
+            self.end_headers()
+            self.wfile.write('{:x}\r\n'.format(len(out)).encode() + out[:len(out) // 2])
+            self.wfile.flush()
+            self.close_connection = True
+            return
+        self.send_header('Content-Length', str(len(out)))
+        self.end_headers()
+        self.wfile.write(out)
+
+
+class StubVehicle(object):
+    """
+    A local fake vehicle, serving from a background thread as soon as it is created.
+    Args:
+        port (int): port to listen on, 0 for any free one.
+        phase (str): initial flight phase.
+        takeoff_seconds (float): time from a ground_takeoff command to FLYING.
+        land_seconds (float): time from a land command to REST.
+    """
+
+    def __init__(self, port=0, phase='READY_FOR_GROUND_TAKEOFF', takeoff_seconds=1.0, land_seconds=1.0):
+        self.phase = phase
+        self.takeoff_seconds = takeoff_seconds
+        self.land_seconds = land_seconds
+        self.slow_fraction = 0.0
+        self.slow_seconds = 1.0
+        self.errors = deque()
+        self.truncate = 0
+        self.faults = []
+        self.status_padding = 0
+        self.framed_skills = set(['framed'])
+        self.requests = Counter()
+        self.lock = threading.Lock()
+        self._next_phase = None
+        self._server = _Server(('127.0.0.1', port), _Handler)
+        self._server.vehicle = self
+        thread = threading.Thread(target=self._server.serve_forever)
+        thread.daemon = True
+        thread.start()
+
+    @property
+    def url(self):
+        return 'http://127.0.0.1:{}'.format(self._server.server_address[1])
+
+    def close(self):
+        self._server.shutdown()
+        self._server.server_close()
+
+    def current_phase(self):
+        with self.lock:
+            if self._next_phase and monotonic() >= self._next_phase[0]:
+                self.phase = self._next_phase[1]
+                self._next_phase = None
+            return self.phase
+
+    def respond(self, endpoint, body):
+        """ The 'data' of the reply to a request for endpoint with JSON body. """
+        key = endpoint.split('/')[0]
+        if key == 'async_command':
+            with self.lock:
+                if body.get('command') == 'ground_takeoff' and not self._next_phase:
+                    self._next_phase = (monotonic() + self.takeoff_seconds, 'FLYING')
+                elif body.get('command') == 'land' and (self._next_phase[1] == 'FLYING' if self._next_phase
+                                                        else self.phase == 'FLYING'):
+                    self._next_phase = (monotonic() + self.land_seconds, 'REST')
+            return {}
+        if key == 'active_faults':
+            return {'faults': dict((str(i), {'name': name, 'relevant': True}) for i, name in enumerate(self.faults))}
+        if key == 'custom_comms':
+            payload = base64.b64decode(body['data'])
+            reply = self._echo(payload) if body.get('skill_key') in self.framed_skills else payload[::-1]
+            return {'data': base64.b64encode(reply).decode('ascii')}
+        data = {
+            'accessLevel': 'PILOT',
+            'accessToken': 'stub-token',
+            'sessionId': 'stub-session',
+            'flightPhase': self.current_phase(),
+            'config': {'lcmProxyUdpHostname': '127.0.0.1', 'lcmProxyUdpPort': 55005},
+        }
+        for i in range(self.status_padding):
+            data['config']['stub_{}'.format(i)] = {'values': list(range(40)), 'name': 'padding entry {}'.format(i)}
+        return data
+
+    def _echo(self, raw):
+        replies = []
+        offset = 0
+        while offset < len(raw):
+            length, flags = COMMS_FRAME_HEADER.unpack_from(raw, offset)
+            offset += COMMS_FRAME_HEADER.size
+            message = raw[offset:offset + length]
+            offset += length
+            if not flags & COMMS_FLAG_NO_RESPONSE:
+                replies.append(COMMS_REPLY_HEADER.pack(len(message)) + message[::-1])
+        return b''.join(replies)
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Serve a fake vehicle API.')
+    parser.add_argument('--port', type=int, default=8080)
+    parser.add_argument('--phase', default='READY_FOR_GROUND_TAKEOFF')
+    args = parser.parse_args()
+    vehicle = StubVehicle(args.port, args.phase)
+    print('Serving a stub vehicle at {}'.format(vehicle.url))
+    try:
+        while True:
+            sleep(1)
+    except KeyboardInterrupt:
+        vehicle.close()